@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+# Compares native arrays against the variable-per-element workaround
+# (x0, x1, x2, ...) for filling and summing N values.
+#
+#   python3 bench/bench_arrays.py [N]
+
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, __file__.rsplit('/', 2)[0])
+
+from pseudo.__main__ import parse_file
+
+def variables_source(n):
+    lines = ["PROGRAM main", "BEGIN"]
+    lines += ["    x{0} <- {0}".format(i) for i in range(n)]
+    lines += ["    total <- 0"]
+    lines += ["    total <- total + x{}".format(i) for i in range(n)]
+    lines += ["    OUTPUT total", "END"]
+    return "\n".join(lines)
+
+def array_loop_source(n):
+    return "\n".join([
+        "PROGRAM main",
+        "BEGIN",
+        "    xs <- array({}, 0)".format(n),
+        "    FOR i <- 0 TO {}".format(n - 1),
+        "        xs[i] <- i",
+        "    NEXT",
+        "    total <- 0",
+        "    FOR i <- 0 TO {}".format(n - 1),
+        "        total <- total + xs[i]",
+        "    NEXT",
+        "    OUTPUT total",
+        "END"
+    ])
+
+def array_native_source(n):
+    return "\n".join([
+        "PROGRAM main",
+        "BEGIN",
+        "    xs <- array({}, 0)".format(n),
+        "    FOR i <- 0 TO {}".format(n - 1),
+        "        xs[i] <- i",
+        "    NEXT",
+        "    OUTPUT sum(xs)",
+        "END"
+    ])
+
+def run(name, source):
+    out = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(out):
+        parse_file(io.StringIO(source), None)
+    elapsed = time.perf_counter() - start
+    print("{:<24} {:>9.3f}s  -> {}".format(name, elapsed, out.getvalue().strip()))
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    print("N = {}".format(n))
+    run("variable per element", variables_source(n))
+    run("array, pseudo loop sum", array_loop_source(n))
+    run("array, native sum()", array_native_source(n))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Runs many interactive sessions on one event loop. Each session asks for
+# numbers until it is sent 0 while a busy loop in it counts; the input for
+# all sessions is fed in rounds, as if from as many clients. Also compares a
+# single run with run() and arun().
+#
+#   python3 bench/bench_async.py [SESSIONS]
+
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, __file__.rsplit('/', 2)[0])
+
+import pseudo
+from pseudo.stream import QueueInput, AsyncSink
+
+SOURCE = """
+PROGRAM main
+BEGIN
+    total <- 0
+    INPUT NUMBER n
+    WHILE n != 0
+        FOR i <- 1 TO 200
+            total <- total + n
+        NEXT
+        INPUT NUMBER n
+    REPEAT
+    OUTPUT total
+END
+"""
+
+ROUNDS = 10
+
+async def sessions(unit, count):
+    written = []
+
+    async def send(text):
+        written.append(text)
+
+    inputs = [QueueInput() for _ in range(count)]
+    runs = [asyncio.ensure_future(unit.arun(inputs=source, output=AsyncSink(send))) for source in inputs]
+
+    for value in ['1'] * ROUNDS + ['0']:
+        for source in inputs:
+            source.feed(value)
+        await asyncio.sleep(0)
+
+    return await asyncio.gather(*runs), written
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    unit = pseudo.compile_source(SOURCE)
+    lines = ['1'] * ROUNDS + ['0']
+
+    start = time.perf_counter()
+    for _ in range(20):
+        unit.run(inputs=lines)
+    print("{:<24} {:>8.2f} ms per run".format("run()", (time.perf_counter() - start) / 20 * 1000))
+
+    start = time.perf_counter()
+    for _ in range(20):
+        asyncio.run(unit.arun(inputs=lines))
+    print("{:<24} {:>8.2f} ms per run".format("arun()", (time.perf_counter() - start) / 20 * 1000))
+
+    start = time.perf_counter()
+    results, written = asyncio.run(sessions(unit, count))
+    elapsed = time.perf_counter() - start
+    assert all(res.ok for res in results) and len(written) == count
+
+    print("{:<24} {:>8.2f} s, {:.2f} ms per session".format("{} sessions".format(count),
+            elapsed, elapsed / count * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Runs a generated payroll calculation over N employees with float,
+# fixed point and decimal.Decimal numbers, taking the best of a few runs.
+#
+#   python3 bench/bench_fixed.py [EMPLOYEES]
+
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+from decimal import Decimal
+
+sys.path.insert(0, __file__.rsplit('/', 2)[0])
+
+from pseudo.__main__ import parse_file
+from pseudo.types import fixed_kind
+
+SOURCE = """
+MODULE Pay
+PARAM rate
+PARAM hours
+BEGIN
+    overtime <- hours - 38
+    IF overtime > 0
+        RETURN (38 * rate) + (overtime * rate * 1.5)
+    END IF
+    RETURN hours * rate
+END
+
+PROGRAM Payroll
+BEGIN
+    rates <- [15.25, 18.40, 22.75, 31.10, 27.05]
+    hours <- [38.5, 40.25, 12.75, 45.0, 38.0, 20.5, 41.75]
+    r <- 0
+    h <- 0
+    total <- 0.00
+    FOR employee <- 1 TO {employees}
+        total <- total + Pay(rates[r], hours[h])
+        r <- r + 1
+        IF r = 5
+            r <- 0
+        END IF
+        h <- h + 1
+        IF h = 7
+            h <- 0
+        END IF
+    NEXT
+    OUTPUT "Total pay: $", total
+END
+"""
+
+REPEAT = 3
+
+def run(name, employees, number):
+    elapsed = None
+    for _ in range(REPEAT):
+        out = io.StringIO()
+        start = time.perf_counter()
+        with redirect_stdout(out):
+            parse_file(io.StringIO(SOURCE.format(employees=employees)), None, number)
+        took = time.perf_counter() - start
+        elapsed = took if elapsed is None else min(elapsed, took)
+
+    print("{:<16} {:>9.3f}s  -> {}".format(name, elapsed, out.getvalue().strip()))
+
+def main():
+    employees = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    print("{} employees".format(employees))
+    run("float", employees, float)
+    run("fixed (2 places)", employees, fixed_kind(2))
+    run("decimal.Decimal", employees, Decimal)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+# Measures what the tracing hooks cost an untraced run. The same program runs
+# as parsed in a plain Context (what `pseudo FILE` does) and as the traced
+# variant in a plain Context, where every assignment and condition still goes
+# through trace_var/trace_conditional but nothing is recorded. The second
+# line is what untraced runs paid before the variants were split.
+#
+#   python3 bench/bench_hooks.py [ITERATIONS] [REPEATS]
+
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, __file__.rsplit('/', 2)[0])
+
+from pseudo.token import FileTokeniser
+from pseudo.context import Context
+from pseudo.code import traced
+from pseudo.__main__ import parse
+
+SOURCE = """
+PROGRAM main
+BEGIN
+    a <- 0
+    b <- 0
+    FOR i <- 1 TO {iterations}
+        a <- a + 3
+        IF a > 100
+            a <- a - 100
+            b <- b + 1
+        END IF
+    NEXT
+    OUTPUT a, b
+END
+"""
+
+class HookedContext(Context):
+    def prepare(self, node):
+        return traced(node)
+
+def run(ctx_class, iterations):
+    ctx = ctx_class()
+    with redirect_stdout(io.StringIO()):
+        parse(FileTokeniser(io.StringIO(SOURCE.format(iterations=iterations))), ctx)
+        prog = ctx.get_program('main')
+
+        start = time.perf_counter()
+        prog.eval(ctx)
+        return time.perf_counter() - start
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    # alternate the two so that machine noise hits both alike
+    plain = hooked = float('inf')
+    for _ in range(repeats):
+        plain = min(plain, run(Context, iterations))
+        hooked = min(hooked, run(HookedContext, iterations))
+
+    print("{} iterations, best of {}".format(iterations, repeats))
+    print("{:<26} {:>8.3f}s".format("untraced tree", plain))
+    print("{:<26} {:>8.3f}s  ({:+.1%})".format("traced tree, no recording", hooked, hooked / plain - 1))
+
+if __name__ == "__main__":
+    main()
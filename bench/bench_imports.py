@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# Times compiling and running a program that uses one module of a large
+# library, with the library pasted into the program and with it imported:
+# the first import in a process parses the library when the module is first
+# called, later ones reuse it.
+#
+#   python3 bench/bench_imports.py [MODULES]
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, __file__.rsplit('/', 2)[0])
+
+import pseudo
+
+MODULE = """
+MODULE Step%d
+PARAM n
+BEGIN
+    total <- 0
+    FOR i <- 1 TO n
+        total <- total + i * %d
+    NEXT
+    RETURN total
+END
+"""
+
+MAIN = """
+PROGRAM main
+BEGIN
+    OUTPUT Step0(10)
+END
+"""
+
+def timed(source, name):
+    start = time.perf_counter()
+    res = pseudo.compile_source(source, name).run()
+    elapsed = time.perf_counter() - start
+
+    assert res.ok, res.error
+    return res.output, elapsed
+
+def main():
+    modules = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    library = "".join(MODULE % (k, k + 1) for k in range(modules))
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'lib.psc'), 'w') as fp:
+            fp.write(library)
+
+        name = os.path.join(directory, 'main.psc')
+        expected, pasted = timed(library + MAIN, name)
+        output, first = timed('IMPORT "lib.psc"\n' + MAIN, name)
+        assert output == expected
+        output, again = timed('IMPORT "lib.psc"\n' + MAIN, name)
+        assert output == expected
+
+    print("{} modules".format(modules))
+    print("pasted        {:>8.3f}s".format(pasted))
+    print("first import  {:>8.3f}s".format(first))
+    print("imported      {:>8.3f}s  x{:.0f}".format(again, pasted / again))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+# Times parsing a file of many modules in full against applying one-character
+# edits to it as an editor would, and checks that the edited document ends up
+# with the same errors as parsing its text from scratch.
+#
+#   python3 bench/bench_incremental.py [MODULES]
+
+import sys
+import time
+
+sys.path.insert(0, __file__.rsplit('/', 2)[0])
+
+from pseudo.incremental import Document
+
+MODULE = """
+MODULE Step%d
+PARAM n
+BEGIN
+    total <- 0
+    FOR i <- 1 TO n
+        IF i > %d THEN
+            total <- total + i
+        ELSE
+            total <- total - 1
+        END IF
+    NEXT
+    RETURN total
+END
+"""
+
+def main():
+    modules = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    text = "".join(MODULE % (k, k) for k in range(modules))
+
+    start = time.perf_counter()
+    doc = Document(text)
+    full = time.perf_counter() - start
+
+    # type and delete a character in the middle of the file, breaking and
+    # fixing a module each time
+    row = len(doc.lines) // 2
+    while not doc.lines[row-1].strip().startswith('total <-'):
+        row += 1
+
+    edits = 50
+    start = time.perf_counter()
+    for _ in range(edits):
+        doc.edit((row, 5), (row, 5), '(')
+        assert doc.diagnostics()
+        doc.edit((row, 5), (row, 6), '')
+        assert not doc.diagnostics()
+    edit = (time.perf_counter() - start) / (edits * 2)
+
+    assert doc.diagnostics() == Document(doc.text).diagnostics()
+
+    print("{} lines, {} modules".format(len(doc.lines), modules))
+    print("full parse  {:>9.4f}s".format(full))
+    print("edit        {:>9.4f}s  x{:.0f}".format(edit, full / edit))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# Compares a 1,000-branch IF ... ELSE IF lookup module against a MAP lookup,
+# looking up every key once.
+#
+#   python3 bench/bench_maps.py [BRANCHES] [LOOKUPS]
+
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, __file__.rsplit('/', 2)[0])
+
+from pseudo.__main__ import parse_file
+
+def chain_source(branches, lookups):
+    lines = ["MODULE lookup", "PARAM x", "BEGIN"]
+    lines.append("    IF x = 0")
+    lines.append("        RETURN 'v0'")
+    for i in range(1, branches):
+        lines.append("    ELSE IF x = {}".format(i))
+        lines.append("        RETURN 'v{}'".format(i))
+    lines += ["    ELSE", "        RETURN ''", "    END IF", "END", ""]
+
+    lines += [
+        "PROGRAM main",
+        "BEGIN",
+        "    last <- ''",
+        "    FOR n <- 1 TO {}".format(lookups),
+        "        last <- lookup(n - 1)",
+        "    NEXT",
+        "    OUTPUT last",
+        "END"
+    ]
+    return "\n".join(lines)
+
+def map_source(branches, lookups):
+    entries = ", ".join("{0}: 'v{0}'".format(i) for i in range(branches))
+    return "\n".join([
+        "PROGRAM main",
+        "BEGIN",
+        "    table <- {{{}}}".format(entries),
+        "    last <- ''",
+        "    FOR n <- 1 TO {}".format(lookups),
+        "        last <- table[n - 1]",
+        "    NEXT",
+        "    OUTPUT last",
+        "END"
+    ])
+
+def run(name, source):
+    out = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(out):
+        parse_file(io.StringIO(source), None)
+    elapsed = time.perf_counter() - start
+    print("{:<20} {:>9.3f}s  -> {}".format(name, elapsed, out.getvalue().strip()))
+
+def main():
+    branches = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else branches
+
+    # nested ELSE IF chains are parsed and evaluated recursively
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), branches * 20))
+
+    print("{} branches, {} lookups".format(branches, lookups))
+    run("ELSE IF chain", chain_source(branches, lookups))
+    run("MAP lookup", map_source(branches, lookups))
+
+if __name__ == "__main__":
+    main()
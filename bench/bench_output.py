@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+# Measures an OUTPUT-heavy program with each output sink. The stdout sink
+# writes to a real file so that the cost of the writes themselves shows.
+#
+#   python3 bench/bench_output.py [LINES]
+
+import io
+import sys
+import time
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, __file__.rsplit('/', 2)[0])
+
+from pseudo.__main__ import parse_file
+from pseudo.context import RunState
+from pseudo.stream import StreamSink, BufferSink, NullSink
+
+SOURCE = """
+PROGRAM main
+BEGIN
+    FOR i <- 1 TO {lines}
+        OUTPUT "line", i, i * 2
+    NEXT
+END
+"""
+
+def run(name, lines, output=None):
+    with tempfile.TemporaryFile('w') as fp, redirect_stdout(fp):
+        start = time.perf_counter()
+        parse_file(io.StringIO(SOURCE.format(lines=lines)), None, state=RunState(output=output))
+        elapsed = time.perf_counter() - start
+
+    print("{:<10} {:>8.3f}s".format(name, elapsed))
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    print("{} lines".format(lines))
+    run("stdout", lines)
+    with tempfile.TemporaryFile('w') as fp:
+        run("file", lines, StreamSink(fp))
+    run("buffer", lines, BufferSink())
+    run("null", lines, NullSink())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+# Times a PARALLEL FOR whose iterations each call a pure module and output a
+# line, with 1, 2, 4, ... worker processes up to the number of cores, and
+# checks that every run writes the same output.
+#
+#   python3 bench/bench_parallel.py [ITERATIONS]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, __file__.rsplit('/', 2)[0])
+
+import pseudo
+
+SOURCE = """
+MODULE Collatz
+PARAM n
+BEGIN
+    steps <- 0
+    WHILE n != 1
+        IF n - floor(n / 2) * 2 = 0
+            n <- n / 2
+        ELSE
+            n <- 3 * n + 1
+        END IF
+        steps <- steps + 1
+    REPEAT
+    RETURN steps
+END
+
+PROGRAM main
+BEGIN
+    PARALLEL FOR i <- 1 TO %d
+        OUTPUT i, Collatz(i)
+    NEXT
+END
+"""
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    unit = pseudo.compile_source(SOURCE % iterations)
+
+    cores = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+
+    print("{} iterations, {} cores".format(iterations, cores))
+    expected = None
+    for workers in counts:
+        # a first run starts the pool
+        unit.run(workers=workers)
+
+        start = time.perf_counter()
+        res = unit.run(workers=workers)
+        elapsed = time.perf_counter() - start
+
+        assert res.ok, res.error
+        if expected is None:
+            expected, base = res.output, elapsed
+        assert res.output == expected
+
+        print("{:>3} workers  {:>8.3f}s  x{:.2f}".format(workers, elapsed, base / elapsed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Compares the latency of short runs: a cold 'pseudo FILE' process each time,
+# a 'pseudo client' process talking to a warm 'pseudo serve', and requests
+# sent from this process over one connection (the server's own latency).
+#
+#   python3 bench/bench_server.py [RUNS]
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+ROOT = __file__.rsplit('/', 2)[0]
+sys.path.insert(0, ROOT)
+
+from pseudo.client import Client
+
+SOURCE = """
+PROGRAM main
+BEGIN
+    total <- 0
+    FOR i <- 1 TO 100
+        total <- total + i
+    NEXT
+    OUTPUT total
+END
+"""
+
+# what the 'pseudo' console script runs
+CONSOLE = "import sys; from pseudo import main; sys.argv[0] = 'pseudo'; main()"
+
+def timed(name, runs, func):
+    start = time.perf_counter()
+    for _ in range(runs):
+        func()
+    elapsed = time.perf_counter() - start
+    print("{:<20} {:>8.2f} ms per run".format(name, elapsed / runs * 1000))
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'prog.psc')
+        with open(source, 'w') as fp:
+            fp.write(SOURCE)
+
+        path = os.path.join(tmp, 'pseudo.sock')
+        server = subprocess.Popen([sys.executable, '-c', CONSOLE, 'serve', path, '-w', '2'],
+                env=env, stderr=subprocess.DEVNULL)
+        try:
+            while not os.path.exists(path):
+                time.sleep(0.01)
+
+            def cold():
+                subprocess.run([sys.executable, '-c', CONSOLE, source], env=env,
+                        stdout=subprocess.DEVNULL, check=True)
+
+            def client():
+                subprocess.run([sys.executable, '-c', CONSOLE, 'client', path, source], env=env,
+                        stdout=subprocess.DEVNULL, check=True)
+
+            print("{} runs".format(runs))
+            timed("cold pseudo FILE", runs, cold)
+            timed("pseudo client", runs, client)
+            with Client(path) as conn:
+                timed("in-process request", runs * 10, lambda: conn.run(SOURCE))
+
+        finally:
+            server.terminate()
+            server.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+# Builds a large report string with `s <- s + to_str(i) + ","`, with and
+# without rope-backed concatenation.
+#
+#   python3 bench/bench_strings.py [SIZE_IN_BYTES]
+
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, __file__.rsplit('/', 2)[0])
+
+import pseudo.types
+from pseudo.__main__ import parse_file
+
+def source(size):
+    return "\n".join([
+        "PROGRAM main",
+        "BEGIN",
+        "    s <- ''",
+        "    i <- 0",
+        "    WHILE LENGTH(s) < {}".format(size),
+        "        s <- s + to_str(i) + ','",
+        "        i <- i + 1",
+        "    REPEAT",
+        "    OUTPUT LENGTH(s)",
+        "END"
+    ])
+
+def run(name, size):
+    out = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(out):
+        parse_file(io.StringIO(source(size)), None)
+    elapsed = time.perf_counter() - start
+    print("{:<16} {:>9.3f}s  -> {} chars".format(name, elapsed, out.getvalue().strip()))
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1 << 20
+
+    threshold = pseudo.types.ROPE_THRESHOLD
+    run("rope", size)
+
+    pseudo.types.ROPE_THRESHOLD = float('inf')
+    run("flat strings", size)
+    pseudo.types.ROPE_THRESHOLD = threshold
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+# Measures tracing overhead on a loop-heavy program: no tracing, full
+# tracing in each format, and filtered or sampled tracing.
+#
+#   python3 bench/bench_trace.py [ITERATIONS]
+
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, __file__.rsplit('/', 2)[0])
+
+from pseudo.__main__ import parse_file
+from pseudo.trace import TraceFilter
+
+SOURCE = """
+MODULE Step
+PARAM x
+BEGIN
+    IF x > 100
+        RETURN x - 100
+    END IF
+    RETURN x + 7
+END
+
+PROGRAM main
+BEGIN
+    a <- 0
+    b <- 0
+    FOR i <- 1 TO {iterations}
+        a <- Step(a)
+        IF a > 50
+            b <- b + 1
+        END IF
+    NEXT
+    OUTPUT a, b
+END
+"""
+
+def run(name, iterations, trace_format=None, trace_filter=None):
+    trace_fp = None
+    if trace_format:
+        trace_fp = io.BytesIO() if trace_format == 'binary' else io.StringIO()
+
+    out = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(out):
+        parse_file(io.StringIO(SOURCE.format(iterations=iterations)), trace_fp,
+                trace_format=trace_format or 'table', trace_filter=trace_filter)
+    elapsed = time.perf_counter() - start
+
+    size = len(trace_fp.getvalue()) if trace_fp else 0
+    print("{:<28} {:>8.3f}s  {:>10} bytes of trace".format(name, elapsed, size))
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print("{} iterations".format(iterations))
+    run("untraced", iterations)
+    run("table", iterations, 'table')
+    run("csv", iterations, 'csv')
+    run("jsonl", iterations, 'jsonl')
+    run("binary", iterations, 'binary')
+    run("csv, --trace-var b", iterations, 'csv', TraceFilter(names=['b']))
+    run("csv, --trace-scope main", iterations, 'csv', TraceFilter(scopes=['main']))
+    run("csv, --trace-lines 16-18", iterations, 'csv', TraceFilter(lines=[(16, 18)]))
+    run("csv, --trace-every 100", iterations, 'csv', TraceFilter(every=100))
+    run("csv, --trace-max 10", iterations, 'csv', TraceFilter(limit=10))
+
+if __name__ == "__main__":
+    main()
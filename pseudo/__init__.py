@@ -3,5 +3,20 @@
 from .version import APP_NAME, APP_VERSION
 
 def main(*args, **kwargs):
+    import sys
+    if sys.argv[1:2] == ['client'] and not args and not kwargs:
+        # the client only talks to a server, skip importing the interpreter
+        from .client import client_main
+        sys.exit(client_main(sys.argv[2:]))
+
     from .__main__ import main
     main(*args, **kwargs)
+
+def compile_source(text, name='<source>', fixed=None):
+    from .unit import compile_source
+    return compile_source(text, name, fixed)
+
+def compile_file(fp, name=None, fixed=None):
+    from .unit import compile_file
+    from .types import fixed_kind
+    return compile_file(fp, name, float if fixed is None else fixed_kind(fixed))
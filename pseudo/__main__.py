@@ -4,21 +4,43 @@ import sys
 import argparse
 
 from .version import APP_NAME, APP_VERSION
-from .token import Token, FileTokeniser, REPLTokeniser, ParseError, PseudoRuntimeError
+from .token import Token, FileTokeniser, StreamTokeniser, REPLTokeniser, ParseError, PseudoRuntimeError
 from .code import PseudoModule, PseudoProgram
 from .parse import pseudo_code_element
-from .context import Context, TraceContext
+from .context import Context, TraceContext, RunState
+from .trace import TRACE_FORMATS, TRACE_WRITERS, StreamTraceContext, TraceFilter, line_range, render_main
+from .batch import batch_main
+from .check import check_main
+from .cache import ProgramCache
+from .client import client_main
+from .server import serve_main
+from .lsp import lsp_main
+from .profile import Profiler, ProfileContext
+from .limits import Budget
+from .stream import NullSink, open_sink, open_input
+from .types import fixed_kind
+from .unit import failure, entry_point
+from . import imports
+
+def trace_context(trace_fp, trace_format='table', number=float, trace_filter=None, state=None):
+    if not trace_fp:
+        return Context(number, state=state)
+
+    elif trace_format == 'table':
+        return TraceContext(number=number, trace_filter=trace_filter, state=state)
 
-def parse(parse_ctx, trace=False):
-    if trace:
-        global_ctx = TraceContext()
     else:
-        global_ctx = Context()
+        return StreamTraceContext(TRACE_WRITERS[trace_format](trace_fp), number=number,
+                trace_filter=trace_filter, state=state)
+
+def parse(parse_ctx, global_ctx=None):
+    if global_ctx is None:
+        global_ctx = Context(parse_ctx.number)
 
     while True:
         try:
             with parse_ctx.ready_context():
-                el = pseudo_code_element(parse_ctx)
+                el = global_ctx.prepare(pseudo_code_element(parse_ctx))
                 if isinstance(el, PseudoModule):
                     ctx, rc = parse_ctx.get_context()
                     global_ctx.def_module(el.name, el, ctx, rc)
@@ -29,10 +51,16 @@ def parse(parse_ctx, trace=False):
 
                 else:
                     res = el.eval(global_ctx)
+                    global_ctx.output.flush()
                     if res is not None and res != Token('symbol', None):
                         print(res.value)
 
+            # nothing refers to a statement that has run, nor to its lines
+            el = None
+            parse_ctx.discard()
+
         except KeyboardInterrupt as e:
+            global_ctx.output.flush()
             if parse_ctx.level > 1:
                 print("")
                 parse_ctx.reset()
@@ -48,66 +76,153 @@ def parse(parse_ctx, trace=False):
             parse_ctx.reset()
             #sys.exit(1)
 
-        except PseudoRuntimeError as e:
-            print("Runtime error: {}".format(e))
+        except (PseudoRuntimeError, RecursionError) as e:
+            global_ctx.output.flush()
+            print("Runtime error: {}".format(failure(e)[1]))
             #sys.exit(1)
 
     return global_ctx
 
-def parse_file(fp, trace_fp):
-    ctx = parse(FileTokeniser(fp), bool(trace_fp))
-
+def parse_file(fp, trace_fp, number=float, trace_format='table', trace_filter=None, state=None,
+        cache=None, stream=False):
+    ctx = trace_context(trace_fp, trace_format, number, trace_filter, state)
+    try:
+        run_file(fp, ctx, number, cache, stream)
+
+    finally:
+        ctx.output.close()
+        ctx.state.close_files()
+        if trace_fp:
+            ctx.finish_trace(trace_fp)
+
+def profile_file(fp, report_fp, stacks_fp, number=float, state=None, cache=None, stream=False):
+    profiler = Profiler()
+    ctx = ProfileContext(profiler, number, state=state)
+    try:
+        run_file(fp, ctx, number, cache, stream)
+
+    finally:
+        ctx.output.close()
+        ctx.state.close_files()
+        if report_fp:
+            profiler.report(report_fp)
+
+        if stacks_fp:
+            profiler.write_stacks(stacks_fp)
+
+def run_program(ctx, prog):
+    try:
+        prog.eval(ctx)
+
+    except EOFError as e:
+        pass
+
+    except ParseError as e:
+        ctx.output.flush()
+        print("Parse failed: {}".format(e))
+
+    except (PseudoRuntimeError, RecursionError) as e:
+        ctx.output.flush()
+        print("Runtime error: {}".format(failure(e)[1]))
+
+    ctx.output.flush()
+
+def run_programs(ctx):
+    # Runs the entry point of a file that has been run up to its end: its
+    # only program or main. Without one the user picks programs to run.
     if len(ctx.programs) == 0:
         return
 
-    elif len(ctx.programs) == 1:
+    elif len(ctx.programs) == 1 or 'main' in ctx.programs:
+        run_program(ctx, entry_point(ctx.programs))
+        return
+
+    print("Your code file does not have a main entry point.")
+    while True:
+        print("Select a program from the list below (or enter nothing to exit):")
+        keys = ctx.programs.keys()
+        for name in enumerate(keys):
+            print(name)
+
         try:
-            for prog in ctx.programs.values():
-                prog.eval(ctx)
+            name = input(": ")
+        except EOFError:
+            break
 
-        except EOFError as e:
-            pass
+        if not name:
+            break
 
-        except ParseError as e:
-            print("Parse failed: {}".format(e))
-            parse_ctx.reset()
-            #sys.exit(1)
+        elif name not in keys:
+            print("The program you entered has not been defined.")
+            continue
 
-        except PseudoRuntimeError as e:
-            print("Runtime error: {}".format(e))
-            #sys.exit(1)
+        else:
+            run_program(ctx, ctx.get_program(name))
 
-    elif 'main' not in ctx.programs:
-        print("Your code file does not have a main entry point.")
-        while True:
-            print("Select a program from the list below (or enter nothing to exit):")
-            keys = ctx.programs.keys()
-            for name in enumerate(keys):
-                print(name)
+def run_compiled(unit, ctx):
+    for error in unit.errors:
+        print("Parse failed: {}".format(error))
 
-            name = input(": ")
-            if not name:
-                break
+    try:
+        unit.execute_statements(ctx)
 
-            elif name not in keys:
-                print("The program you entered has not been defined.")
-                continue
+    except (PseudoRuntimeError, RecursionError) as e:
+        ctx.output.flush()
+        print("Runtime error: {}".format(failure(e)[1]))
+        return
 
-            else:
-                prog = ctx.get_program(name)
-                if prog: prog.eval(ctx)
+    ctx.output.flush()
+    run_programs(ctx)
 
-    if trace_fp:
-        trace_fp.write(ctx.get_trace())
+def run_file(fp, ctx, number=float, cache=None, stream=False):
+    if cache is not None:
+        # a cached unit is parsed in full before it runs, so any parse errors
+        # are reported first
+        return run_compiled(cache.compile(fp.read(), getattr(fp, 'name', '<stream>'), number), ctx)
 
-def repl():
+    parse_ctx = StreamTokeniser(fp, number=number) if stream else FileTokeniser(fp, number=number)
+    imports.enable(parse_ctx, getattr(fp, 'name', '<stream>'))
+    parse(parse_ctx, ctx)
+    run_programs(ctx)
+
+def repl(number=float):
     print("{} version {}".format(APP_NAME, APP_VERSION))
     print("(C) Thomas Bell 2016, MIT License.")
     print("Press Ctrl-C to exit.")
 
-    ctx = parse(REPLTokeniser())
+    parse_ctx = REPLTokeniser(number)
+    imports.enable(parse_ctx, '<repl>')
+    ctx = parse(parse_ctx)
+
+COMMANDS = {
+    'trace-render': render_main,
+    'batch': batch_main,
+    'check': check_main,
+    'serve': serve_main,
+    'client': client_main,
+    'lsp': lsp_main
+}
+
+def open_trace(path, trace_format):
+    binary = trace_format == 'binary'
+    if path == '-':
+        return sys.stdout.buffer if binary else sys.stdout
+
+    return open(path, 'wb' if binary else 'w')
+
+def close_trace(fp):
+    # standard output is only flushed, it stays open for the rest of the run
+    if fp is sys.stdout or fp is sys.stdout.buffer:
+        fp.flush()
+    else:
+        fp.close()
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
 
-def main():
+    if argv and argv[0] in COMMANDS:
+        sys.exit(COMMANDS[argv[0]](argv[1:]))
 
     parser = argparse.ArgumentParser(prog=APP_NAME,
             description="An interpreter for simple PASCAL-like pseudo code.",
@@ -117,16 +232,139 @@ def main():
     parser.add_argument("input_file", type=argparse.FileType('r'), nargs="?",
             help="Input source file to be interpreted.")
 
-    parser.add_argument("-t", "--trace", type=argparse.FileType('w'),
+    parser.add_argument("-t", "--trace", metavar="TRACE_FILE",
             help="Write a trace table to the given file.")
 
-    args = parser.parse_args()
+    parser.add_argument("--trace-format", choices=TRACE_FORMATS, default='table',
+            help="Trace layout: a table written at exit, rows streamed as csv, jsonl or text, "
+                 "or a compact binary log for '{} trace-render'.".format(APP_NAME))
+
+    parser.add_argument("--trace-var", action="append", metavar="NAME",
+            help="Only trace assignments to (and conditions reading) this variable. Can be repeated.")
+
+    parser.add_argument("--trace-scope", action="append", metavar="NAME",
+            help="Only trace inside this module or program. Can be repeated.")
+
+    parser.add_argument("--trace-lines", action="append", type=line_range, metavar="FROM-TO",
+            help="Only trace events on these source lines. Can be repeated.")
+
+    parser.add_argument("--trace-every", type=int, default=1, metavar="N",
+            help="Only trace every Nth event that passes the other filters.")
+
+    parser.add_argument("--trace-max", type=int, metavar="N",
+            help="Trace at most N events per program or module call.")
+
+    parser.add_argument("--profile", metavar="REPORT_FILE",
+            help="Profile the run and write hit counts and times per line, module and program "
+                 "to the given file ('-' for stdout).")
+
+    parser.add_argument("--profile-stacks", metavar="STACKS_FILE",
+            help="Profile the run and write collapsed stacks for flame graph tools to the given file.")
+
+    parser.add_argument("-o", "--output", metavar="OUTPUT_FILE",
+            help="Write the program's OUTPUT to the given file instead of stdout.")
+
+    parser.add_argument("--no-output", action="store_true",
+            help="Discard the program's OUTPUT.")
+
+    parser.add_argument("-i", "--input", metavar="INPUT_FILE",
+            help="Read INPUT values from the given file ('-' for stdin), one per line, "
+                 "without prompting.")
+
+    parser.add_argument("--prompts", action="store_true",
+            help="With --input, echo prompts and the values read to stderr.")
+
+    parser.add_argument("--max-steps", type=int, metavar="N",
+            help="Stop the program after about N statements have run.")
+
+    parser.add_argument("--timeout", type=float, metavar="SECONDS",
+            help="Stop the program after it has run for this long.")
+
+    parser.add_argument("--max-variables", type=int, metavar="N",
+            help="Stop the program when more than N variables are live across all calls.")
+
+    parser.add_argument("--max-string", type=int, metavar="N",
+            help="Stop the program when a string grows beyond N characters.")
+
+    parser.add_argument("--cache-dir", metavar="DIR",
+            help="Keep parsed programs in this directory and reuse them while the source is unchanged.")
+
+    parser.add_argument("--stream", action="store_true",
+            help="Read the source a line at a time and let go of top-level statements once they "
+                 "have run, so long flat scripts run in constant memory.")
+
+    parser.add_argument("-j", "--jobs", type=int, metavar="N",
+            help="Number of processes for PARALLEL FOR loops (default: one per core).")
+
+    parser.add_argument("--fixed", action="store_true",
+            help="Use exact fixed point numbers instead of floating point.")
+
+    parser.add_argument("--places", type=int, default=2, metavar="N",
+            help="Number of decimal places of fixed point numbers (default 2).")
+
+    args = parser.parse_args(argv)
+
+    try:
+        cache = ProgramCache(args.cache_dir) if args.cache_dir else None
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    number = float
+    if args.fixed:
+        number = fixed_kind(args.places)
+
+    budget = None
+    if (args.max_steps is not None or args.timeout is not None
+            or args.max_variables is not None or args.max_string is not None):
+        budget = Budget(args.max_steps, args.timeout, args.max_variables, args.max_string)
+
+    output = None
+    if args.no_output:
+        output = NullSink()
+    elif args.output:
+        output = open_sink(args.output)
+
+    input_source = None
+    if args.input:
+        input_source = open_input(args.input, sys.stderr if args.prompts else None)
+
+    state = RunState(budget, output, input_source)
+    state.workers = args.jobs
+
+    if (args.profile or args.profile_stacks) and args.trace:
+        parser.error("--profile cannot be combined with --trace")
+
+    if args.stream and cache is not None:
+        parser.error("--stream cannot be combined with --cache-dir")
+
+    if args.input_file and (args.profile or args.profile_stacks):
+        report_fp = open_trace(args.profile, 'table') if args.profile else None
+        stacks_fp = open_trace(args.profile_stacks, 'table') if args.profile_stacks else None
+        try:
+            profile_file(args.input_file, report_fp, stacks_fp, number, state, cache, args.stream)
+
+        finally:
+            for fp in (report_fp, stacks_fp):
+                if fp:
+                    close_trace(fp)
+
+    elif args.input_file:
+        trace_fp = open_trace(args.trace, args.trace_format) if args.trace else None
+        trace_filter = None
+        if args.trace_var or args.trace_scope or args.trace_lines or args.trace_every > 1 or args.trace_max is not None:
+            trace_filter = TraceFilter(args.trace_var, args.trace_scope, args.trace_lines,
+                    args.trace_every, args.trace_max)
+
+        try:
+            parse_file(args.input_file, trace_fp, number, args.trace_format, trace_filter, state,
+                    cache, args.stream)
 
-    if args.input_file:
-        parse_file(args.input_file, args.trace)
+        finally:
+            if trace_fp:
+                close_trace(trace_fp)
 
     else:
-        repl()
+        repl(number)
 
 if __name__ == "__main__":
     """from io import StringIO
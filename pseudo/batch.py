@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from .version import APP_NAME
+from .stream import LineInput, open_input
+from .types import fixed_kind
+from .unit import compile_file
+from .cache import ProgramCache
+
+# units of the current worker process, sent once when the worker starts
+_units = None
+
+def _init_worker(units):
+    global _units
+    _units = units
+
+def run_job(unit, input_path=None, timeout=None, max_steps=None, expected_ext=None):
+    res = {
+        'program': unit.name,
+        'input': input_path,
+    }
+
+    try:
+        input_source = open_input(input_path) if input_path else LineInput([])
+    except (OSError, UnicodeDecodeError) as e:
+        res.update(status='error', error="Cannot read input: {}".format(e))
+        return res
+
+    res.update(run_unit(unit, input_source, timeout, max_steps))
+
+    if expected_ext and input_path:
+        expected_path = os.path.splitext(input_path)[0] + expected_ext
+        if os.path.exists(expected_path):
+            with open(expected_path) as fp:
+                res['passed'] = res['status'] == 'ok' and res['output'] == fp.read()
+
+    return res
+
+def run_unit(unit, input_source, timeout=None, max_steps=None):
+    # Runs are already spread over processes, so PARALLEL FOR stays in this
+    # one. Programs run here are untrusted and may not open files.
+    return unit.run(inputs=input_source, limits=dict(steps=max_steps, seconds=timeout),
+            workers=1, files=False).as_dict()
+
+def _run_worker_job(job):
+    index, input_path, timeout, max_steps, expected_ext = job
+    return run_job(_units[index], input_path, timeout, max_steps, expected_ext)
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(prog="{} batch".format(APP_NAME),
+            description="Run every program against every input file in a pool of processes "
+                        "and write one JSON result per run.")
+
+    parser.add_argument("programs", nargs="+", metavar="PROGRAM",
+            help="Source files to run. Each is parsed once.")
+
+    parser.add_argument("-i", "--inputs", nargs="+", default=[], metavar="INPUT_FILE",
+            help="Input files, one INPUT value per line. Without inputs each program runs once "
+                 "with no input.")
+
+    parser.add_argument("-o", "--output", type=argparse.FileType('w'), default=sys.stdout,
+            help="Write the JSONL results to the given file instead of standard output.")
+
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, metavar="N",
+            help="Number of worker processes (default: one per core, 1 runs in this process).")
+
+    parser.add_argument("--timeout", type=float, metavar="SECONDS",
+            help="Stop each run after it has run for this long.")
+
+    parser.add_argument("--max-steps", type=int, metavar="N",
+            help="Stop each run after about N statements.")
+
+    parser.add_argument("--expected-ext", metavar="EXT",
+            help="Compare each run's output with the input file's name with this extension "
+                 "(e.g. '.out') and add 'passed' to its result.")
+
+    parser.add_argument("--cache-dir", metavar="DIR",
+            help="Keep parsed programs in this directory and reuse them while the source is unchanged.")
+
+    parser.add_argument("--fixed", action="store_true",
+            help="Use exact fixed point numbers instead of floating point.")
+
+    parser.add_argument("--places", type=int, default=2, metavar="N",
+            help="Number of decimal places of fixed point numbers (default 2).")
+
+    args = parser.parse_args(argv)
+    try:
+        cache = ProgramCache(args.cache_dir) if args.cache_dir else None
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    number = float
+    if args.fixed:
+        number = fixed_kind(args.places)
+
+    # the programs are untrusted, so they may not import files either
+    units = []
+    for path in args.programs:
+        with open(path) as fp:
+            if cache is not None:
+                units.append(cache.compile(fp.read(), path, number, imports=False))
+            else:
+                units.append(compile_file(fp, path, number, imports=False))
+
+    jobs = [(index, input_path, args.timeout, args.max_steps, args.expected_ext)
+            for index in range(len(units)) for input_path in (args.inputs or [None])]
+
+    if args.jobs <= 1:
+        _init_worker(units)
+        results = map(_run_worker_job, jobs)
+        _write_results(results, args.output)
+
+    else:
+        with ProcessPoolExecutor(args.jobs, initializer=_init_worker, initargs=(units,)) as pool:
+            results = pool.map(_run_worker_job, jobs, chunksize=max(1, len(jobs) // (args.jobs * 4)))
+            _write_results(results, args.output)
+
+def _write_results(results, fp):
+    for res in results:
+        fp.write(json.dumps(res) + '\n')
+
+    fp.flush()
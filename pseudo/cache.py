@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import stat
+import pickle
+import hashlib
+import tempfile
+
+from .version import APP_NAME, APP_VERSION
+from .unit import compile_file
+from .imports import Importer, source_path
+
+# bump when the pickled tree changes shape without a version change
+CACHE_FORMAT = 6
+
+def check_directory(directory):
+    # raises ValueError for a cache directory someone else could put files in
+    if not hasattr(os, 'getuid'):
+        return
+
+    st = os.stat(directory)
+    if st.st_uid not in (os.getuid(), 0):
+        raise ValueError("Cache directory {} belongs to another user".format(directory))
+
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise ValueError("Cache directory {} is writable by other users".format(directory))
+
+def cache_key(source, name, number=float, imports=True):
+    # The file name is part of the key because error locations are baked into
+    # the parsed tree, and the number kind because literals are parsed with it.
+    # So are the file's full path and whether it may import files, as IMPORT
+    # paths are resolved when parsing.
+    places = getattr(number, 'keywords', {}).get('places')
+    base = source_path(name) if imports else False
+    h = hashlib.sha256()
+    h.update("{} {} {} {!r} {!r} {!r}\n".format(APP_NAME, APP_VERSION, CACHE_FORMAT, places, name,
+            base).encode('utf-8'))
+    h.update(source.encode('utf-8'))
+    return h.hexdigest()
+
+class UnitPickler(pickle.Pickler):
+    # IMPORT statements keep the Importer they were parsed with, which is
+    # pickled as a reference and replaced by the loading cache's own
+    def persistent_id(self, obj):
+        return 'importer' if isinstance(obj, Importer) else None
+
+class UnitUnpickler(pickle.Unpickler):
+    def __init__(self, fp, importer):
+        super().__init__(fp)
+        self.importer = importer
+
+    def persistent_load(self, pid):
+        if pid != 'importer':
+            raise pickle.UnpicklingError("Unknown reference {!r}".format(pid))
+
+        return self.importer
+
+class ProgramCache:
+    # Compiled units pickled into a directory, one file per key. Files are
+    # written to a temporary name and renamed into place, so readers in other
+    # processes see either nothing or a whole file.
+    #
+    # Loading a pickle can run any code, so the directory must belong to the
+    # user (or root) and not be writable by anyone else; see check_directory.
+    #
+    # Files the programs import are compiled through the cache too, with an
+    # Importer of its own.
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        check_directory(directory)
+        self.importer = Importer(self)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def load(self, key):
+        try:
+            with open(self.path(key), 'rb') as fp:
+                return UnitUnpickler(fp, self.importer).load()
+
+        except FileNotFoundError:
+            return None
+
+        except Exception:
+            # a cache file from an incompatible interpreter; it is replaced
+            return None
+
+    def store(self, key, unit):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                UnitPickler(fp, pickle.HIGHEST_PROTOCOL).dump(unit)
+
+            os.replace(tmp, self.path(key))
+
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def compile(self, source, name, number=float, imports=True):
+        key = cache_key(source, name, number, imports)
+        unit = self.load(key)
+        if unit is None:
+            unit = compile_file(io.StringIO(source), name, number, self.importer if imports else False)
+            self.store(key, unit)
+
+        return unit
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from .version import APP_NAME
+from .incremental import Document
+
+def find_sources(paths, ext):
+    # files are taken as given, directories are searched for files ending in
+    # ext, in a stable order
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(ext):
+                    yield os.path.join(root, name)
+
+def check_file(path):
+    # Parses a file without running it. Parsing goes on after an error (see
+    # incremental.Document), so every broken module or program is reported.
+    try:
+        with open(path) as fp:
+            doc = Document(fp.read(), path)
+
+    except (OSError, UnicodeDecodeError) as e:
+        return {'file': path, 'status': 'error', 'errors': [{'line': None, 'column': None, 'message': str(e)}]}
+
+    errors = [{'line': row, 'column': col, 'message': msg} for row, col, msg in doc.diagnostics()]
+    return {'file': path, 'status': 'parse_error' if errors else 'ok', 'errors': errors}
+
+def check_main(argv):
+    parser = argparse.ArgumentParser(prog="{} check".format(APP_NAME),
+            description="Parse source files without running them in a pool of processes and "
+                        "write one JSON result per file.")
+
+    parser.add_argument("paths", nargs="+", metavar="PATH",
+            help="Source files, or directories to search for them.")
+
+    parser.add_argument("--ext", default=".psc", metavar="EXT",
+            help="Extension of the source files in directories (default '.psc').")
+
+    parser.add_argument("-o", "--output", type=argparse.FileType('w'), default=sys.stdout,
+            help="Write the JSONL results to the given file instead of standard output.")
+
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, metavar="N",
+            help="Number of worker processes (default: one per core, 1 runs in this process).")
+
+    args = parser.parse_args(argv)
+
+    paths = list(find_sources(args.paths, args.ext))
+    start = time.perf_counter()
+
+    if args.jobs <= 1 or len(paths) <= 1:
+        failed = _write_results(map(check_file, paths), args.output)
+
+    else:
+        with ProcessPoolExecutor(args.jobs) as pool:
+            results = pool.map(check_file, paths, chunksize=max(1, len(paths) // (args.jobs * 4)))
+            failed = _write_results(results, args.output)
+
+    elapsed = time.perf_counter() - start
+    print("{} files checked, {} with errors in {:.2f}s ({:.0f} files/s)".format(len(paths), failed,
+            elapsed, len(paths) / elapsed if elapsed > 0 else 0), file=sys.stderr)
+
+    return 1 if failed else 0
+
+def _write_results(results, fp):
+    failed = 0
+    for res in results:
+        fp.write(json.dumps(res) + '\n')
+        failed += res['status'] != 'ok'
+
+    fp.flush()
+    return failed
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# Kept free of interpreter imports so that 'pseudo client' starts quickly.
+
+import sys
+import json
+import socket
+import argparse
+
+from .version import APP_NAME
+
+class Client:
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.fp = self.sock.makefile('rwb')
+
+    def request(self, req):
+        self.fp.write(json.dumps(req).encode('utf-8') + b'\n')
+        self.fp.flush()
+
+        line = self.fp.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+
+        return json.loads(line.decode('utf-8'))
+
+    def run(self, source=None, program_id=None, inputs=(), name=None, **limits):
+        req = {'input': list(inputs)}
+        if source is not None:
+            req['source'] = source
+        else:
+            req['program_id'] = program_id
+
+        if name is not None:
+            req['name'] = name
+
+        req.update((key, value) for key, value in limits.items() if value is not None)
+        return self.request(req)
+
+    def close(self):
+        self.fp.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def client_main(argv):
+    parser = argparse.ArgumentParser(prog="{} client".format(APP_NAME),
+            description="Run a program on a '{} serve' server.".format(APP_NAME))
+
+    parser.add_argument("socket", help="Path of the server's Unix domain socket.")
+
+    parser.add_argument("input_file", type=argparse.FileType('r'), nargs="?",
+            help="Source file to run.")
+
+    parser.add_argument("--program-id", metavar="ID",
+            help="Run a program the server has already been sent instead of a source file.")
+
+    parser.add_argument("-i", "--input", type=argparse.FileType('r'), metavar="INPUT_FILE",
+            help="Read INPUT values from the given file, one per line.")
+
+    parser.add_argument("--timeout", type=float, metavar="SECONDS",
+            help="Stop the program after it has run for this long.")
+
+    parser.add_argument("--max-steps", type=int, metavar="N",
+            help="Stop the program after about N statements.")
+
+    parser.add_argument("--fixed", action="store_true",
+            help="Use exact fixed point numbers instead of floating point.")
+
+    parser.add_argument("--places", type=int, default=2, metavar="N",
+            help="Number of decimal places of fixed point numbers (default 2).")
+
+    args = parser.parse_args(argv)
+    if not args.input_file and not args.program_id:
+        parser.error("a source file or --program-id is required")
+
+    source = args.input_file.read() if args.input_file else None
+    inputs = args.input.read().splitlines() if args.input else []
+
+    with Client(args.socket) as client:
+        res = client.run(source, args.program_id, inputs,
+                name=args.input_file.name if args.input_file else None, timeout=args.timeout,
+                max_steps=args.max_steps, fixed=args.places if args.fixed else None)
+
+    sys.stdout.write(res.get('output', ''))
+    if res.get('error'):
+        print("Runtime error: {}".format(res['error']), file=sys.stderr)
+
+    return 0 if res.get('status') == 'ok' else 1
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 
+import copy
 import traceback
 from inspect import signature
 
 from .token import Token, PseudoRuntimeError, PseudoTypeError, PseudoBreak, PseudoContinue, PseudoReturn
-from .expr import Expression, VariableReference
+from .expr import Expression, VariableReference, TracedVariableReference, IndexExpression, FileExpression
 from .context import Context
+from .types import box, flatten
 
 class Statement:
+    # see Expression.waits; loops always wait as they give way to other tasks
+    waits = True
+
     def __init__(self):
         self.context = None
 
@@ -15,15 +20,30 @@ class Statement:
         self.context, self.row_col = ctx.get_context()
         return self
 
+    async def aeval(self, ctx):
+        # see Expression.aeval
+        return self.eval(ctx)
+
+def any_waits(stmt_list):
+    return any(stmt.waits for stmt in stmt_list)
+
+async def cooperate(state):
+    # the asyncio runner's loops and calls count steps in state.ticks and
+    # give way to other tasks every state.yield_every steps
+    import asyncio
+    state.ticks = 0
+    await asyncio.sleep(0)
+
 class AssignmentStatement(Statement):
     def __init__(self, target, value):
         super().__init__()
 
         self.target = Expression._normalise_arg(target)
-        if not isinstance(self.target, VariableReference):
-            raise PseudoTypeError("Assignment target must be a variable reference")
+        if not isinstance(self.target, (VariableReference, IndexExpression)):
+            raise PseudoTypeError(None, "Assignment target must be a variable or element reference")
 
         self.value = Expression._normalise_arg(value)
+        self.waits = self.value.waits
 
     def eval(self, ctx):
         value = Expression._get_arg(ctx, self.value)
@@ -32,6 +52,13 @@ class AssignmentStatement(Statement):
 
         return value
 
+    async def aeval(self, ctx):
+        value = await Expression._aget_arg(ctx, self.value)
+
+        self.target.set(ctx, value)
+
+        return value
+
 class IfStatement(Statement):
     def __init__(self, cond, then_stmts=[], else_stmts=[]):
         super().__init__()
@@ -39,35 +66,45 @@ class IfStatement(Statement):
         self.condition = Expression._normalise_arg(cond)
         self.then_stmt_list = then_stmts
         self.else_stmt_list = else_stmts
+        self.waits = self.condition.waits or any_waits(then_stmts) or any_waits(else_stmts)
 
-    def eval(self, ctx):
-        res = Token('symbol', None)
-        value = self.condition.eval(ctx)
+    def _branch(self, ctx, value):
+        # the statements to run for the value of the condition
         if not value:
-            raise PseudoTypeError("If statement condition does not return")
+            raise PseudoTypeError(self.context, "If statement condition does not return")
 
         if value.type != 'number':
-            raise PseudoTypeError("Condition must be numerical or boolean")
+            raise PseudoTypeError(self.context, "Condition must be numerical or boolean")
 
-        ctx.trace_conditional(self.condition, value, self.row_col)
+        return self.then_stmt_list if value.value else self.else_stmt_list
+
+    def eval(self, ctx):
+        res = Token('symbol', None)
+        for expr in self._branch(ctx, self.condition.eval(ctx)):
+            res = expr.eval(ctx)
 
-        if value.value:
-            for expr in self.then_stmt_list:
-                res = expr.eval(ctx)
+        return res
 
-        else:
-            for expr in self.else_stmt_list:
-                res = expr.eval(ctx)
+    async def aeval(self, ctx):
+        res = Token('symbol', None)
+        for expr in self._branch(ctx, await Expression._aget_arg(ctx, self.condition)):
+            res = (await expr.aeval(ctx)) if expr.waits else expr.eval(ctx)
 
         return res
 
+class TracedIfStatement(IfStatement):
+    def _branch(self, ctx, value):
+        stmts = super()._branch(ctx, value)
+        ctx.trace_conditional(self.condition, value, self.row_col)
+        return stmts
+
 class ForStatement(Statement):
     def __init__(self, start_expr, end_expr, stmt_list=[]):
         super().__init__()
 
         self.start_expr = start_expr
         if not isinstance(start_expr, AssignmentStatement):
-            raise PseudoTypeError("For statement requires a variable assignment")
+            raise PseudoTypeError(None, "For statement requires a variable assignment")
 
         self.variable = start_expr.target
 
@@ -76,8 +113,14 @@ class ForStatement(Statement):
 
     def eval(self, ctx):
         res = Token('symbol', None)
+        budget = ctx.budget
+        cost = len(self.stmt_list) + 1
+
         self.start_expr.eval(ctx)
         while True:
+            if budget is not None:
+                budget.step(cost, ctx, self.context)
+
             for stmt in self.stmt_list:
                 try:
                     res = stmt.eval(ctx)
@@ -97,6 +140,111 @@ class ForStatement(Statement):
 
         return res
 
+    async def aeval(self, ctx):
+        res = Token('symbol', None)
+        budget, state = ctx.budget, ctx.state
+        cost = len(self.stmt_list) + 1
+
+        await self.start_expr.aeval(ctx)
+        while True:
+            if budget is not None:
+                budget.step(cost, ctx, self.context)
+            state.ticks += cost
+            if state.ticks >= state.yield_every:
+                await cooperate(state)
+
+            for stmt in self.stmt_list:
+                try:
+                    res = (await stmt.aeval(ctx)) if stmt.waits else stmt.eval(ctx)
+
+                except PseudoBreak:
+                    return res
+
+                except PseudoContinue:
+                    break
+
+            end = ((await self.end_expr.aeval(ctx)) if self.end_expr.waits else self.end_expr.eval(ctx)).value
+            val = self.variable.eval(ctx).value
+            if val < end:
+                self.variable.set(ctx, Token('number', val + 1))
+            else:
+                break
+
+        return res
+
+class ForEachStatement(Statement):
+    def __init__(self, variable, iterable, stmt_list=[]):
+        super().__init__()
+
+        self.variable = Expression._normalise_arg(variable)
+        self.iterable = Expression._normalise_arg(iterable)
+        self.stmt_list = stmt_list
+
+    def _items(self, ctx, container=None):
+        if container is None:
+            container = Expression._get_arg(ctx, self.iterable)
+
+        if container.type in ('array', 'map'):
+            # iterate over a snapshot so the body may modify the container
+            return list(container.value)
+
+        elif container.type == 'string':
+            return [Token('string', c) for c in container.value]
+
+        elif container.type == 'file':
+            # streamed, a line at a time
+            close = isinstance(self.iterable, FileExpression)
+            return (Token('string', line) for line in container.value.lines(self.context, close))
+
+        raise PseudoTypeError(self.context, "Cannot iterate over {}".format(container.type))
+
+    def eval(self, ctx):
+        res = Token('symbol', None)
+        budget = ctx.budget
+        cost = len(self.stmt_list) + 1
+
+        for item in self._items(ctx):
+            if budget is not None:
+                budget.step(cost, ctx, self.context)
+
+            self.variable.set(ctx, item)
+            for stmt in self.stmt_list:
+                try:
+                    res = stmt.eval(ctx)
+
+                except PseudoBreak:
+                    return res
+
+                except PseudoContinue:
+                    break
+
+        return res
+
+    async def aeval(self, ctx):
+        res = Token('symbol', None)
+        budget, state = ctx.budget, ctx.state
+        cost = len(self.stmt_list) + 1
+
+        for item in self._items(ctx, await Expression._aget_arg(ctx, self.iterable)):
+            if budget is not None:
+                budget.step(cost, ctx, self.context)
+            state.ticks += cost
+            if state.ticks >= state.yield_every:
+                await cooperate(state)
+
+            self.variable.set(ctx, item)
+            for stmt in self.stmt_list:
+                try:
+                    res = (await stmt.aeval(ctx)) if stmt.waits else stmt.eval(ctx)
+
+                except PseudoBreak:
+                    return res
+
+                except PseudoContinue:
+                    break
+
+        return res
+
 class WhileStatement(Statement):
     def __init__(self, cond, stmt_list=[]):
         super().__init__()
@@ -106,7 +254,13 @@ class WhileStatement(Statement):
 
     def eval(self, ctx):
         res = Token('symbol', None)
+        budget = ctx.budget
+        cost = len(self.stmt_list) + 1
+
         while self.condition.eval(ctx).value:
+            if budget is not None:
+                budget.step(cost, ctx, self.context)
+
             for stmt in self.stmt_list:
                 try:
                     res = stmt.eval(ctx)
@@ -119,11 +273,40 @@ class WhileStatement(Statement):
 
         return res
 
+    async def aeval(self, ctx):
+        res = Token('symbol', None)
+        budget, state = ctx.budget, ctx.state
+        cost = len(self.stmt_list) + 1
+        cond = self.condition
+
+        while ((await cond.aeval(ctx)) if cond.waits else cond.eval(ctx)).value:
+            if budget is not None:
+                budget.step(cost, ctx, self.context)
+            state.ticks += cost
+            if state.ticks >= state.yield_every:
+                await cooperate(state)
+
+            for stmt in self.stmt_list:
+                try:
+                    res = (await stmt.aeval(ctx)) if stmt.waits else stmt.eval(ctx)
+
+                except PseudoBreak:
+                    return res
+
+                except PseudoContinue:
+                    break
+
+        return res
+
 class BreakStatement(Statement):
+    waits = False
+
     def eval(self, ctx):
         raise PseudoBreak(self.context)
 
 class ContinueStatement(Statement):
+    waits = False
+
     def eval(self, ctx):
         raise PseudoContinue(self.context)
 
@@ -131,41 +314,63 @@ class ReturnStatement(Statement):
     def __init__(self, ret):
         super().__init__()
         self.value = Expression._normalise_arg(ret)
+        self.waits = self.value.waits
 
     def eval(self, ctx):
         raise PseudoReturn(self.context, Expression._get_arg(ctx, self.value))
 
+    async def aeval(self, ctx):
+        raise PseudoReturn(self.context, await Expression._aget_arg(ctx, self.value))
+
 class PseudoProgram(Statement):
     def __init__(self, prog_name, stmt_list):
         super().__init__()
         self.name = prog_name
         self.stmt_list = stmt_list
 
-    def eval(self, ctx, pos=None):
-
+    def _context(self, ctx, pos):
         name = "PROGRAM {}".format(self.name)
         if pos:
             row, col = pos
             name += ", called at line {}".format(row)
 
-        ctx = ctx.child_context(name)
+        return ctx.child_context(name, self.name)
+
+    def eval(self, ctx, pos=None):
+        ctx = self._context(ctx, pos)
 
         res = Token('symbol', None)
         try:
             for stmt in self.stmt_list:
                 res = stmt.eval(ctx)
 
-        except PseudoBreak as e:
-            raise PseudoRuntimeError(e.context, 'Break outside of loop') from e
+        except (PseudoBreak, PseudoContinue, PseudoReturn) as e:
+            raise _misplaced(e) from e
 
-        except PseudoContinue as e:
-            raise PseudoRuntimeError(e.context, 'Continue outside of loop') from e
+        return res
+
+    async def aeval(self, ctx, pos=None):
+        ctx = self._context(ctx, pos)
 
-        except PseudoReturn as e:
-            raise PseudoRuntimeError(e.context, 'Return outside of module') from e
+        res = Token('symbol', None)
+        try:
+            for stmt in self.stmt_list:
+                res = (await stmt.aeval(ctx)) if stmt.waits else stmt.eval(ctx)
+
+        except (PseudoBreak, PseudoContinue, PseudoReturn) as e:
+            raise _misplaced(e) from e
 
         return res
 
+def _misplaced(e):
+    if isinstance(e, PseudoBreak):
+        return PseudoRuntimeError(e.context, 'Break outside of loop')
+
+    elif isinstance(e, PseudoContinue):
+        return PseudoRuntimeError(e.context, 'Continue outside of loop')
+
+    return PseudoRuntimeError(e.context, 'Return outside of module')
+
 class PseudoModule(Statement):
     def __init__(self, name, params, stmt_list):
         super().__init__()
@@ -176,69 +381,172 @@ class PseudoModule(Statement):
     def eval(self, ctx):
         raise PseudoRuntimeError(self.context, "Modules cannot be called like programs")
 
-    def call(self, ctx, args, pos=None):
-        args = [Expression._get_arg(ctx, Expression._normalise_arg(arg)) for arg in args]
-
+    def _enter(self, caller, args, pos):
         name = "MODULE {}".format(self.name)
         if pos:
             row, col = pos
             name += ", called at line {}".format(row)
 
-        ctx = ctx.child_context(name)
         if len(args) != len(self.params):
             raise PseudoRuntimeError(self.context, "Module takes {} argument(s) ({} given)".format(
                     len(self.params), len(args)))
 
-        for name, value in zip(self.params, args):
-            ctx.set_var(name, value, self.context, self.row_col)
+        if caller.budget is not None:
+            caller.budget.enter(caller, len(self.stmt_list) + 1, self.context)
+
+        ctx = caller.child_context(name, self.name)
+        self.bind(ctx, args)
+        return ctx
+
+    def call(self, ctx, args, pos=None):
+        args = [Expression._get_arg(ctx, arg) for arg in args]
+
+        caller, budget = ctx, ctx.budget
+        ctx = self._enter(caller, args, pos)
 
         res = Token('symbol', None)
         try:
             for stmt in self.stmt_list:
                 res = stmt.eval(ctx)
 
-        except PseudoBreak as e:
-            raise PseudoRuntimeError(e.context, 'Break outside of loop')
+        except (PseudoBreak, PseudoContinue) as e:
+            raise _misplaced(e)
+
+        except PseudoReturn as ret:
+            return ret.value
+
+        finally:
+            if budget is not None:
+                budget.leave(caller)
+
+        return res
+
+    async def acall(self, ctx, args, pos=None):
+        args = [await Expression._aget_arg(ctx, arg) for arg in args]
+
+        caller, budget = ctx, ctx.budget
+        ctx = self._enter(caller, args, pos)
+        state = ctx.state
+        state.ticks += len(self.stmt_list) + 1
+        if state.ticks >= state.yield_every:
+            await cooperate(state)
 
-        except PseudoContinue as e:
-            raise PseudoRuntimeError(e.context, 'Continue outside of loop')
+        res = Token('symbol', None)
+        try:
+            for stmt in self.stmt_list:
+                res = (await stmt.aeval(ctx)) if stmt.waits else stmt.eval(ctx)
+
+        except (PseudoBreak, PseudoContinue) as e:
+            raise _misplaced(e)
 
         except PseudoReturn as ret:
             return ret.value
 
+        finally:
+            if budget is not None:
+                budget.leave(caller)
+
         return res
 
+    def bind(self, ctx, args):
+        for name, value in zip(self.params, args):
+            ctx.set_var(name, value, self.context)
+
+class TracedPseudoModule(PseudoModule):
+    def bind(self, ctx, args):
+        for name, value in zip(self.params, args):
+            ctx.trace_var(name, value, self.context, self.row_col)
+
 class PseudoBinding(Statement):
-    def __init__(self, name, func):
+    def __init__(self, name, func, arity=None, returns=None, ropes=None, context=False,
+            mutates=False):
         super().__init__()
 
         self.name = name
         self.func = func
+        # whether it changes an array or map it is passed
+        self.mutates = mutates
+
+        # natives declare their arity and result type up front; other Python
+        # functions are inspected once here and have their results sniffed
+        if arity is None:
+            arity = len(signature(func).parameters) - int(context)
 
-        self.params = [p.name for p in signature(func).parameters.values()]
+        if ropes is None:
+            ropes = getattr(func, 'keeps_ropes', False)
+
+        self.arity = arity
+        self.returns = returns
+        self.flatten = not ropes
+        self.pass_context = context
 
     def eval(self, ctx):
         raise PseudoRuntimeError(self.context, "Modules cannot be called like programs")
 
     def call(self, ctx, args, pos=None):
-        args = [Expression._get_arg(ctx, Expression._normalise_arg(arg)).value for arg in args]
+        self._check_arity(args)
+        return self._apply(ctx, [Expression._get_arg(ctx, arg).value for arg in args])
 
-        if len(args) != len(self.params):
-            raise PseudoRuntimeError(self.context, "Module takes {} argument(s) ({} given)".format(
-                    len(self.params), len(args)))
+    async def acall(self, ctx, args, pos=None):
+        self._check_arity(args)
+        return self._apply(ctx, [(await Expression._aget_arg(ctx, arg)).value for arg in args])
+
+    def _check_arity(self, args):
+        if len(args) != self.arity:
+            raise PseudoRuntimeError(None, "Module {} takes {} argument(s) ({} given)".format(
+                    self.name, self.arity, len(args)))
+
+    def _apply(self, ctx, args):
+        if self.flatten:
+            args = list(map(flatten, args))
+
+        if self.pass_context:
+            args.insert(0, ctx)
 
-        res = Token('symbol', None)
         try:
             res = self.func(*args)
-            if isinstance(res, int) or isinstance(res, float):
-                res = Token('number', res)
-            elif res is None:
-                res = Token('symbol', None)
-            else:
-                res = Token('string', str(res))
 
-            return res
+        except PseudoRuntimeError:
+            raise
 
         except Exception as e:
             traceback.print_exc()
-            raise PseudoRuntimeError(self.context, "Exception in bound module '{}'".format(self.name)) from e
\ No newline at end of file
+            raise PseudoRuntimeError(None, "Exception in bound module '{}'".format(self.name)) from e
+
+        if self.returns is not None:
+            return Token(self.returns, res)
+
+        return box(res)
+
+TRACED_NODES = {
+    VariableReference: TracedVariableReference,
+    IfStatement: TracedIfStatement,
+    PseudoModule: TracedPseudoModule
+}
+
+def traced(node, memo=None):
+    # Copies a parsed tree, swapping in the node classes that report to the
+    # tracing context. Shared nodes (a FOR loop's variable) stay shared.
+    if memo is None:
+        memo = {}
+
+    if isinstance(node, list):
+        return [traced(child, memo) for child in node]
+
+    elif type(node) is tuple:
+        return tuple(traced(child, memo) for child in node)
+
+    elif not isinstance(node, (Expression, Statement)):
+        return node
+
+    try:
+        return memo[id(node)]
+    except KeyError:
+        pass
+
+    res = memo[id(node)] = copy.copy(node)
+    res.__class__ = TRACED_NODES.get(type(node), type(node))
+    for name, value in vars(node).items():
+        setattr(res, name, traced(value, memo))
+
+    return res
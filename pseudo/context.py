@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
 
+import random
+
 from .token import Token, PseudoRuntimeError
+from .types import flatten
+from .stream import StreamSink, ConsoleInput
+from . import stdlib
 
 DEFAULT_CONSTANTS = {
     'TRUE': Token('number', 1),
@@ -17,58 +22,72 @@ DEFAULT_CONSTANTS = {
     'Infinity': Token('number', float('inf'))
 }
 
-class DefaultModules:
-
-    @staticmethod
-    def to_str(n): return str(n)
-    @staticmethod
-    def to_num(s):
-        try:
-            return float(s)
-        except ValueError:
-            return None
-
-    @staticmethod
-    def upper(s): return s.upper()
-    @staticmethod
-    def lower(s): return s.lower()
-
-    def modules():
-        mods = {
-            'to_str': DefaultModules.to_str,
-            'to_num': DefaultModules.to_num,
-            'upper': DefaultModules.upper,
-            'lower': DefaultModules.lower
-        }
-
-        from .code import PseudoBinding
-        return {name: PseudoBinding(name, f) for name,f in mods.items()}
+class RunState:
+    # Everything that belongs to one run of a program rather than to the
+    # program itself, shared by all contexts of that run. Programs, modules
+    # and their trees are only read while running, so any number of runs can
+    # share them, each with its own RunState.
+    def __init__(self, budget=None, output=None, input_source=None, rng=None):
+        self.budget = budget
+        self.output = StreamSink() if output is None else output
+        self.input_source = ConsoleInput() if input_source is None else input_source
+        self.rng = random.Random() if rng is None else rng
+
+        # for the asyncio runner, see code.cooperate
+        self.yield_every = None
+        self.ticks = 0
+
+        # processes for PARALLEL FOR, None for one per core
+        self.workers = None
+
+        # files opened by the program (see stream.open_file), or None when
+        # the run may not open files. Files leave it when they are closed.
+        self.files = set()
+
+    def close_files(self):
+        for f in list(self.files or ()):
+            f.close()
 
 class Context:
-    def __init__(self):
+    # whether PARALLEL FOR may hand iterations to other processes; contexts
+    # that record what happens keep them in this one
+    parallel = True
+
+    def __init__(self, number=float, modules=None, programs=None, state=None):
+        self.number = number
+        self.state = RunState() if state is None else state
+
+        # copied from the state for the interpreter's hot paths
+        self.budget = self.state.budget
+        self.output = self.state.output
+        self.input_source = self.state.input_source
+        self.rng = self.state.rng
+
         self.variables = {}
         self.variables.update(DEFAULT_CONSTANTS)
 
-        self.modules = {}
-        self.modules.update(DefaultModules.modules())
+        if modules is None:
+            modules = {}
+            modules.update(stdlib.modules())
 
-        self.programs = {}
+        self.modules = modules
+        self.programs = {} if programs is None else programs
 
-    def child_context(self, name=None):
-        new_ctx = Context()
-        new_ctx.modules = self.modules
-        new_ctx.programs = self.programs
-        return new_ctx
+    def child_context(self, name=None, scope=None):
+        return Context(self.number, self.modules, self.programs, self.state)
 
     def get_var(self, name):
         return self.variables.get(name)
 
-    def set_var(self, name, value, ctx=None, pos=None):
+    def set_var(self, name, value, ctx=None):
         if name in DEFAULT_CONSTANTS:
             raise PseudoRuntimeError(ctx, "Cannot reassign pre-defined variable {}".format(name))
 
         self.variables[name] = value
 
+    def trace_var(self, name, value, ctx=None, pos=None):
+        self.set_var(name, value, ctx)
+
     def get_module(self, name):
         return self.modules.get(name)
 
@@ -92,26 +111,46 @@ class Context:
     def trace_conditional(self, cond, value, pos=None):
         pass
 
+    def prepare(self, node):
+        # untraced contexts run the tree as parsed; tracing contexts swap in
+        # the traced variant, which is the only one that calls trace_var and
+        # trace_conditional
+        return node
+
+    def finish_trace(self, fp):
+        pass
+
 class TraceContext(Context):
-    def __init__(self, name=None):
-        super().__init__()
+    parallel = False
+
+    def __init__(self, name=None, number=float, modules=None, programs=None,
+            trace_filter=None, scope=None, state=None):
+        super().__init__(number, modules, programs, state)
         self.traces = []
         self.children = []
         self.name = name
 
-    def child_context(self, name):
-        new_ctx = TraceContext(name)
-        new_ctx.programs = self.programs
-        new_ctx.modules = self.modules
+        self.trace_filter = trace_filter
+        self.trace_count = 0
+        self.traced = trace_filter is None or trace_filter.scope(scope)
+
+    def child_context(self, name, scope=None):
+        new_ctx = TraceContext(name, self.number, self.modules, self.programs,
+                self.trace_filter, scope, self.state)
         self.children.append(new_ctx)
         return new_ctx
 
-    def set_var(self, name, value, ctx=None, pos=None):
-        super().set_var(name, value, ctx, pos)
+    def trace_var(self, name, value, ctx=None, pos=None):
+        self.set_var(name, value, ctx)
 
-        self.traces.append((pos, name, value))
+        if self.traced and (self.trace_filter is None or self.trace_filter.accept_var(self, name, pos)):
+            self.traces.append((pos, name, value))
 
     def trace_conditional(self, cond, value, pos=None):
+        if not self.traced or (self.trace_filter is not None
+                and not self.trace_filter.accept_conditional(self, cond, pos)):
+            return
+
         if value.value:
             value = Token('symbol', 'true')
         else:
@@ -119,36 +158,50 @@ class TraceContext(Context):
 
         self.traces.append((pos, str(cond), value))
 
-    def get_trace(self):
-
-        from tabulate import tabulate
+    def prepare(self, node):
+        from .code import traced
+        return traced(node)
 
+    def get_trace(self):
         res = ""
-        if self.name:
-            res += self.name + '\n'
-
-        if self.traces:
-            vars = []
-            for pos, name, value in self.traces:
-                if name not in vars:
-                    vars.append(name)
-
-            lines = []
-            for pos, name, value in self.traces:
-                line = []
-                row, col = pos
-                line.append(row)
-                for v in vars:
-                    if v == name:
-                        line.append(value.value)
-                    else:
-                        line.append(' ')
-
-                lines.append(line)
-
-            res += tabulate(lines, headers=(["Line"] + vars)) + '\n\n'
+        if self.traced:
+            res = format_trace_table(self.name, self.traces)
 
         for child in self.children:
             res += child.get_trace()
 
         return res
+
+    def finish_trace(self, fp):
+        fp.write(self.get_trace())
+
+def format_trace_table(name, traces):
+
+    from tabulate import tabulate
+
+    res = ""
+    if name:
+        res += name + '\n'
+
+    if traces:
+        vars = []
+        for pos, name, value in traces:
+            if name not in vars:
+                vars.append(name)
+
+        lines = []
+        for pos, name, value in traces:
+            line = []
+            row, col = pos
+            line.append(row)
+            for v in vars:
+                if v == name:
+                    line.append(flatten(value.value))
+                else:
+                    line.append(' ')
+
+            lines.append(line)
+
+        res += tabulate(lines, headers=(["Line"] + vars)) + '\n\n'
+
+    return res
@@ -1,8 +1,16 @@
 #!/usr/bin/env python3
 
+import inspect
+
 from .token import *
+from .types import PseudoArray, PseudoMap, Rope, Fixed, fixed_product
+from .stream import resolve, open_file
 
 class Expression:
+    # whether evaluating the node can reach INPUT, OUTPUT or a module call,
+    # i.e. whether the asyncio runner has to await it
+    waits = True
+
     def __init__(self):
         self.context = None
 
@@ -21,6 +29,22 @@ class Expression:
 
         return res
 
+    @staticmethod
+    async def _aget_arg(ctx, arg):
+        res = None
+        if isinstance(arg, Expression):
+            res = (await arg.aeval(ctx)) if arg.waits else arg.eval(ctx)
+
+        if res is None:
+            raise PseudoRuntimeError(None, "Invalid expression argument")
+
+        return res
+
+    async def aeval(self, ctx):
+        # the asyncio runner's entry point; nodes that can reach INPUT, OUTPUT
+        # or a module call override it
+        return self.eval(ctx)
+
     @staticmethod
     def _normalise_arg(arg):
         if isinstance(arg, Token) and arg.type == 'identifier':
@@ -38,6 +62,8 @@ class Expression:
         return arg
 
 class VariableReference(Expression):
+    waits = False
+
     def __init__(self, name):
         super().__init__()
         self.name = name
@@ -50,28 +76,142 @@ class VariableReference(Expression):
         return res
 
     def set(self, ctx, value):
-        ctx.set_var(self.name, value, self.context, self.row_col)
+        ctx.set_var(self.name, value, self.context)
 
     def __str__(self):
         return self.name
 
+class TracedVariableReference(VariableReference):
+    def set(self, ctx, value):
+        ctx.trace_var(self.name, value, self.context, self.row_col)
+
 class ModuleReference(Expression):
     def __init__(self, name, args):
         super().__init__()
         self.name = name
-        self.args = args
+        self.args = list(map(Expression._normalise_arg, args))
 
     def eval(self, ctx):
         res = ctx.get_module(self.name)
         if res is None:
             raise PseudoNameError(self.context, "Module {} is undefined or is not a module".format(self.name))
 
-        return res.call(ctx, self.args, self.row_col)
+        try:
+            return res.call(ctx, self.args, self.row_col)
+
+        except RecursionError:
+            # reported at the innermost call that can still raise it
+            raise PseudoRuntimeError(self.context, "Maximum recursion depth exceeded") from None
+
+    async def aeval(self, ctx):
+        res = ctx.get_module(self.name)
+        if res is None:
+            raise PseudoNameError(self.context, "Module {} is undefined or is not a module".format(self.name))
+
+        try:
+            return await res.acall(ctx, self.args, self.row_col)
+
+        except RecursionError:
+            raise PseudoRuntimeError(self.context, "Maximum recursion depth exceeded") from None
 
     def __str__(self):
         return "{}({})".format(self.name, ", ".join(map(str, self.args)))
 
+class IndexExpression(Expression):
+    def __init__(self, target, index):
+        super().__init__()
+        self.target = Expression._normalise_arg(target)
+        self.index = Expression._normalise_arg(index)
+        self.waits = self.target.waits or self.index.waits
+
+    def _container(self, ctx):
+        res = Expression._get_arg(ctx, self.target)
+        if res.type not in ('array', 'map'):
+            raise PseudoTypeError(self.context, "{} cannot be indexed".format(res.type))
+
+        return res.value
+
+    def eval(self, ctx):
+        container = self._container(ctx)
+        return container.get(Expression._get_arg(ctx, self.index), self.context)
+
+    async def aeval(self, ctx):
+        res = await Expression._aget_arg(ctx, self.target)
+        if res.type not in ('array', 'map'):
+            raise PseudoTypeError(self.context, "{} cannot be indexed".format(res.type))
+
+        return res.value.get(await Expression._aget_arg(ctx, self.index), self.context)
+
+    def set(self, ctx, value):
+        container = self._container(ctx)
+        container.set(Expression._get_arg(ctx, self.index), value, self.context)
+
+    def __str__(self):
+        return "{}[{}]".format(self.target, self.index)
+
+class ArrayExpression(Expression):
+    def __init__(self, items):
+        super().__init__()
+        self.items = list(map(Expression._normalise_arg, items))
+        self.waits = any(item.waits for item in self.items)
+
+    def eval(self, ctx):
+        return Token('array', PseudoArray(Expression._get_arg(ctx, item) for item in self.items))
+
+    async def aeval(self, ctx):
+        return Token('array', PseudoArray([await Expression._aget_arg(ctx, item) for item in self.items]))
+
+    def __str__(self):
+        return "[{}]".format(", ".join(map(str, self.items)))
+
+class MapExpression(Expression):
+    def __init__(self, pairs):
+        super().__init__()
+        self.pairs = [(Expression._normalise_arg(key), Expression._normalise_arg(value))
+                for key, value in pairs]
+        self.waits = any(key.waits or value.waits for key, value in self.pairs)
+
+    def eval(self, ctx):
+        res = PseudoMap()
+        for key, value in self.pairs:
+            res.set(Expression._get_arg(ctx, key), Expression._get_arg(ctx, value), self.context)
+
+        return Token('map', res)
+
+    async def aeval(self, ctx):
+        res = PseudoMap()
+        for key, value in self.pairs:
+            res.set(await Expression._aget_arg(ctx, key), await Expression._aget_arg(ctx, value), self.context)
+
+        return Token('map', res)
+
+    def __str__(self):
+        return "{{{}}}".format(", ".join("{}: {}".format(key, value) for key, value in self.pairs))
+
+class FileExpression(Expression):
+    # FILE path in FOR EACH line IN FILE path: opens the file for reading;
+    # the loop closes it when it ends
+    def __init__(self, path):
+        super().__init__()
+        self.path = Expression._normalise_arg(path)
+        self.waits = self.path.waits
+
+    def eval(self, ctx):
+        path = Expression._get_arg(ctx, self.path)
+        if path.type != 'string':
+            raise PseudoTypeError(self.context, "File name must be a string, got {}".format(path.type))
+
+        return Token('file', open_file(ctx.state, path.value, 'r', self.context))
+
+    async def aeval(self, ctx):
+        return self.eval(ctx)
+
+    def __str__(self):
+        return "FILE {}".format(self.path)
+
 class KeywordReference(Expression):
+    waits = False
+
     def __init__(self, name):
         super().__init__()
         self.name = name
@@ -83,6 +223,8 @@ class KeywordReference(Expression):
         return self.name.upper()
 
 class LiteralExpression(Expression):
+    waits = False
+
     def __init__(self, token):
         self.token = token
 
@@ -110,10 +252,10 @@ class UnaryExpression(Expression):
         self.operation = op.value
 
         self.argument = Expression._normalise_arg(arg)
+        self.waits = self.argument.waits
 
-    def _do_operation(self, ctx, op_type, func):
-        arg = Expression._get_arg(ctx, self.argument)
-
+    @staticmethod
+    def _do_operation(arg, op_type, func):
         if arg.type == op_type:
             res = func(arg.value)
             if isinstance(res, str):
@@ -124,27 +266,51 @@ class UnaryExpression(Expression):
         return None
 
     def eval(self, ctx):
+        return self._apply(ctx, Expression._get_arg(ctx, self.argument))
+
+    async def aeval(self, ctx):
+        return self._apply(ctx, await Expression._aget_arg(ctx, self.argument))
 
+    def _apply(self, ctx, arg):
         res = None
         if self.operation in NEG_OPERATORS:
-            res = self._do_operation(ctx, 'number', lambda x: -x)
+            res = self._do_operation(arg, 'number', lambda x: -x)
 
         elif self.operation in PLUS_OPERATORS:
-            res = self._do_operation(ctx, 'number', lambda x: +x)
+            res = self._do_operation(arg, 'number', lambda x: +x)
 
         elif self.operation in NOT_OPERATORS:
-            res = self._do_operation(ctx, 'number', lambda x: not x)
+            res = self._do_operation(arg, 'number', lambda x: not x)
 
         if res is None:
-            arg_type = Expression._get_arg(ctx, self.argument).type
-
-            raise PseudoTypeError(self.context, "{}({}) not supported".format(self.operation, arg_type))
+            raise PseudoTypeError(self.context, "{}({}) not supported".format(self.operation, arg.type))
 
         return res
 
     def __str__(self):
         return "{}{}".format(str(self.operation), str(self.argument))
 
+def _add(a, b):
+    if isinstance(a, (str, Rope)):
+        return Rope.concat(a, b)
+
+    return a + b
+
+# Operations on fixed point numbers with the same places, done directly on
+# their integer counts: (count1, count2, places) -> value
+FIXED_OPERATIONS = {}
+for _ops, _func in (
+        (ADD_OPERATORS, lambda a, b, p: Fixed(a + b, p)),
+        (SUB_OPERATORS, lambda a, b, p: Fixed(a - b, p)),
+        (MUL_OPERATORS, lambda a, b, p: Fixed(fixed_product(a, b, p), p)),
+        (EQ_OPERATORS, lambda a, b, p: int(a == b)),
+        (NEQ_OPERATORS, lambda a, b, p: int(a != b)),
+        (LT_OPERATORS, lambda a, b, p: int(a < b)),
+        (GT_OPERATORS, lambda a, b, p: int(a > b)),
+        (LE_OPERATORS, lambda a, b, p: int(a <= b)),
+        (GE_OPERATORS, lambda a, b, p: int(a >= b))):
+    FIXED_OPERATIONS.update(dict.fromkeys(_ops, _func))
+
 class BinaryExpression(Expression):
     def __init__(self, op, arg1, arg2):
         super().__init__()
@@ -152,14 +318,13 @@ class BinaryExpression(Expression):
 
         self.argument1 = Expression._normalise_arg(arg1)
         self.argument2 = Expression._normalise_arg(arg2)
+        self.waits = self.argument1.waits or self.argument2.waits
 
-    def _do_operation(self, ctx, op_type, func):
+    @staticmethod
+    def _do_operation(arg1, arg2, op_type, func):
         if isinstance(op_type, str):
             op_type = (op_type,)
 
-        arg1 = Expression._get_arg(ctx, self.argument1)
-        arg2 = Expression._get_arg(ctx, self.argument2)
-
         if arg1.type != arg2.type:
             return None
 
@@ -167,7 +332,7 @@ class BinaryExpression(Expression):
             return None
 
         res = func(arg1.value, arg2.value)
-        if isinstance(res, str):
+        if isinstance(res, (str, Rope)):
             return Token('string', res)
         elif res is None:
             return Token('symbol', None)
@@ -175,63 +340,76 @@ class BinaryExpression(Expression):
             return Token('number', res)
 
     def eval(self, ctx):
+        return self._apply(ctx, Expression._get_arg(ctx, self.argument1),
+                Expression._get_arg(ctx, self.argument2))
+
+    async def aeval(self, ctx):
+        return self._apply(ctx, await Expression._aget_arg(ctx, self.argument1),
+                await Expression._aget_arg(ctx, self.argument2))
+
+    def _apply(self, ctx, arg1, arg2):
+        a, b = arg1.value, arg2.value
+        if type(a) is Fixed and type(b) is Fixed and a.places == b.places:
+            func = FIXED_OPERATIONS.get(self.operation)
+            if func is not None:
+                return Token('number', func(a.raw, b.raw, a.places))
+
         #print("Eval with op {}:".format(self.operation))
         #print("Arg1: {}".format(self.argument1))
         #print("Arg2: {}".format(self.argument2))
         res = None
         if self.operation in ADD_OPERATORS:
-            res = self._do_operation(ctx, ('number', 'string'), lambda a,b: a + b)
+            res = self._do_operation(arg1, arg2, ('number', 'string'), _add)
+            if res is not None and res.type == 'string' and ctx.budget is not None:
+                ctx.budget.check_string(res.value, self.context)
 
         elif self.operation in SUB_OPERATORS:
-            res = self._do_operation(ctx, 'number', lambda a,b: a - b)
+            res = self._do_operation(arg1, arg2, 'number', lambda a,b: a - b)
 
         elif self.operation in MUL_OPERATORS:
-            res = self._do_operation(ctx, 'number', lambda a,b: a * b)
+            res = self._do_operation(arg1, arg2, 'number', lambda a,b: a * b)
 
         elif self.operation in DIV_OPERATORS:
             try:
-                res = self._do_operation(ctx, 'number', lambda a,b: a / b)
+                res = self._do_operation(arg1, arg2, 'number', lambda a,b: a / b)
             except ZeroDivisionError as e:
                 raise PseudoRuntimeError(self.context, 'Cannot divide by zero')
 
         elif self.operation in EQ_OPERATORS:
-            res = self._do_operation(ctx, ('number', 'string', 'symbol'), lambda a,b: int(a == b))
+            res = self._do_operation(arg1, arg2, ('number', 'string', 'symbol', 'array', 'map'), lambda a,b: int(a == b))
 
         elif self.operation in NEQ_OPERATORS:
-            res = self._do_operation(ctx, ('number', 'string', 'symbol'), lambda a,b: int(a != b))
+            res = self._do_operation(arg1, arg2, ('number', 'string', 'symbol', 'array', 'map'), lambda a,b: int(a != b))
 
         elif self.operation in LT_OPERATORS:
-            res = self._do_operation(ctx, 'number', lambda a,b: int(a < b))
+            res = self._do_operation(arg1, arg2, 'number', lambda a,b: int(a < b))
 
         elif self.operation in GT_OPERATORS:
-            res = self._do_operation(ctx, 'number', lambda a,b: int(a > b))
+            res = self._do_operation(arg1, arg2, 'number', lambda a,b: int(a > b))
 
         elif self.operation in LE_OPERATORS:
-            res = self._do_operation(ctx, 'number', lambda a,b: int(a <= b))
+            res = self._do_operation(arg1, arg2, 'number', lambda a,b: int(a <= b))
 
         elif self.operation in GE_OPERATORS:
-            res = self._do_operation(ctx, 'number', lambda a,b: int(a >= b))
+            res = self._do_operation(arg1, arg2, 'number', lambda a,b: int(a >= b))
             
         elif self.operation in AND_OPERATORS:
-            res = self._do_operation(ctx, 'number', lambda a,b: int(a and b))
+            res = self._do_operation(arg1, arg2, 'number', lambda a,b: int(a and b))
             
         elif self.operation in OR_OPERATORS:
-            res = self._do_operation(ctx, 'number', lambda a,b: int(a or b))
+            res = self._do_operation(arg1, arg2, 'number', lambda a,b: int(a or b))
             
         elif self.operation in BINARY_AND_OPERATORS:
-            res = self._do_operation(ctx, 'number', lambda a,b: int(a & b))
+            res = self._do_operation(arg1, arg2, 'number', lambda a,b: int(a & b))
             
         elif self.operation in BINARY_OR_OPERATORS:
-            res = self._do_operation(ctx, 'number', lambda a,b: int(a | b))
+            res = self._do_operation(arg1, arg2, 'number', lambda a,b: int(a | b))
             
         elif self.operation in BINARY_XOR_OPERATORS:
-            res = self._do_operation(ctx, 'number', lambda a,b: int(a ^ b))
+            res = self._do_operation(arg1, arg2, 'number', lambda a,b: int(a ^ b))
 
         if res is None:
-            arg1_type = Expression._get_arg(ctx, self.argument1).type
-            arg2_type = Expression._get_arg(ctx, self.argument2).type
-
-            raise PseudoTypeError(self.context, "{} {} {} not supported".format(arg1_type, self.operation, arg2_type))
+            raise PseudoTypeError(self.context, "{} {} {} not supported".format(arg1.type, self.operation, arg2.type))
 
         return res
 
@@ -244,69 +422,114 @@ class KeywordExpression(Expression):
         self.keyword = keyword.value
         self.arguments = list(map(Expression._normalise_arg, args))
 
+    def _program(self, ctx):
+        prog_name = self.arguments[0]
+
+        if not isinstance(prog_name, VariableReference):
+            raise PseudoTypeError(self.context, "Run target not a program reference")
+
+        prog = ctx.get_program(prog_name.name)
+        if not prog:
+            raise PseudoNameError(self.context,
+                    "Program {} is not defined or is not a program".format(prog_name.name))
+
+        return prog
+
+    def _input_target(self):
+        type_ = None
+        type_kw = self.arguments[0]
+        target = self.arguments[1]
+
+        if isinstance(type_kw, KeywordReference):
+            if type_kw.name in ('NUMBER', 'INTEGER', 'INT', 'FLOAT', 'REAL', 'STRING'):
+                type_ = type_kw.name
+
+        if not isinstance(target, VariableReference):
+            raise PseudoTypeError(self.context, "Input target not a variable reference")
+
+        prompt = "{}{}: ".format(target.name,
+                " ({})".format(type_.lower()) if type_ else "")
+
+        return type_, target, prompt
+
+    @staticmethod
+    def _input_value(ctx, type_, value):
+        # the value as a token, or None and what was expected instead
+        if type_ in ('NUMBER', 'FLOAT', 'REAL'):
+            try:
+                return Token('number', ctx.number(value)), None
+            except ValueError:
+                return None, "a number"
+
+        elif type_ in ('INTEGER', 'INT'):
+            try:
+                return Token('number', int(value)), None
+            except ValueError:
+                return None, "an integer"
+
+        elif type_ in ('STRING',):
+            return Token('string', value), None
+
+        try:
+            return Token('number', ctx.number(value)), None
+        except ValueError:
+            return Token('string', value), None
+
+    def _not_async(self, res):
+        # an async source or sink reached from a node run synchronously
+        if inspect.isawaitable(res):
+            res.close()
+            raise PseudoRuntimeError(self.context, "{} cannot wait for asynchronous {} here".format(
+                    self.keyword, "input" if self.keyword == 'INPUT' else "output"))
+
     def eval(self, ctx):
         res = Token('symbol', None)
         if self.keyword == "RUN":
-            prog_name = self.arguments[0]
+            res = self._program(ctx).eval(ctx)
+
+        elif self.keyword in ('OUTPUT', 'PRINT'):
+            written = ctx.output.write_line([Expression._get_arg(ctx, arg).value for arg in self.arguments])
+            if written is not None:
+                self._not_async(written)
 
-            if not isinstance(prog_name, VariableReference):
-                raise PseudoTypeError(self.context, "Run target not a program reference")
+        elif self.keyword == 'INPUT':
+            type_, target, prompt = self._input_target()
+
+            source = ctx.input_source
+            self._not_async(ctx.output.flush())
+            line = source.read_line(prompt, self.context)
+            self._not_async(line)
+            value, expected = self._input_value(ctx, type_, line)
+            while value is None:
+                line = source.retry(prompt, expected, line, self.context)
+                self._not_async(line)
+                value, expected = self._input_value(ctx, type_, line)
+
+            target.set(ctx, value)
+            res = value
 
-            prog = ctx.get_program(prog_name.name)
-            if not prog:
-                raise PseudoNameError(self.context,
-                        "Program {} is not defined or is not a program".format(prog_name.name))
+        return res
 
-            res = prog.eval(ctx)
+    async def aeval(self, ctx):
+        # sinks and sources may be synchronous or asynchronous here
+        res = Token('symbol', None)
+        if self.keyword == "RUN":
+            res = await self._program(ctx).aeval(ctx)
 
         elif self.keyword in ('OUTPUT', 'PRINT'):
-            for arg in self.arguments:
-                arg = Expression._get_arg(ctx, arg)
-                print(arg.value, end=' ')
-            print("", end='\n')
+            await resolve(ctx.output.write_line([(await Expression._aget_arg(ctx, arg)).value
+                    for arg in self.arguments]))
 
         elif self.keyword == 'INPUT':
-            type_ = None
-            type_kw = self.arguments[0]
-            target = self.arguments[1]
-
-            if isinstance(type_kw, KeywordReference):
-                if type_kw.name in ('NUMBER', 'INTEGER', 'INT', 'FLOAT', 'REAL', 'STRING'):
-                    type_ = type_kw.name
-
-            if not isinstance(target, VariableReference):
-                raise PseudoTypeError(self.context, "Input target not a variable reference")
-
-            prompt = "{}{}: ".format(target.name,
-                    " ({})".format(type_.lower()) if type_ else "")
-
-            value = input(prompt)
-            if type_ in ('NUMBER', 'FLOAT', 'REAL'):
-                while True:
-                    try:
-                        value = Token('number', float(value))
-                        break
-                    except ValueError:
-                        print("Please enter a number.")
-                        value = input(prompt)
-
-            elif type_ in ('INTEGER', 'INT'):
-                while True:
-                    try:
-                        value = Token('number', int(value))
-                        break
-                    except ValueError:
-                        print("Please enter an integer.")
-                        value = input(prompt)
-
-            elif type_ in ('STRING',):
-                value = Token('string', value)
-
-            else:
-                try:
-                    value = Token('number', float(value))
-                except ValueError:
-                    value = Token('string', value)
+            type_, target, prompt = self._input_target()
+
+            source = ctx.input_source
+            await resolve(ctx.output.flush())
+            line = await resolve(source.read_line(prompt, self.context))
+            value, expected = self._input_value(ctx, type_, line)
+            while value is None:
+                line = await resolve(source.retry(prompt, expected, line, self.context))
+                value, expected = self._input_value(ctx, type_, line)
 
             target.set(ctx, value)
             res = value
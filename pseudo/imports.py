@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import re
+import threading
+
+from .token import Token, FileTokeniser, PseudoRuntimeError, PseudoNameError
+from .code import Statement, PseudoModule
+
+# Imported files are scanned for these lines when they are imported, and
+# only parsed when one of their modules is first called
+MODULE_RE = re.compile(r'^[ \t]*MODULE[ \t]+([a-zA-Z_][a-zA-Z0-9_]*)', re.I | re.M)
+IMPORT_RE = re.compile(r'^[ \t]*IMPORT[ \t]+("([^"\\]|\\.)*"|\'([^\'\\]|\\.)*\')', re.I | re.M)
+
+def source_path(name):
+    # the absolute path of the file source was read from, or None for
+    # source that did not come from a file ('<stdin>', '<source>')
+    if name is None or name.startswith('<'):
+        return None
+
+    return os.path.abspath(name)
+
+def enable(tokeniser, name, importer=None):
+    # Lets the source read by tokeniser IMPORT files, relative to the file
+    # it was read from or else to the current directory, with importer (the
+    # default one of the process if None). Tokenisers that are not enabled
+    # reject IMPORT.
+    path = source_path(name)
+    tokeniser.origin = path
+    tokeniser.importer = importer
+    tokeniser.directory = os.getcwd() if path is None else os.path.dirname(path)
+
+def resolve_path(directory, path):
+    return os.path.normpath(os.path.join(directory, path))
+
+class Importer:
+    # The files imported through it, each scanned once and parsed at most
+    # once while it is unchanged. cache is a cache.ProgramCache to keep the
+    # parsed files in across processes, if any.
+    def __init__(self, cache=None):
+        self.cache = cache
+        self._libraries = {}
+        self._lock = threading.Lock()
+
+    def compile(self, fp, path, number):
+        from .unit import compile_file
+
+        if self.cache is not None:
+            return self.cache.compile(fp.read(), path, number)
+
+        return compile_file(fp, path, number, self)
+
+    def library(self, path, number, where):
+        try:
+            st = os.stat(path)
+            key = path, getattr(number, 'keywords', {}).get('places')
+            stamp = st.st_mtime_ns, st.st_size
+
+            with self._lock:
+                library = self._libraries.get(key)
+                if library is None or library.stamp != stamp:
+                    with open(path) as fp:
+                        library = self._libraries[key] = Library(self, path, number, stamp, fp.read())
+
+        except OSError as e:
+            raise PseudoRuntimeError(where, "Cannot import {}: {}".format(path, e.strerror))
+
+        return library
+
+    def libraries(self, path, number, where, chain=()):
+        # the file at path and every file it imports, each after the files it
+        # imports; chain is the files importing it
+        if path in chain:
+            cycle = chain[chain.index(path):] + (path,)
+            raise PseudoRuntimeError(where, "Import cycle: {}".format(" -> ".join(cycle)))
+
+        library = self.library(path, number, where)
+        res = []
+        for sub in library.imports:
+            for lib in self.libraries(sub, number, where, chain + (path,)):
+                if lib not in res:
+                    res.append(lib)
+
+        if library not in res:
+            res.append(library)
+
+        return res
+
+# used by tokenisers enabled without an importer of their own
+DEFAULT_IMPORTER = Importer()
+
+class Library:
+    # An imported file. names and imports come from scanning the file and
+    # modules is filled in when importer parses it.
+    def __init__(self, importer, path, number, stamp, text):
+        self.importer = importer
+        self.path = path
+        self.number = number
+        self.stamp = stamp
+
+        directory = os.path.dirname(path)
+        self.names = [m.group(1) for m in MODULE_RE.finditer(text)]
+        self.imports = [resolve_path(directory, _unquote(m.group(1), path)) for m in IMPORT_RE.finditer(text)]
+
+        self.modules = None
+        self.lock = threading.Lock()
+
+    def module(self, name, where):
+        if self.modules is None:
+            with self.lock:
+                if self.modules is None:
+                    self.modules = self._load(where)
+
+        res = self.modules.get(name)
+        if res is None:
+            raise PseudoNameError(where, "Module {} is not defined in {}".format(name, self.path))
+
+        return res
+
+    def _load(self, where):
+        try:
+            with open(self.path) as fp:
+                unit = self.importer.compile(fp, self.path, self.number)
+
+        except OSError as e:
+            raise PseudoRuntimeError(where, "Cannot import {}: {}".format(self.path, e.strerror))
+
+        errors = unit.errors + unit.link_errors
+        if errors:
+            raise PseudoRuntimeError(where, "Cannot import {}:\n{}".format(self.path, "\n".join(errors)))
+
+        modules = {}
+        for el in unit.elements:
+            if isinstance(el, PseudoModule):
+                modules[el.name] = el
+
+            elif not isinstance(el, ImportStatement):
+                raise PseudoRuntimeError(where, "Cannot import {}: it may only define modules "
+                        "and import files".format(self.path))
+
+        return modules
+
+def _unquote(literal, path):
+    return FileTokeniser(io.StringIO(literal), path).token().value
+
+class LazyModule:
+    # Stands in for a module of an imported file in a module table. The file
+    # is parsed when the module is first called; prepare is the context's
+    # (see Context.prepare), applied to the module then.
+    def __init__(self, library, name, where, prepare=None):
+        self.library = library
+        self.name = name
+        self.where = where
+        self.prepare = prepare
+        self.module = None
+
+    def resolve(self):
+        if self.module is None:
+            module = self.library.module(self.name, self.where)
+            self.module = module if self.prepare is None else self.prepare(module)
+
+        return self.module
+
+    def call(self, ctx, args, pos=None):
+        return self.resolve().call(ctx, args, pos)
+
+    async def acall(self, ctx, args, pos=None):
+        return await self.resolve().acall(ctx, args, pos)
+
+class ImportStatement(Statement):
+    # IMPORT "lib.psc" at the top level of a file. path is resolved when the
+    # statement is parsed, origin is the importing file, if any, and
+    # importer the Importer of the tokeniser it was parsed with.
+    waits = False
+
+    def __init__(self, path, origin=None, importer=None):
+        super().__init__()
+        self.path = path
+        self.origin = origin
+        self.importer = importer
+
+    def lazy_modules(self, number, prepare=None):
+        chain = () if self.origin is None else (self.origin,)
+        importer = self.importer or DEFAULT_IMPORTER
+        res = []
+        for library in importer.libraries(self.path, number, self.context, chain):
+            for name in library.names:
+                res.append((name, LazyModule(library, name, self.context, prepare)))
+
+        return res
+
+    def define(self, ctx):
+        for name, module in self.lazy_modules(ctx.number, ctx.prepare):
+            current = ctx.get_module(name)
+            if isinstance(current, LazyModule) and current.library is module.library:
+                # imported before, e.g. by two files that both import it
+                continue
+
+            ctx.def_module(name, module, self.context)
+
+    def eval(self, ctx):
+        self.define(ctx)
+        return Token('symbol', None)
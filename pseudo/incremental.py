@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+import re
+import bisect
+
+from .token import Tokeniser, FileTokeniser, ParseError
+from .code import PseudoModule, PseudoProgram
+from .parse import pseudo_code_element, skip_eol
+from . import imports
+
+# lines where parsing starts again after a parse error
+RECOVER_RE = re.compile(r'[ \t]*((MODULE|PROGRAM)\b|IMPORT[ \t]*["\'])', re.I)
+
+LINE_RE = re.compile(r'\r?\n')
+
+class LineTokeniser(FileTokeniser):
+    # Tokenises a document's lines from the given row on, only reading as far
+    # as it is asked to. end_row is the row the last token other than an end
+    # of line ends on, which is where the element parsed last ends.
+    def __init__(self, lines, row, name='<document>', number=float):
+        Tokeniser.__init__(self, name, number)
+        self.lines = lines
+        self.row = row
+        self.end_row = row
+
+    def token(self):
+        row = self.raw_context()[0]
+        res = super().token()
+        if res.type == 'string':
+            # strings can go on over several lines, up to where the lexer is
+            self.end_row = self.row
+        elif res.type != 'eol':
+            self.end_row = row
+
+        return res
+
+    def read_row(self):
+        # the last row the lexer has read from
+        return self.row - 1 if self.col == 1 else self.row
+
+class Block:
+    # Top-level elements that start on the line the one before ends on are
+    # kept together. start and end are the rows of their first and last
+    # tokens; first and last are the lines the block owns, up to the next
+    # block. errors are (row, col, message).
+    def __init__(self, start):
+        self.start = start
+        self.end = start
+        self.first = start
+        self.last = start
+        self.elements = []
+        self.errors = []
+
+    def shift(self, delta):
+        self.start += delta
+        self.end += delta
+        self.first += delta
+        self.last += delta
+        self.errors = [(row + delta, col, msg) for row, col, msg in self.errors]
+
+class Document:
+    # A source file being edited. It is parsed once as a list of blocks and
+    # an edit only lexes and parses again from the block before the one it
+    # starts in, until a block starts where an unchanged one did; the blocks
+    # after that are kept and moved. Kept elements are not parsed again, so
+    # the positions in their error contexts are those of when they were.
+    #
+    # Unlike running a file, parsing goes on after a parse error, from the
+    # next line starting with MODULE, PROGRAM or IMPORT.
+    def __init__(self, text='', name='<document>', number=float):
+        self.name = name
+        self.number = number
+        self.replace(text)
+
+    @property
+    def text(self):
+        return "\n".join(self.lines)
+
+    @property
+    def elements(self):
+        return [el for block in self.blocks for el in block.elements]
+
+    def _tokeniser(self, row):
+        res = LineTokeniser(self.lines, row, self.name, self.number)
+        imports.enable(res, self.name)
+        return res
+
+    def _recover(self, row):
+        for index in range(row - 1, len(self.lines)):
+            if RECOVER_RE.match(self.lines[index]):
+                return index + 1
+
+        return len(self.lines) + 1
+
+    def _parse(self, row, stop=None):
+        # Parses blocks from row on. Returns them and, if stop(start) was
+        # true for the start of a block, that start; the block there is not
+        # parsed.
+        blocks = []
+        tok = self._tokeniser(row)
+        while True:
+            try:
+                start = skip_eol(tok)[0]
+            except EOFError:
+                return blocks, None
+
+            merge = blocks and start <= blocks[-1].end
+            if not merge and stop is not None and stop(start):
+                return blocks, start
+
+            if not merge:
+                blocks.append(Block(start))
+
+            block = blocks[-1]
+            try:
+                with tok.ready_context():
+                    block.elements.append(pseudo_code_element(tok))
+
+                block.end = tok.end_row
+
+            except (ParseError, EOFError, RecursionError) as e:
+                if isinstance(e, RecursionError):
+                    e = ParseError(tok, "Too deeply nested to parse")
+
+                if isinstance(e, ParseError) and e.row_col is not None:
+                    row, col = e.row_col
+                    msg = e.message
+                else:
+                    row, col, msg = start, 1, "Unexpected end of file"
+
+                block.errors.append((row, col, msg))
+                resume = self._recover(max(start + 1, row, tok.read_row()))
+                block.end = max(block.end, resume - 1)
+                tok = self._tokeniser(resume)
+
+    def _bounds(self):
+        for index, block in enumerate(self.blocks):
+            block.first = 1 if index == 0 else block.start
+            if index + 1 < len(self.blocks):
+                block.last = self.blocks[index + 1].start - 1
+            else:
+                block.last = len(self.lines)
+
+    def _in_range(self, row, col):
+        return 1 <= row <= len(self.lines) and 1 <= col <= len(self.lines[row-1]) + 1
+
+    def edit(self, start, end, text):
+        # Replaces the text from start up to end, both (row, col) positions
+        # as in error messages. Returns the row parsing started again at and
+        # the number of blocks parsed.
+        (row1, col1), (row2, col2) = start, end
+        if not (self._in_range(row1, col1) and self._in_range(row2, col2)
+                and (row1, col1) <= (row2, col2)):
+            raise ValueError("Edit range {}:{} to {}:{} is not in the document".format(
+                    row1, col1, row2, col2))
+
+        before = self.lines[row1-1][:col1-1]
+        after = self.lines[row2-1][col2-1:]
+        new = LINE_RE.split(before + text + after)
+        self.lines[row1-1:row2] = new
+        delta = len(new) - (row2 - row1 + 1)
+
+        # an edit can end the block before the one it is in early, e.g. by
+        # starting a MODULE that block was recovering up to
+        index = max(0, bisect.bisect_right([block.first for block in self.blocks], row1) - 2)
+        restart = self.blocks[index].first if self.blocks else 1
+
+        kept = {block.start: k for k, block in enumerate(self.blocks) if k > index and block.start > row2}
+        blocks, at = self._parse(restart, lambda row: row - delta in kept)
+
+        tail = []
+        if at is not None:
+            tail = self.blocks[kept[at - delta]:]
+            for block in tail:
+                block.shift(delta)
+
+        self.blocks = self.blocks[:index] + blocks + tail
+        self._bounds()
+        return restart, len(blocks)
+
+    def replace(self, text):
+        self.lines = LINE_RE.split(text)
+        self.blocks = self._parse(1)[0]
+        self._bounds()
+
+    def diagnostics(self):
+        # parse errors and modules or programs defined twice, as
+        # (row, col, message) in order
+        res = []
+        defined = set()
+        for block in self.blocks:
+            res.extend(block.errors)
+            for el in block.elements:
+                if isinstance(el, (PseudoModule, PseudoProgram)):
+                    kind = 'Module' if isinstance(el, PseudoModule) else 'Program'
+                    if (kind, el.name) in defined:
+                        res.append((block.start, 1, "{} {} already defined".format(kind, el.name)))
+                    defined.add((kind, el.name))
+
+        return sorted(res)
+
+    def symbols(self):
+        # (kind, name, first row, last row) of each module and program
+        res = []
+        for block in self.blocks:
+            for el in block.elements:
+                if isinstance(el, PseudoModule):
+                    res.append(('module', el.name, block.start, block.end))
+                elif isinstance(el, PseudoProgram):
+                    res.append(('program', el.name, block.start, block.end))
+
+        return res
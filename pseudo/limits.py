@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import time
+
+from .token import PseudoLimitError
+from .context import DEFAULT_CONSTANTS
+
+# The clock is read about every CLOCK_SECONDS, and at most every CLOCK_STEPS
+# steps. The steps between readings follow how long the last ones took, so a
+# loop around a slow native still stops soon after the deadline.
+CLOCK_STEPS = 1000
+CLOCK_SECONDS = 0.01
+
+class Budget:
+    # Shared by every context of a run. Loops charge their body's statement
+    # count (plus one for the condition) per iteration and module calls
+    # charge their body once per call, so a run is stopped within one loop
+    # iteration or call of running out. Live variables are counted over all
+    # active calls; string sizes are checked as strings are concatenated.
+    def __init__(self, steps=None, seconds=None, variables=None, string_size=None,
+            clock=time.monotonic):
+        self.steps = steps
+        self.seconds = seconds
+        self.variables = variables
+        self.string_size = string_size
+
+        self.clock = clock
+        self.last_clock = clock()
+        self.deadline = None if seconds is None else self.last_clock + seconds
+        self.clock_steps = 1
+        self.next_clock = 1
+
+        self.used = 0
+        self.live = 0
+
+    def step(self, cost, ctx, where):
+        self.used += cost
+
+        if self.steps is not None and self.used > self.steps:
+            raise PseudoLimitError(where, "Step budget of {} exceeded".format(self.steps))
+
+        if self.deadline is not None and self.used >= self.next_clock:
+            self.check_clock(where)
+
+        if self.variables is not None and self.live + frame_size(ctx) > self.variables:
+            raise PseudoLimitError(where, "Limit of {} live variables exceeded".format(self.variables))
+
+    def check_clock(self, where):
+        now = self.clock()
+        if now > self.deadline:
+            raise PseudoLimitError(where, "Time limit of {}s exceeded".format(self.seconds))
+
+        elapsed = now - self.last_clock
+        if elapsed > CLOCK_SECONDS:
+            self.clock_steps = max(1, int(self.clock_steps * CLOCK_SECONDS / elapsed))
+        else:
+            self.clock_steps = min(CLOCK_STEPS, self.clock_steps * 2)
+
+        self.last_clock = now
+        self.next_clock = self.used + self.clock_steps
+
+    def enter(self, caller, cost, where):
+        self.step(cost, caller, where)
+        self.live += frame_size(caller)
+
+    def leave(self, caller):
+        self.live -= frame_size(caller)
+
+    def share(self):
+        # limits for work done elsewhere on behalf of this run, out of what
+        # is left; the work's steps are charged here when it is done
+        steps = None if self.steps is None else max(0, self.steps - self.used)
+        seconds = None if self.deadline is None else max(0.0, self.deadline - self.clock())
+        return dict(steps=steps, seconds=seconds, variables=self.variables, string_size=self.string_size)
+
+    def check_string(self, value, where):
+        if self.string_size is not None and len(value) > self.string_size:
+            raise PseudoLimitError(where, "String of {} characters exceeds the limit of {}".format(
+                    len(value), self.string_size))
+
+def frame_size(ctx):
+    return len(ctx.variables) - len(DEFAULT_CONSTANTS)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import argparse
+from urllib.parse import urlparse, unquote
+
+from .version import APP_NAME, APP_VERSION
+from .incremental import Document
+
+# A language server speaking JSON-RPC over stdin and stdout, for editors.
+# Documents are kept as incremental.Document and edits are applied as they
+# come, so only the blocks around an edit are parsed again. It publishes
+# diagnostics after every change and answers document symbol requests. A
+# message the server cannot handle is answered with an error if it is a
+# request and logged to stderr if it is a notification; either way the
+# server goes on.
+
+SYNC_INCREMENTAL = 2
+SEVERITY_ERROR = 1
+SYMBOL_KINDS = {'program': 2, 'module': 12}
+
+PARSE_ERROR = -32700
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+class InvalidParams(Exception):
+    pass
+
+def read_message(fp):
+    # None at the end of the input
+    length = None
+    while True:
+        line = fp.readline()
+        if not line:
+            return None
+
+        line = line.strip()
+        if not line:
+            break
+
+        name, _, value = line.decode('ascii').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+
+    if length is None:
+        return None
+
+    return json.loads(fp.read(length).decode('utf-8'))
+
+def write_message(fp, msg):
+    body = json.dumps(msg).encode('utf-8')
+    fp.write("Content-Length: {}\r\n\r\n".format(len(body)).encode('ascii') + body)
+    fp.flush()
+
+def document_name(uri):
+    # IMPORT paths are relative to the file a document is saved as
+    parts = urlparse(uri)
+    if parts.scheme == 'file':
+        return unquote(parts.path)
+
+    return '<{}>'.format(uri)
+
+def error_message(e):
+    if isinstance(e, InvalidParams):
+        return str(e)
+
+    if isinstance(e, KeyError):
+        return "Missing parameter {}".format(e)
+
+    return "{}: {}".format(type(e).__name__, e)
+
+def position(row, col):
+    return {'line': row - 1, 'character': col - 1}
+
+class LanguageServer:
+    def __init__(self, out):
+        self.out = out
+        self.documents = {}
+        self.shut_down = False
+
+    def send(self, msg):
+        msg['jsonrpc'] = '2.0'
+        write_message(self.out, msg)
+
+    def publish(self, uri):
+        doc = self.documents.get(uri)
+        diagnostics = []
+        for row, col, msg in doc.diagnostics() if doc is not None else ():
+            diagnostics.append({
+                'range': {'start': position(row, col), 'end': position(row, col + 1)},
+                'severity': SEVERITY_ERROR,
+                'source': APP_NAME,
+                'message': msg,
+            })
+
+        self.send({'method': 'textDocument/publishDiagnostics',
+                'params': {'uri': uri, 'diagnostics': diagnostics}})
+
+    def initialize(self, params):
+        return {
+            'capabilities': {
+                'textDocumentSync': {'openClose': True, 'change': SYNC_INCREMENTAL},
+                'documentSymbolProvider': True,
+            },
+            'serverInfo': {'name': APP_NAME, 'version': APP_VERSION},
+        }
+
+    def shutdown(self, params):
+        self.shut_down = True
+        return None
+
+    def did_open(self, params):
+        item = params['textDocument']
+        self.documents[item['uri']] = Document(item['text'], document_name(item['uri']))
+        self.publish(item['uri'])
+
+    def document(self, uri):
+        try:
+            return self.documents[uri]
+        except (KeyError, TypeError):
+            raise InvalidParams("Document {} is not open".format(uri))
+
+    def did_change(self, params):
+        uri = params['textDocument']['uri']
+        doc = self.document(uri)
+        for change in params['contentChanges']:
+            if 'range' in change:
+                start, end = change['range']['start'], change['range']['end']
+                doc.edit((start['line'] + 1, start['character'] + 1),
+                        (end['line'] + 1, end['character'] + 1), change['text'])
+            else:
+                doc.replace(change['text'])
+
+        self.publish(uri)
+
+    def did_close(self, params):
+        uri = params['textDocument']['uri']
+        self.documents.pop(uri, None)
+        self.publish(uri)
+
+    def document_symbol(self, params):
+        doc = self.document(params['textDocument']['uri'])
+        res = []
+        for kind, name, first, last in doc.symbols():
+            full = {'start': position(first, 1), 'end': position(last, len(doc.lines[last-1]) + 1)}
+            res.append({'name': name, 'kind': SYMBOL_KINDS[kind], 'range': full,
+                    'selectionRange': {'start': position(first, 1), 'end': position(first, 1)}})
+
+        return res
+
+    REQUESTS = {
+        'initialize': initialize,
+        'shutdown': shutdown,
+        'textDocument/documentSymbol': document_symbol,
+    }
+
+    NOTIFICATIONS = {
+        'textDocument/didOpen': did_open,
+        'textDocument/didChange': did_change,
+        'textDocument/didClose': did_close,
+    }
+
+    def handle(self, msg):
+        if not isinstance(msg, dict):
+            print("{} lsp: ignoring message {!r}".format(APP_NAME, msg), file=sys.stderr)
+            return
+
+        method = msg.get('method')
+        params = msg.get('params') or {}
+
+        if 'id' not in msg:
+            handler = self.NOTIFICATIONS.get(method)
+            try:
+                if handler is not None:
+                    handler(self, params)
+            except Exception as e:
+                print("{} lsp: ignoring {}: {}".format(APP_NAME, method, error_message(e)),
+                        file=sys.stderr)
+            return
+
+        handler = self.REQUESTS.get(method)
+        if handler is None:
+            self.send({'id': msg['id'], 'error': {'code': METHOD_NOT_FOUND,
+                    'message': "Unknown method {}".format(method)}})
+            return
+
+        try:
+            res = {'result': handler(self, params)}
+        except (InvalidParams, KeyError, TypeError, ValueError, IndexError) as e:
+            res = {'error': {'code': INVALID_PARAMS, 'message': error_message(e)}}
+        except Exception as e:
+            res = {'error': {'code': INTERNAL_ERROR, 'message': error_message(e)}}
+
+        res['id'] = msg['id']
+        self.send(res)
+
+    def serve(self, fp):
+        # returns the exit status asked for by the client
+        while True:
+            try:
+                msg = read_message(fp)
+            except ValueError as e:
+                self.send({'id': None, 'error': {'code': PARSE_ERROR, 'message': error_message(e)}})
+                continue
+
+            if msg is None:
+                return 1
+
+            if isinstance(msg, dict) and msg.get('method') == 'exit':
+                return 0 if self.shut_down else 1
+
+            self.handle(msg)
+
+def lsp_main(argv):
+    parser = argparse.ArgumentParser(prog="{} lsp".format(APP_NAME),
+            description="Run a language server on stdin and stdout, publishing parse errors "
+                        "and the modules and programs of open files.")
+    parser.parse_args(argv)
+
+    return LanguageServer(sys.stdout.buffer).serve(sys.stdin.buffer)
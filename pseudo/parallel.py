@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+
+import os
+import pickle
+import random
+
+from .token import Token, PseudoRuntimeError, PseudoTypeError, PseudoContinue
+from . import token
+from .expr import Expression, VariableReference, IndexExpression, KeywordExpression, ModuleReference
+from .code import (Statement, AssignmentStatement, IfStatement, ForStatement, ForEachStatement,
+        WhileStatement, BreakStatement, ContinueStatement, ReturnStatement, PseudoModule,
+        PseudoBinding)
+from .context import Context, RunState, DEFAULT_CONSTANTS
+from .limits import Budget
+from .stream import BufferSink, LineInput
+from .imports import LazyModule
+from . import stdlib
+
+# fewer iterations than this run in the current process
+MIN_PARALLEL = 2
+
+# chunks handed out per worker, so that uneven iterations even out
+CHUNKS_PER_WORKER = 4
+
+_pool = None
+_pool_workers = None
+
+def get_pool(workers):
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        from concurrent.futures import ProcessPoolExecutor
+        if _pool is not None:
+            _pool.shutdown()
+
+        _pool, _pool_workers = ProcessPoolExecutor(workers), workers
+
+    return _pool
+
+def default_workers():
+    return os.cpu_count() or 1
+
+class ParallelForStatement(ForStatement):
+    # PARALLEL FOR i <- a TO b ... NEXT. The bounds are evaluated once and
+    # the iterations are independent: the loop variable and everything the
+    # body assigns are local to an iteration, which the parser checks (see
+    # loop_problems). Chunks of iterations run in a pool of processes, each
+    # with a copy of the variables the body reads, and their output is
+    # written in iteration order. Afterwards the loop variable and the
+    # variables the body assigns are left as a FOR would leave them.
+    #
+    # Modules can change arrays and maps they are passed, which a process
+    # would only do to its own copy, so a loop that passes variables to a
+    # module that may do so (see may_change_arguments) runs in this process.
+    def __init__(self, start_expr, end_expr, stmt_list=[]):
+        super().__init__(start_expr, end_expr, stmt_list)
+
+        reads, writes = set(), set()
+        for stmt in stmt_list:
+            _collect(stmt, reads, writes)
+
+        loop_var = self.variable.name
+        self.free = sorted(reads - writes - {loop_var} - set(DEFAULT_CONSTANTS))
+        self.assigned = sorted(writes - {loop_var})
+        self.passed = sorted({node.name for node in _walk(stmt_list) if isinstance(node, ModuleReference)
+                and any(_passes_variable(arg, loop_var) for arg in node.args)})
+
+    def _bounds(self, ctx):
+        start = Expression._get_arg(ctx, self.start_expr.value)
+        end = Expression._get_arg(ctx, self.end_expr)
+        if start.type != 'number' or end.type != 'number':
+            raise PseudoTypeError(self.context, "PARALLEL FOR bounds must be numbers")
+
+        count = int(end.value - start.value) + 1 if end.value >= start.value else 0
+        return start.value, count
+
+    def _variables(self, ctx):
+        res = []
+        for name in self.free:
+            value = ctx.get_var(name)
+            if value is None:
+                continue
+
+            if value.type == 'file':
+                raise PseudoTypeError(self.context, "PARALLEL FOR cannot use the file in {}, since "
+                        "its iterations may run in other processes".format(name))
+
+            res.append((name, value))
+
+        return res
+
+    def _changes_arguments(self, ctx):
+        seen = set()
+        return any(may_change_arguments(ctx.get_module(name), ctx.modules, seen) for name in self.passed)
+
+    def _finish(self, ctx, first, count, variables):
+        # variables are the (name, value) the body assigned last, in order
+        for name, value in variables:
+            ctx.set_var(name, value, self.context)
+
+        self.variable.set(ctx, Token('number', first + count - 1 if count else first))
+
+    def run_range(self, ctx, first, count):
+        budget = ctx.budget
+        cost = len(self.stmt_list) + 1
+
+        for k in range(count):
+            if budget is not None:
+                budget.step(cost, ctx, self.context)
+
+            self.variable.set(ctx, Token('number', first + k))
+            for stmt in self.stmt_list:
+                try:
+                    stmt.eval(ctx)
+
+                except PseudoContinue:
+                    break
+
+    def last_values(self, ctx):
+        # files stay in the process that opened them, so they are not kept
+        return [(name, ctx.variables[name]) for name in self.assigned
+                if name in ctx.variables and ctx.variables[name].type != 'file']
+
+    def _run_here(self, ctx, first, count, variables):
+        iter_ctx = ctx.child_context("PARALLEL FOR", None)
+        for name, value in variables:
+            iter_ctx.variables[name] = value
+
+        self.run_range(iter_ctx, first, count)
+        self._finish(ctx, first, count, self.last_values(iter_ctx))
+
+    def _submit(self, ctx, first, count, workers, variables):
+        modules = {}
+        for name, module in ctx.modules.items():
+            if isinstance(module, LazyModule):
+                # the workers get every imported module parsed
+                module = module.resolve()
+
+            if isinstance(module, PseudoModule):
+                modules[name] = module
+
+        try:
+            payload = pickle.dumps((self, modules, ctx.number, variables, ctx.state.files is not None),
+                    pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            raise PseudoRuntimeError(self.context, "PARALLEL FOR cannot copy its variables and "
+                    "modules to other processes: {}".format(e))
+
+        limits = {} if ctx.budget is None else ctx.budget.share()
+
+        pool = get_pool(workers)
+        chunks = min(count, workers * CHUNKS_PER_WORKER)
+        size, extra = divmod(count, chunks)
+
+        futures = []
+        for index in range(chunks):
+            chunk = size + (index < extra)
+            futures.append(pool.submit(run_chunk, payload, first, chunk, ctx.rng.getrandbits(64), limits))
+            first += chunk
+
+        return futures
+
+    def _pooled(self, ctx):
+        first, count = self._bounds(ctx)
+        variables = self._variables(ctx)
+        workers = ctx.state.workers
+        if workers is None:
+            workers = default_workers()
+
+        if workers <= 1 or count < MIN_PARALLEL or not ctx.parallel or self._changes_arguments(ctx):
+            self._run_here(ctx, first, count, variables)
+            return None
+
+        return first, count, self._submit(ctx, first, count, workers, variables)
+
+    def _merge(self, ctx, result, futures, last):
+        text, used, error, variables = result
+        ctx.output.write(text)
+
+        if error is not None:
+            for future in futures:
+                future.cancel()
+
+            if ctx.budget is not None:
+                ctx.budget.used += used
+
+            kind, msg = error
+            raise getattr(token, kind)(None, msg)
+
+        if ctx.budget is not None:
+            ctx.budget.step(used, ctx, self.context)
+
+        # a later chunk's values replace an earlier one's
+        last.update(variables)
+
+    def eval(self, ctx):
+        pooled = self._pooled(ctx)
+        if pooled is not None:
+            first, count, futures = pooled
+            last = {}
+            for future in futures:
+                self._merge(ctx, future.result(), futures, last)
+
+            self._finish(ctx, first, count, last.items())
+
+        return Token('symbol', None)
+
+    async def aeval(self, ctx):
+        import asyncio
+
+        pooled = self._pooled(ctx)
+        if pooled is not None:
+            first, count, futures = pooled
+            last = {}
+            for future in futures:
+                self._merge(ctx, await asyncio.wrap_future(future), futures, last)
+
+            self._finish(ctx, first, count, last.items())
+
+        return Token('symbol', None)
+
+def run_chunk(payload, first, count, seed, limits):
+    loop, modules, number, variables, files = pickle.loads(payload)
+
+    table = dict(stdlib.modules())
+    table.update(modules)
+
+    output = BufferSink()
+    budget = Budget(**limits)
+    state = RunState(budget, output, LineInput(()), random.Random(seed))
+    # a PARALLEL FOR inside a worker runs in the worker
+    state.workers = 1
+    if not files:
+        state.files = None
+
+    ctx = Context(number, table, {}, state)
+    for name, value in variables:
+        ctx.variables[name] = value
+
+    error, variables = None, []
+    try:
+        loop.run_range(ctx, first, count)
+        variables = loop.last_values(ctx)
+
+    except PseudoRuntimeError as e:
+        error = type(e).__name__, str(e)
+
+    except RecursionError:
+        error = 'PseudoRuntimeError', "Maximum recursion depth exceeded"
+
+    finally:
+        state.close_files()
+
+    return output.getvalue(), budget.used, error, variables
+
+def _walk(node):
+    # every expression and statement in a tree
+    if isinstance(node, (list, tuple)):
+        for child in node:
+            yield from _walk(child)
+
+    elif isinstance(node, (Expression, Statement)):
+        yield node
+        for value in vars(node).values():
+            yield from _walk(value)
+
+def _passes_variable(arg, loop_var):
+    # whether a module argument can be an array or map held in a variable
+    if isinstance(arg, VariableReference):
+        return arg.name != loop_var
+
+    return isinstance(arg, IndexExpression)
+
+def may_change_arguments(module, modules, seen):
+    # Whether a module may change an array or map it is passed: a native
+    # declared to, or a module that assigns any element or passes variables
+    # on to such a module. seen holds the modules already looked at.
+    if isinstance(module, LazyModule):
+        module = module.resolve()
+
+    if isinstance(module, PseudoBinding):
+        return module.mutates
+
+    if not isinstance(module, PseudoModule) or module.name in seen:
+        return False
+
+    seen.add(module.name)
+    for node in _walk(module.stmt_list):
+        if isinstance(node, AssignmentStatement) and isinstance(node.target, IndexExpression):
+            return True
+
+        if (isinstance(node, ModuleReference) and any(_passes_variable(arg, None) for arg in node.args)
+                and may_change_arguments(modules.get(node.name), modules, seen)):
+            return True
+
+    return False
+
+def _collect(node, reads, writes):
+    # every variable read and assigned anywhere in a tree
+    if isinstance(node, (list, tuple)):
+        for child in node:
+            _collect(child, reads, writes)
+
+    elif isinstance(node, VariableReference):
+        reads.add(node.name)
+
+    elif isinstance(node, (Expression, Statement)):
+        target = _target(node)
+        if target is not None:
+            writes.add(target)
+
+        for value in vars(node).values():
+            _collect(value, reads, writes)
+
+def _target(node):
+    # the variable a statement assigns, if any
+    if isinstance(node, AssignmentStatement):
+        target = node.target
+        while isinstance(target, IndexExpression):
+            target = target.target
+
+        if isinstance(target, VariableReference):
+            return target.name
+
+    elif isinstance(node, ForEachStatement):
+        return node.variable.name
+
+    elif isinstance(node, KeywordExpression) and node.keyword == 'INPUT':
+        return node.arguments[1].name
+
+    return None
+
+def _reads(node):
+    reads = set()
+    _collect(node, reads, set())
+    return reads
+
+def loop_problems(loop):
+    # Why the iterations of a PARALLEL FOR might depend on each other: a
+    # variable assigned in the body that may be read before it is assigned in
+    # the same iteration, elements assigned in an array or map that is not
+    # the iteration's own, and statements that only make sense in order.
+    # Returns (position, message) pairs.
+    writes = set()
+    _collect(loop.stmt_list, set(), writes)
+
+    problems = []
+    _check_block(loop.stmt_list, {loop.variable.name}, writes, 0, problems)
+    return problems
+
+def _check_block(stmt_list, local, writes, depth, problems):
+    for stmt in stmt_list:
+        _check(stmt, local, writes, depth, problems)
+
+def _check_reads(node, pos, local, writes, problems):
+    for name in sorted(_reads(node)):
+        if name in writes and name not in local:
+            problems.append((pos, "{} is read before it is assigned, so its value would "
+                    "carry over from another iteration".format(name)))
+
+def _check(stmt, local, writes, depth, problems):
+    pos = stmt.row_col
+
+    if isinstance(stmt, AssignmentStatement):
+        _check_reads(stmt.value, pos, local, writes, problems)
+        if isinstance(stmt.target, IndexExpression):
+            _check_reads(stmt.target.index, pos, local, writes, problems)
+            name = _target(stmt)
+            if name not in local:
+                problems.append((pos, "Elements of {} are assigned but {} is not assigned in the "
+                        "loop".format(name, name)))
+
+        else:
+            local.add(stmt.target.name)
+
+    elif isinstance(stmt, KeywordExpression) and stmt.keyword in ('INPUT', 'RUN'):
+        problems.append((pos, "{} cannot be used in PARALLEL FOR".format(stmt.keyword)))
+
+    elif isinstance(stmt, IfStatement):
+        _check_reads(stmt.condition, pos, local, writes, problems)
+        then_local, else_local = set(local), set(local)
+        _check_block(stmt.then_stmt_list, then_local, writes, depth, problems)
+        _check_block(stmt.else_stmt_list, else_local, writes, depth, problems)
+        local |= then_local & else_local
+
+    elif isinstance(stmt, ForStatement):
+        _check(stmt.start_expr, local, writes, depth, problems)
+        _check_reads(stmt.end_expr, pos, local, writes, problems)
+        _check_block(stmt.stmt_list, set(local), writes, depth + 1, problems)
+
+    elif isinstance(stmt, ForEachStatement):
+        _check_reads(stmt.iterable, pos, local, writes, problems)
+        _check_block(stmt.stmt_list, local | {stmt.variable.name}, writes, depth + 1, problems)
+
+    elif isinstance(stmt, WhileStatement):
+        _check_reads(stmt.condition, pos, local, writes, problems)
+        _check_block(stmt.stmt_list, set(local), writes, depth + 1, problems)
+
+    elif isinstance(stmt, BreakStatement):
+        if depth == 0:
+            problems.append((pos, "BREAK cannot be used in PARALLEL FOR"))
+
+    elif isinstance(stmt, ContinueStatement):
+        pass
+
+    elif isinstance(stmt, ReturnStatement):
+        problems.append((pos, "RETURN cannot be used in PARALLEL FOR"))
+
+    else:
+        _check_reads(stmt, pos, local, writes, problems)
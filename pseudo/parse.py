@@ -3,6 +3,8 @@
 from .token import *
 from .expr import *
 from .code import *
+from .parallel import ParallelForStatement, loop_problems
+from .imports import ImportStatement, resolve_path
 
 def skip_eol(ctx):
     res = ctx.raw_context()
@@ -16,11 +18,31 @@ def skip_eol(ctx):
 
 def pseudo_code_element(ctx):
     with ctx.ready_context(skip_eol(ctx)):
-        res = pseudo_program(ctx)
+        res = pseudo_import(ctx)
+        if not res: res = pseudo_program(ctx)
         if not res: res = statement(ctx)
 
         return res.assoc(ctx)
 
+def pseudo_import(ctx):
+    if ctx.peek_token() == Token('keyword', 'IMPORT'):
+        ctx.token()
+
+        with ctx.ready_context():
+            path = ctx.token()
+            if path.type != 'string':
+                raise ParseExpected(ctx, 'file name', path)
+
+        with ctx.ready_context():
+            eol = ctx.token()
+            if eol != Token('eol', ''):
+                raise ParseExpected(ctx, 'end of statement', eol)
+
+        if ctx.directory is None:
+            raise ParseError(ctx, "IMPORT cannot be used here")
+
+        return ImportStatement(resolve_path(ctx.directory, path.value), ctx.origin, ctx.importer)
+
 def pseudo_program(ctx):
     token = ctx.peek_token()
     if token == Token('keyword', 'PROGRAM'):
@@ -186,9 +208,36 @@ def iteration(ctx):
 
         return WhileStatement(while_cond, stmt_list).assoc(ctx)
 
+    elif iter_kw == Token('keyword', 'PARALLEL'):
+        ctx.token() # consume peek
+
+        with ctx.ready_context():
+            for_kw = ctx.peek_token()
+            if for_kw != Token('keyword', 'FOR'):
+                raise ParseExpected(ctx, 'FOR', for_kw)
+
+        loop = iteration(ctx)
+        if not isinstance(loop, ForStatement) or isinstance(loop, ParallelForStatement):
+            with ctx.ready_context(loop.row_col):
+                raise ParseError(ctx, "PARALLEL needs a FOR ... TO loop")
+
+        parallel = ParallelForStatement(loop.start_expr, loop.end_expr, loop.stmt_list)
+        parallel.context, parallel.row_col = loop.context, loop.row_col
+
+        problems = loop_problems(parallel)
+        if problems:
+            pos, msg = problems[0]
+            with ctx.ready_context(pos):
+                raise ParseError(ctx, "Iterations of PARALLEL FOR are not independent: {}".format(msg))
+
+        return parallel
+
     elif iter_kw == Token('keyword', 'FOR'):
         ctx.token() # consume peek
 
+        if ctx.peek_token() == Token('keyword', 'EACH'):
+            return for_each(ctx)
+
         with ctx.ready_context():
             start_expr = assignment_stmt(ctx)
             if not start_expr:
@@ -212,6 +261,50 @@ def iteration(ctx):
 
         return ForStatement(start_expr, end_expr, stmt_list).assoc(ctx)
 
+def for_each(ctx):
+    ctx.token() # consume EACH
+
+    with ctx.ready_context():
+        ident = ctx.token()
+        if ident.type != 'identifier':
+            raise ParseExpected(ctx, 'loop variable', ident)
+
+        var = VariableReference(ident.value).assoc(ctx)
+
+    with ctx.ready_context():
+        in_kw = ctx.token()
+        if in_kw.type != 'identifier' or in_kw.value.upper() != 'IN':
+            raise ParseExpected(ctx, 'IN', in_kw)
+
+    with ctx.ready_context():
+        file_kw = ctx.peek_token()
+        is_file = file_kw.type == 'identifier' and file_kw.value.upper() == 'FILE'
+        if is_file:
+            ctx.token()
+            after = ctx.peek_token()
+            # FOR EACH line IN file, with a variable called file
+            if after == Token('eol', '') or after.type == 'keyword':
+                return for_each_body(ctx, var, VariableReference(file_kw.value).assoc(ctx))
+
+    with ctx.ready_context():
+        iterable = conditional_expr(ctx)
+        if not iterable:
+            raise ParseExpected(ctx, 'file name' if is_file else 'expression')
+
+        if is_file:
+            iterable = FileExpression(iterable).assoc(ctx)
+
+    return for_each_body(ctx, var, iterable)
+
+def for_each_body(ctx, var, iterable):
+    then_kw = ctx.peek_token()
+    if then_kw.type == 'keyword' and then_kw.value in ('THEN', 'DO'):
+        ctx.token()
+
+    stmt_list = statement_list(ctx, end_kw='NEXT')
+
+    return ForEachStatement(var, iterable, stmt_list).assoc(ctx)
+
 def jump(ctx):
     jump_kw = ctx.peek_token()
     if jump_kw == Token('keyword', 'BREAK'):
@@ -274,7 +367,12 @@ def assignment_stmt(ctx):
     if target.type == 'identifier':
         ctx.token()
 
-        target = VariableReference(target.value).assoc(ctx)
+        with ctx.ready_context():
+            target = postfix_ops(ctx, VariableReference(target.value).assoc(ctx))
+
+        # a bare module call, e.g. sort(values)
+        if isinstance(target, ModuleReference) and ctx.peek_token() == Token('eol', ''):
+            return target
 
         with ctx.ready_context():
             op = ctx.token()
@@ -317,6 +415,10 @@ def postfix_expr(ctx):
         if not arg:
             raise ParseExpected(ctx, 'expression')
 
+        return postfix_ops(ctx, arg)
+
+def postfix_ops(ctx, arg):
+    while True:
         op = ctx.peek_token()
         if op == Token('symbol', '('):
             ctx.token()
@@ -341,7 +443,26 @@ def postfix_expr(ctx):
 
             arg = ModuleReference(arg.name, args).assoc(ctx)
 
-    return arg
+        elif op == Token('symbol', '['):
+            arg = index_expr(ctx, arg)
+
+        else:
+            return arg
+
+def index_expr(ctx, target):
+    ctx.token() # consume [
+
+    with ctx.ready_context():
+        index = expression(ctx)
+        if not index:
+            raise ParseExpected(ctx, 'index expression')
+
+    with ctx.ready_context():
+        end_bracket = ctx.token()
+        if end_bracket != Token('symbol', ']'):
+            raise ParseExpected(ctx, "']'", end_bracket)
+
+    return IndexExpression(target, index).assoc(ctx)
 
 def argument_list(ctx):
     args = []
@@ -370,6 +491,12 @@ def primary_expr(ctx):
     elif res.type == 'identifier':
         return VariableReference(res.value).assoc(ctx)
 
+    elif res == Token('symbol', '['):
+        return array_literal(ctx)
+
+    elif res == Token('symbol', '{'):
+        return map_literal(ctx)
+
     elif res != Token('symbol', '('):
         raise ParseExpected(ctx, 'expression', res)
 
@@ -382,6 +509,50 @@ def primary_expr(ctx):
 
     return res
 
+def array_literal(ctx):
+    items = []
+    if ctx.peek_token() != Token('symbol', ']'):
+        items = argument_list(ctx)
+
+    with ctx.ready_context():
+        end_bracket = ctx.token()
+        if end_bracket != Token('symbol', ']'):
+            raise ParseExpected(ctx, "']'", end_bracket)
+
+    return ArrayExpression(items).assoc(ctx)
+
+def map_literal(ctx):
+    pairs = []
+    while ctx.peek_token() != Token('symbol', '}'):
+        with ctx.ready_context():
+            key = expression(ctx)
+            if not key:
+                raise ParseExpected(ctx, 'map key')
+
+        with ctx.ready_context():
+            colon = ctx.token()
+            if colon != Token('symbol', ':'):
+                raise ParseExpected(ctx, "':'", colon)
+
+        with ctx.ready_context():
+            value = expression(ctx)
+            if not value:
+                raise ParseExpected(ctx, 'map value')
+
+        pairs.append((key, value))
+
+        if ctx.peek_token() != Token('symbol', ','):
+            break
+
+        ctx.token()
+
+    with ctx.ready_context():
+        end_bracket = ctx.token()
+        if end_bracket != Token('symbol', '}'):
+            raise ParseExpected(ctx, "'}'", end_bracket)
+
+    return MapExpression(pairs).assoc(ctx)
+
 def _binary_expr(ops, _next_expr):
     def _curr_expr(ctx):
         with ctx.ready_context():
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import copy
+import time
+
+from .expr import Expression
+from .code import Statement, PseudoModule, PseudoProgram
+from .context import Context
+
+TOP_LEVEL = '<top>'
+
+class Profiler:
+    # Keys are ('line', scope, row), ('module', name) or ('program', name).
+    # Every entered key is timed; self time excludes the time of keys entered
+    # inside it, and recursive calls only count towards cumulative time once.
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.stats = {}
+        self.stacks = {}
+
+        self.stack = []
+        self.active = {}
+
+    def enter(self, key):
+        self.active[key] = self.active.get(key, 0) + 1
+        self.stack.append([key, self.clock(), 0.0])
+
+    def exit(self):
+        key, start, children = self.stack.pop()
+        elapsed = self.clock() - start
+        own = elapsed - children
+
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+        self.active[key] -= 1
+
+        try:
+            stats = self.stats[key]
+        except KeyError:
+            stats = self.stats[key] = [0, 0.0, 0.0]
+
+        stats[0] += 1
+        stats[2] += own
+        if not self.active[key]:
+            stats[1] += elapsed
+
+        path = tuple(frame[0] for frame in self.stack) + (key,)
+        self.stacks[path] = self.stacks.get(path, 0.0) + own
+
+    def rows(self, kinds):
+        rows = [(key, hits, cumulative, own)
+                for key, (hits, cumulative, own) in self.stats.items() if key[0] in kinds]
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows
+
+    def report(self, fp):
+        from tabulate import tabulate
+
+        total = sum(own for hits, cumulative, own in self.stats.values())
+        fp.write("Total time: {:.6f}s\n\n".format(total))
+
+        calls = [(kind.upper(), name, hits, cumulative, own)
+                for (kind, name), hits, cumulative, own in self.rows(('module', 'program'))]
+        fp.write(tabulate(calls, headers=("Kind", "Name", "Calls", "Cumulative", "Self"),
+                floatfmt=".6f") + '\n\n')
+
+        lines = [(scope, row, hits, cumulative, own,
+                    "{:.1%}".format(own / total) if total else '-')
+                for (kind, scope, row), hits, cumulative, own in self.rows(('line',))]
+        fp.write(tabulate(lines, headers=("Scope", "Line", "Hits", "Cumulative", "Self", "% Self"),
+                floatfmt=".6f") + '\n')
+
+    def write_stacks(self, fp):
+        # collapsed stacks, one "frame;frame;frame microseconds" line per path
+        for path, own in sorted(self.stacks.items()):
+            fp.write("{} {}\n".format(";".join(map(frame_label, path)), int(round(own * 1e6))))
+
+def frame_label(key):
+    if key[0] == 'line':
+        return "{}:{}".format(key[1], key[2])
+
+    return "{} {}".format(key[0].upper(), key[1])
+
+class ProfiledStatement(Statement):
+    def __init__(self, stmt, key, profiler):
+        self.stmt = stmt
+        self.key = key
+        self.profiler = profiler
+
+        self.context = getattr(stmt, 'context', None)
+        self.row_col = getattr(stmt, 'row_col', None)
+
+    def eval(self, ctx):
+        self.profiler.enter(self.key)
+        try:
+            return self.stmt.eval(ctx)
+        finally:
+            self.profiler.exit()
+
+    def __str__(self):
+        return str(self.stmt)
+
+class ProfiledPseudoProgram(PseudoProgram):
+    def eval(self, ctx, pos=None):
+        self.profiler.enter(('program', self.name))
+        try:
+            return super().eval(ctx, pos)
+        finally:
+            self.profiler.exit()
+
+class ProfiledPseudoModule(PseudoModule):
+    def call(self, ctx, args, pos=None):
+        self.profiler.enter(('module', self.name))
+        try:
+            return super().call(ctx, args, pos)
+        finally:
+            self.profiler.exit()
+
+PROFILED_NODES = {
+    PseudoProgram: ProfiledPseudoProgram,
+    PseudoModule: ProfiledPseudoModule
+}
+
+def profiled(node, profiler, scope=TOP_LEVEL, memo=None):
+    # Copies a parsed tree like code.traced, wrapping every statement of every
+    # statement list so that it reports its line to the profiler.
+    if memo is None:
+        memo = {}
+
+    if isinstance(node, list):
+        return [profiled(child, profiler, scope, memo) for child in node]
+
+    elif type(node) is tuple:
+        return tuple(profiled(child, profiler, scope, memo) for child in node)
+
+    elif not isinstance(node, (Expression, Statement)):
+        return node
+
+    try:
+        return memo[id(node)]
+    except KeyError:
+        pass
+
+    res = memo[id(node)] = copy.copy(node)
+    if type(node) in PROFILED_NODES:
+        res.__class__ = PROFILED_NODES[type(node)]
+        res.profiler = profiler
+        scope = node.name
+
+    for name, value in vars(node).items():
+        value = profiled(value, profiler, scope, memo)
+        if name.endswith('stmt_list'):
+            value = [wrap_statement(stmt, profiler, scope) for stmt in value]
+
+        setattr(res, name, value)
+
+    return res
+
+def wrap_statement(stmt, profiler, scope):
+    row_col = getattr(stmt, 'row_col', None)
+    return ProfiledStatement(stmt, ('line', scope, row_col[0] if row_col else 0), profiler)
+
+class ProfileContext(Context):
+    # Only the global context prepares nodes, so child contexts are plain.
+    parallel = False
+
+    def __init__(self, profiler, number=float, modules=None, programs=None, state=None):
+        super().__init__(number, modules, programs, state)
+        self.profiler = profiler
+
+    def prepare(self, node):
+        node = profiled(node, self.profiler)
+        if isinstance(node, (PseudoModule, PseudoProgram)):
+            return node
+
+        return wrap_statement(node, self.profiler, TOP_LEVEL)
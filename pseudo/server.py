@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import json
+import math
+import signal
+import socket
+import hashlib
+import argparse
+import tempfile
+from collections import OrderedDict
+
+from .version import APP_NAME, APP_VERSION
+from .batch import run_unit
+from .stream import LineInput
+from .types import fixed_kind
+from .unit import compile_file
+from .cache import ProgramCache
+
+# Requests are single lines of JSON and each gets a single line of JSON back.
+# A connection may send any number of requests. A request is
+#
+#   {"source": "...", "input": ["line", ...], "timeout": 2, "max_steps": 100000, "fixed": 2}
+#
+# or {"program_id": "..."} instead of "source" to run a program sent before.
+# The response is a run result (status, output, error, seconds, steps) plus
+# the program_id, or {"status": "bad_request", "error": "..."}. A request
+# that fails inside the server gets {"status": "error", "error": "..."} and
+# the worker goes on with the next one.
+
+class BadRequest(Exception):
+    pass
+
+def program_id(source):
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+class Worker:
+    # Runs in each preforked process. The max_units compiled units used last
+    # are kept per worker; sources are shared between workers through the
+    # store directory, so a program sent to one worker can be run by id on
+    # any other.
+    def __init__(self, store, timeout=None, max_steps=None, cache=None, max_units=256):
+        self.store = store
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self.cache = cache
+        self.max_units = max_units
+        self.units = OrderedDict()
+
+    def _source(self, req):
+        if 'source' in req:
+            source = req['source']
+            if not isinstance(source, str):
+                raise BadRequest("'source' must be a string")
+
+            ident = program_id(source)
+            path = os.path.join(self.store, ident + '.psc')
+            if not os.path.exists(path):
+                fd, tmp = tempfile.mkstemp(dir=self.store)
+                with os.fdopen(fd, 'w') as fp:
+                    fp.write(source)
+                os.replace(tmp, path)
+
+            return ident, source
+
+        ident = req.get('program_id')
+        if not isinstance(ident, str) or not ident.isalnum():
+            raise BadRequest("Request needs a 'source' or a 'program_id'")
+
+        try:
+            with open(os.path.join(self.store, ident + '.psc')) as fp:
+                return ident, fp.read()
+        except FileNotFoundError:
+            raise BadRequest("Unknown program_id {}".format(ident))
+
+    def _limit(self, req, name, default):
+        value = req.get(name)
+        if value is None:
+            return default
+        if (isinstance(value, bool) or not isinstance(value, (int, float))
+                or not math.isfinite(value) or value < 0):
+            raise BadRequest("'{}' must be a non-negative number".format(name))
+
+        return value if default is None else min(value, default)
+
+    def handle(self, req):
+        if not isinstance(req, dict):
+            raise BadRequest("Request must be a JSON object")
+
+        ident, source = self._source(req)
+        places = req.get('fixed')
+        if places is not None and (isinstance(places, bool) or not isinstance(places, int) or places < 0):
+            raise BadRequest("'fixed' must be a non-negative whole number of places")
+
+        name = req.get('name', '<request>')
+        if not isinstance(name, str):
+            raise BadRequest("'name' must be a string")
+
+        lines = req.get('input', [])
+        if not isinstance(lines, list) or not all(isinstance(line, (str, int, float)) for line in lines):
+            raise BadRequest("'input' must be a list of lines")
+
+        timeout = self._limit(req, 'timeout', self.timeout)
+        max_steps = self._limit(req, 'max_steps', self.max_steps)
+
+        res = run_unit(self._unit(ident, source, name, places), LineInput(map(str, lines)), timeout, max_steps)
+        res['program_id'] = ident
+        return res
+
+    def _unit(self, ident, source, name, places):
+        key = (ident, places)
+        try:
+            self.units.move_to_end(key)
+            return self.units[key]
+        except KeyError:
+            pass
+
+        number = float if places is None else fixed_kind(places)
+        if self.cache is not None:
+            unit = self.cache.compile(source, name, number, imports=False)
+        else:
+            unit = compile_file(io.StringIO(source), name, number, imports=False)
+
+        self.units[key] = unit
+        if len(self.units) > self.max_units:
+            self.units.popitem(last=False)
+
+        return unit
+
+    def serve(self, sock):
+        while True:
+            conn, addr = sock.accept()
+            with conn, conn.makefile('rwb') as fp:
+                for line in fp:
+                    try:
+                        res = self.handle(json.loads(line.decode('utf-8')))
+                    except (ValueError, BadRequest) as e:
+                        res = {'status': 'bad_request', 'error': str(e)}
+                    except Exception as e:
+                        res = {'status': 'error', 'error': "Internal error: {}: {}".format(
+                                type(e).__name__, e)}
+
+                    fp.write(json.dumps(res).encode('utf-8') + b'\n')
+                    fp.flush()
+
+def spawn(worker, sock):
+    pid = os.fork()
+    if pid:
+        return pid
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    try:
+        worker.serve(sock)
+    finally:
+        os._exit(1)
+
+def _terminate(signum, frame):
+    raise SystemExit(0)
+
+def serve_main(argv):
+    parser = argparse.ArgumentParser(prog="{} serve".format(APP_NAME),
+            description="Run programs sent over a Unix domain socket in preforked worker processes.")
+
+    parser.add_argument("socket", help="Path of the Unix domain socket to listen on.")
+
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, metavar="N",
+            help="Number of worker processes (default: one per core).")
+
+    parser.add_argument("--store", metavar="DIR",
+            help="Directory for the sources of programs sent so far (default: a temporary directory).")
+
+    parser.add_argument("--cache-dir", metavar="DIR",
+            help="Keep parsed programs in this directory, shared with other servers and batch runs.")
+
+    parser.add_argument("--timeout", type=float, default=10.0, metavar="SECONDS",
+            help="Longest time a run may take; requests may ask for less (default 10).")
+
+    parser.add_argument("--max-steps", type=int, metavar="N",
+            help="Most steps a run may take; requests may ask for fewer.")
+
+    parser.add_argument("--max-units", type=int, default=256, metavar="N",
+            help="Number of compiled programs each worker keeps, dropping the least "
+                 "recently used (default 256).")
+
+    args = parser.parse_args(argv)
+
+    try:
+        cache = ProgramCache(args.cache_dir) if args.cache_dir else None
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    store = args.store or tempfile.mkdtemp(prefix='pseudo-serve-')
+    os.makedirs(store, exist_ok=True)
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(args.socket)
+    sock.listen(128)
+
+    worker = Worker(store, args.timeout, args.max_steps, cache, max(1, args.max_units))
+    children = set()
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        for _ in range(max(1, args.workers)):
+            children.add(spawn(worker, sock))
+
+        print("{} {} serving on {} with {} workers".format(APP_NAME, APP_VERSION, args.socket,
+                len(children)), file=sys.stderr)
+
+        while True:
+            pid, status = os.wait()
+            if pid in children:
+                children.discard(pid)
+                children.add(spawn(worker, sock))
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        sock.close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+import io
+import csv
+import math
+import numbers
+
+from .token import Token, PseudoRuntimeError, PseudoTypeError
+from .types import PseudoArray, PseudoMap, Rope, Fixed, box
+from .stream import PseudoFile, open_file as _open_file
+
+# name -> (function, arity, return token type or None, options)
+NATIVES = {}
+
+_modules = None
+
+def native(*names, arity, returns=None, ropes=False, context=False, mutates=False):
+    # Declares a native module. With a declared return type the result is
+    # boxed without inspecting it; ropes=True passes Rope strings through
+    # unflattened, context=True passes the calling context as first argument
+    # and mutates=True marks one that changes an array or map in place.
+    def register(func):
+        for name in names:
+            NATIVES[name] = (func, arity, returns, {'ropes': ropes, 'context': context,
+                    'mutates': mutates})
+
+        return func
+
+    return register
+
+def modules():
+    global _modules
+    if _modules is None:
+        from .code import PseudoBinding
+        _modules = {name: PseudoBinding(name, func, arity=arity, returns=returns, **options)
+                for name, (func, arity, returns, options) in NATIVES.items()}
+
+    return _modules
+
+def _array(arr):
+    if not isinstance(arr, PseudoArray):
+        raise PseudoTypeError(None, "Expected an array, got {}".format(type(arr).__name__))
+
+    return arr
+
+def _map(m):
+    if not isinstance(m, PseudoMap):
+        raise PseudoTypeError(None, "Expected a map, got {}".format(type(m).__name__))
+
+    return m
+
+def _number(x):
+    # any number kind: float, Fixed, or e.g. Decimal through the Python API
+    if not isinstance(x, (numbers.Number, Fixed)):
+        raise PseudoTypeError(None, "Expected a number, got {}".format(type(x).__name__))
+
+    return x
+
+def _string(s):
+    if not isinstance(s, str):
+        raise PseudoTypeError(None, "Expected a string, got {}".format(type(s).__name__))
+
+    return s
+
+def _file(f):
+    if not isinstance(f, PseudoFile):
+        raise PseudoTypeError(None, "Expected a file, got {}".format(type(f).__name__))
+
+    return f
+
+def _finite(x):
+    return not isinstance(x, float) or math.isfinite(x)
+
+def _integer(x, what):
+    if not _finite(_number(x)) or x != int(x):
+        raise PseudoTypeError(None, "{} must be an integer".format(what))
+
+    return int(x)
+
+# conversion
+
+@native('to_str', arity=1, returns='string')
+def to_str(n): return str(n)
+
+@native('to_num', arity=1, context=True)
+def to_num(ctx, s):
+    try:
+        return ctx.number(s)
+    except (ValueError, TypeError):
+        return None
+
+# strings
+
+@native('upper', arity=1, returns='string')
+def upper(s): return _string(s).upper()
+
+@native('lower', arity=1, returns='string')
+def lower(s): return _string(s).lower()
+
+@native('substring', arity=3, returns='string')
+def substring(s, start, count):
+    start = _integer(start, "Substring start")
+    count = _integer(count, "Substring length")
+    if start < 0 or count < 0:
+        raise PseudoRuntimeError(None, "Substring start and length must not be negative")
+
+    return _string(s)[start : start+count]
+
+@native('find', arity=2, returns='number')
+def find(s, sub): return _string(s).find(_string(sub))
+
+@native('length', 'LENGTH', arity=1, returns='number', ropes=True)
+def length(x):
+    if isinstance(x, (str, Rope, PseudoArray, PseudoMap)):
+        return len(x)
+
+    raise PseudoTypeError(None, "{} has no length".format(type(x).__name__))
+
+# maths
+
+@native('sqrt', arity=1, returns='number')
+def sqrt(x):
+    if _number(x) < 0:
+        raise PseudoRuntimeError(None, "Cannot take the square root of a negative number")
+
+    return math.sqrt(x)
+
+@native('floor', arity=1, returns='number')
+def floor(x): return math.floor(x) if _finite(_number(x)) else x
+
+@native('ceil', arity=1, returns='number')
+def ceil(x): return math.ceil(x) if _finite(_number(x)) else x
+
+@native('abs', arity=1, returns='number')
+def abs_(x): return abs(_number(x))
+
+@native('round', arity=2, returns='number')
+def round_(x, places): return round(_number(x), _integer(places, "Number of places"))
+
+# each run has its own generator, so seeding one run does not affect another
+
+@native('random', arity=0, returns='number', context=True)
+def random(ctx): return ctx.rng.random()
+
+@native('random_int', arity=2, returns='number', context=True)
+def random_int(ctx, low, high):
+    return ctx.rng.randint(_integer(low, "Lower bound"), _integer(high, "Upper bound"))
+
+@native('seed', arity=1, returns='symbol', context=True)
+def seed(ctx, n):
+    n = _number(n)
+    ctx.rng.seed(int(n) if _finite(n) and n == int(n) else float(n))
+
+# arrays
+
+@native('array', arity=2, returns='array')
+def array(size, value):
+    size = _integer(size, "Array size")
+    if size < 0:
+        raise PseudoTypeError(None, "Array size must not be negative")
+
+    return PseudoArray.filled(size, box(value))
+
+@native('sum', arity=1, returns='number')
+def sum_(arr): return sum(_array(arr).numbers())
+
+@native('min', arity=1, returns='number')
+def min_(arr):
+    values = _array(arr).numbers()
+    if not values:
+        raise PseudoRuntimeError(None, "min() of an empty array")
+
+    return min(values)
+
+@native('max', arity=1, returns='number')
+def max_(arr):
+    values = _array(arr).numbers()
+    if not values:
+        raise PseudoRuntimeError(None, "max() of an empty array")
+
+    return max(values)
+
+@native('sort', arity=1, returns='array', mutates=True)
+def sort(arr):
+    _array(arr).sort()
+    return arr
+
+@native('fill', arity=2, returns='array', mutates=True)
+def fill(arr, value):
+    _array(arr).fill(box(value))
+    return arr
+
+# maps
+
+@native('has', 'HAS', arity=2, returns='number')
+def has(m, key): return int(_map(m).has(key))
+
+@native('keys', 'KEYS', arity=1, returns='array')
+def keys(m): return PseudoArray(_map(m).keys())
+
+# files, read and written a line at a time
+
+@native('open_file', arity=2, returns='file', context=True)
+def open_file(ctx, path, mode): return _open_file(ctx.state, _string(path), _string(mode))
+
+@native('read_line', arity=1)
+def read_line(f): return _file(f).read_line()
+
+@native('eof', 'EOF', arity=1, returns='number')
+def eof(f): return int(_file(f).at_end())
+
+@native('write_line', arity=2, returns='symbol')
+def write_line(f, value): _file(f).write(str(value) + '\n')
+
+@native('close', arity=1, returns='symbol')
+def close(f): _file(f).close()
+
+# csv fields, split and joined by the csv module's C parser
+
+@native('split_csv', arity=1, returns='array')
+def split_csv(line):
+    for fields in csv.reader((_string(line),)):
+        return PseudoArray(Token('string', field) for field in fields)
+
+    return PseudoArray()
+
+@native('join_csv', arity=1, returns='string')
+def join_csv(arr):
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator='').writerow([str(t.value) for t in _array(arr)])
+    return buf.getvalue()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+import sys
+import inspect
+
+from .token import PseudoRuntimeError, PseudoEOFError, PseudoTypeError
+
+def format_line(values):
+    return "".join([str(value) + ' ' for value in values]) + '\n'
+
+async def resolve(value):
+    # lets the asyncio runner use synchronous sinks and sources as well
+    if inspect.isawaitable(value):
+        return await value
+
+    return value
+
+class OutputSink:
+    # Collects OUTPUT lines and hands them on in large chunks. The interpreter
+    # flushes it before anything else reaches the terminal (INPUT prompts,
+    # results and errors) so that the order of output is kept.
+    #
+    # The chunks are written to fp, or without a file to whatever sys.stdout
+    # is when it flushes, so it follows redirect_stdout. Subclasses send them
+    # elsewhere by overriding emit.
+    def __init__(self, fp=None, buffer_size=1 << 16):
+        self.fp = fp
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.size = 0
+
+    def write_line(self, values):
+        self.write(format_line(values))
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.emit("".join(self.parts))
+            self.parts = []
+            self.size = 0
+
+    def emit(self, text):
+        fp = sys.stdout if self.fp is None else self.fp
+        fp.write(text)
+
+    def close(self):
+        self.flush()
+
+class StreamSink(OutputSink):
+    # An OutputSink that closes its file when it is closed
+    def close(self):
+        super().close()
+        if self.fp is not None and self.fp is not sys.stdout:
+            self.fp.close()
+
+class BufferSink(OutputSink):
+    def __init__(self, buffer_size=1 << 16):
+        super().__init__(buffer_size=buffer_size)
+        self.chunks = []
+
+    def emit(self, text):
+        self.chunks.append(text)
+
+    def getvalue(self):
+        self.flush()
+        return "".join(self.chunks)
+
+class NullSink(OutputSink):
+    def write_line(self, values):
+        pass
+
+    def write(self, text):
+        pass
+
+    def emit(self, text):
+        pass
+
+def open_sink(path):
+    if path is None or path == '-':
+        return StreamSink()
+
+    return StreamSink(open(path, 'w'))
+
+class AsyncSink:
+    # Output for the asyncio runner: text is handed to a coroutine function
+    # as it is written, e.g. one that sends it down a websocket.
+    def __init__(self, send):
+        self.send = send
+
+    async def write_line(self, values):
+        await self.send(format_line(values))
+
+    async def write(self, text):
+        await self.send(text)
+
+    async def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class ConsoleInput:
+    # Interactive input: prompts go to the terminal and bad values are asked
+    # for again.
+    def read_line(self, prompt, where=None):
+        try:
+            return input(prompt)
+        except EOFError:
+            raise PseudoEOFError(where, "End of input")
+
+    def retry(self, prompt, expected, value, where=None):
+        print("Please enter {}.".format(expected))
+        return self.read_line(prompt, where)
+
+class LineInput:
+    # Input from a list or iterator of lines, e.g. a whole input file read at
+    # once. Prompts are dropped unless a prompt stream is given, and a value
+    # of the wrong type is an error rather than a retry.
+    def __init__(self, lines, prompt_fp=None):
+        self.lines = iter(lines)
+        self.prompt_fp = prompt_fp
+
+    def read_line(self, prompt, where=None):
+        if self.prompt_fp is not None:
+            self.prompt_fp.write(prompt)
+
+        try:
+            line = next(self.lines)
+        except StopIteration:
+            raise PseudoEOFError(where, "End of input")
+
+        if self.prompt_fp is not None:
+            self.prompt_fp.write(line + '\n')
+
+        return line
+
+    def retry(self, prompt, expected, value, where=None):
+        raise PseudoTypeError(where, "Invalid input '{}', expected {}".format(value, expected))
+
+class QueueInput:
+    # Input for the asyncio runner, fed a line at a time by whoever hosts the
+    # session; close() ends the input. Prompts and requests to retry a bad
+    # value go to the prompt coroutine function if there is one, otherwise a
+    # bad value is an error as with LineInput.
+    def __init__(self, prompt=None):
+        import asyncio
+        self.queue = asyncio.Queue()
+        self.prompt = prompt
+
+    def feed(self, line):
+        self.queue.put_nowait(line)
+
+    def close(self):
+        self.queue.put_nowait(None)
+
+    async def read_line(self, prompt, where=None):
+        if self.prompt is not None:
+            await self.prompt(prompt)
+
+        line = await self.queue.get()
+        if line is None:
+            # stays closed for any later reads
+            self.queue.put_nowait(None)
+            raise PseudoEOFError(where, "End of input")
+
+        return line
+
+    async def retry(self, prompt, expected, value, where=None):
+        if self.prompt is None:
+            raise PseudoTypeError(where, "Invalid input '{}', expected {}".format(value, expected))
+
+        await self.prompt("Please enter {}.\n".format(expected))
+        return await self.read_line(prompt, where)
+
+# read and write buffer of files opened by programs
+FILE_BUFFER = 1 << 20
+
+class PseudoFile:
+    # A file opened by a program, read or written a line at a time through a
+    # large buffer. Lines are read without their line ending. files is the
+    # set of the run's open files, which it leaves once closed.
+    def __init__(self, path, mode, files=None):
+        self.path = path
+        self.mode = mode
+        self.fp = open(path, mode, buffering=FILE_BUFFER, newline='')
+        # a line read ahead by at_end
+        self.pending = None
+        self.files = files
+        if files is not None:
+            files.add(self)
+
+    def _check(self, mode, where):
+        if self.fp.closed:
+            raise PseudoTypeError(where, "File {} is closed".format(self.path))
+
+        if (self.mode == 'r') != (mode == 'r'):
+            raise PseudoTypeError(where, "File {} is not open for {}".format(self.path,
+                    "reading" if mode == 'r' else "writing"))
+
+    def _next(self):
+        if self.pending is not None:
+            line, self.pending = self.pending, None
+            return line
+
+        return self.fp.readline()
+
+    def at_end(self, where=None):
+        self._check('r', where)
+        if self.pending is None:
+            self.pending = self.fp.readline()
+
+        return self.pending == ''
+
+    def read_line(self, where=None):
+        # None at the end of the file
+        self._check('r', where)
+        line = self._next()
+        if not line:
+            return None
+
+        return _strip_eol(line)
+
+    def lines(self, where=None, close=False):
+        self._check('r', where)
+        try:
+            if self.pending:
+                yield _strip_eol(self._next())
+
+            for line in self.fp:
+                yield _strip_eol(line)
+
+        finally:
+            if close:
+                self.close()
+
+    def write(self, text, where=None):
+        self._check('w', where)
+        self.fp.write(text)
+
+    def close(self):
+        self.fp.close()
+        if self.files is not None:
+            self.files.discard(self)
+            self.files = None
+
+    def __str__(self):
+        return "<file {}>".format(self.path)
+
+def _strip_eol(line):
+    if line.endswith('\n'):
+        line = line[:-1]
+    if line.endswith('\r'):
+        line = line[:-1]
+
+    return line
+
+def open_file(state, path, mode, where=None):
+    # files are kept in the run's state, which closes them when the run ends;
+    # runs without a file table may not use files
+    if state.files is None:
+        raise PseudoTypeError(where, "Files cannot be used in this run")
+
+    if mode not in ('r', 'w', 'a'):
+        raise PseudoTypeError(where, "File mode must be 'r', 'w' or 'a'")
+
+    try:
+        return PseudoFile(str(path), mode, state.files)
+    except OSError as e:
+        raise PseudoRuntimeError(where, "Cannot open {}: {}".format(path, e.strerror))
+
+def open_input(path, prompt_fp=None):
+    if path == '-':
+        return LineInput(sys.stdin.read().splitlines(), prompt_fp)
+
+    with open(path) as fp:
+        return LineInput(fp.read().splitlines(), prompt_fp)
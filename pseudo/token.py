@@ -43,10 +43,27 @@ ASSIGN_OPERATORS = (':=', '=', '<-')
 
 KEYWORDS = "BEGIN", "END", "FOR", "TO", "WHILE", "THEN", "MODULE", "PROGRAM", "IF", "ELSE", "DO", "NEXT", "REPEAT", "OUTPUT", "INPUT", "PRINT", "BREAK", "CONTINUE", "RETURN", "RUN", "IS", "NOT", "INTEGER", "FLOAT", "REAL", "STRING", "INT", "NUMBER", "PARAM"
 
+# Words that are only keywords where they start what they name, so programs
+# can still use them as names: IMPORT before a path, PARALLEL before FOR and
+# EACH after FOR. The patterns are matched against the rest of the line.
+CONTEXT_KEYWORDS = {
+    "IMPORT": re.compile(r'[ \t]*["\']'),
+    "PARALLEL": re.compile(r'[ \t]+FOR\b', re.I),
+    "EACH": re.compile(r'[ \t]+[a-zA-Z_]'),
+}
+
 class ParseError(Exception):
+    # row_col is where the error is (None when it is not known) and message
+    # the error without its location
     def __init__(self, ctx, msg):
-        msg = ctx.get_context()[0] + msg
-        super().__init__(msg)
+        context = ctx.get_context()
+        if isinstance(context, tuple):
+            context, self.row_col = context
+        else:
+            self.row_col = None
+
+        self.message = msg
+        super().__init__(context + msg)
 
 class ParseExpected(ParseError):
     def __init__(self, ctx, expected, got=None):
@@ -72,6 +89,15 @@ class PseudoTypeError(PseudoRuntimeError):
 class PseudoNameError(PseudoRuntimeError):
     pass
 
+class PseudoIndexError(PseudoRuntimeError):
+    pass
+
+class PseudoLimitError(PseudoRuntimeError):
+    pass
+
+class PseudoEOFError(PseudoRuntimeError):
+    pass
+
 class PseudoFlowControl(Exception):
     def __init__(self, ctx):
         super().__init__(ctx)
@@ -99,12 +125,19 @@ def keyword_eq(token1, token2):
     return token1.value.upper() == token2.value.upper()
 
 class Tokeniser:
-    def __init__(self, name):
+    def __init__(self, name, number=float):
         self.name = name
+        self.number = number
+        # where IMPORT paths are relative to, see imports.enable
+        self.directory = None
+        self.origin = None
+        self.importer = None
         self.reset()
 
     def reset(self):
         self.lines = []
+        # the row of lines[0]; streaming tokenisers drop lines they are done with
+        self.first_row = 1
         self.row = 1
         self.col = 1
         self.level = 1
@@ -135,6 +168,23 @@ class Tokeniser:
         while len(self._ready_ctx) > idx:
             self._ready_ctx.pop()
 
+    def line(self, row):
+        index = row - self.first_row
+        if 0 <= index < len(self.lines):
+            return self.lines[index]
+
+        return ""
+
+    def last_row(self):
+        return self.first_row + len(self.lines) - 1
+
+    def load(self, row):
+        # makes the line at row available unless the source ends before it
+        pass
+
+    def discard(self):
+        pass
+
     def raw_context(self):
         if self._peek_token_row_col is not None:
             return self._peek_token_row_col
@@ -149,9 +199,10 @@ class Tokeniser:
         else:
             row, col = self.raw_context()
 
-        if row > len(self.lines):
+        self.load(row)
+        if row > self.last_row():
             row = row-1
-            col = len(self.lines[row-1])+1
+            col = len(self.line(row))+1
 
         if row < 1:
             return "File {}: \n".format(self.name)
@@ -160,7 +211,7 @@ class Tokeniser:
             return "File {}, line {}: \n".format(self.name, row)
 
         ctx += "File {}, line {}, column {}: \n".format(self.name, row, col)
-        ctx += self.lines[row-1] + "\n"
+        ctx += self.line(row) + "\n"
         ctx += "{}^\n".format(' ' * (col-1))
         return ctx, (row, col)
 
@@ -204,6 +255,19 @@ class Tokeniser:
 
         return res[:-1]
 
+    def rest_of_line(self):
+        # the rest of the line from the character the lexer has peeked at
+        if self._peek in (None, '\n'):
+            return self._peek or ''
+
+        return self._peek + self.line(self.row)[self.col-1:]
+
+    def _context_keyword(self, word, last):
+        if word == "EACH" and last != Token('keyword', 'FOR'):
+            return False
+
+        return CONTEXT_KEYWORDS[word].match(self.rest_of_line()) is not None
+
     def _parse_string_escapes(self, string):
         i = 0
         res = ""
@@ -239,7 +303,9 @@ class Tokeniser:
 
     def __iter__(self):
         c = self.peek()
+        last = None
         while c:
+            res = None
 
             if COMMENT_RE.match(c):
                 self.consume(while_re=COMMENT_RE)
@@ -247,7 +313,7 @@ class Tokeniser:
             elif ENDLINE_RE.match(c):
                 self.char()
                 #self.consume(while_re=ENDLINE_RE)
-                yield Token('eol', '')
+                res = Token('eol', '')
 
             elif WHITESPACE_RE.match(c):
                 self.consume(while_re=WHITESPACE_RE)
@@ -255,24 +321,29 @@ class Tokeniser:
             elif c in ('"', "'"):
                 string = self._parse_string_escapes(self.consume(until_re=STRING_RE)[1:])
                 self.char() # consume end of string
-                yield Token('string', string)
+                res = Token('string', string)
 
             elif NUMBER_RE.match(c):
                 num = self.consume(while_re=NUMBER_RE)
-                yield Token('number', float(num))
+                res = Token('number', self.number(num))
 
             elif OPERATOR_RE.match(c):
-                yield Token('operator', self.consume(while_re=OPERATOR_RE))
+                res = Token('operator', self.consume(while_re=OPERATOR_RE))
 
             elif IDENTIFIER_RE.match(c):
                 ident = self.consume(while_re=IDENTIFIER_RE)
-                if ident.upper() in KEYWORDS:
-                    yield Token('keyword', ident.upper())
+                word = ident.upper()
+                if word in KEYWORDS or (word in CONTEXT_KEYWORDS and self._context_keyword(word, last)):
+                    res = Token('keyword', word)
                 else:
-                    yield Token('identifier', ident)
+                    res = Token('identifier', ident)
 
             else:
-                yield Token('symbol', self.char())
+                res = Token('symbol', self.char())
+
+            if res is not None:
+                last = res
+                yield res
 
             c = self.peek()
 
@@ -306,8 +377,8 @@ class Tokeniser:
             raise EOFError from e
 
 class FileTokeniser(Tokeniser):
-    def __init__(self, fp, filename='<stream>'):
-        super().__init__(filename)
+    def __init__(self, fp, filename='<stream>', number=float):
+        super().__init__(filename, number)
         self.fp = fp
         self.lines = re.compile(r'\r?\n').split(fp.read())
 
@@ -325,9 +396,59 @@ class FileTokeniser(Tokeniser):
         self.col += 1
         return c
 
+class StreamTokeniser(Tokeniser):
+    # Reads the file a line at a time. discard() drops the lines before the
+    # current token, which the parser calls between top-level statements once
+    # they have run, so only the lines of the statement being parsed are kept.
+    def __init__(self, fp, filename='<stream>', number=float):
+        super().__init__(filename, number)
+        self.fp = fp
+        self.more = True
+
+    def reset(self):
+        super().reset()
+        # after a parse error the rest of the file is skipped, as it is when
+        # the whole file is read at once
+        self.more = False
+
+    def load(self, row):
+        while self.more and row > self.last_row():
+            line = self.fp.readline()
+            if line.endswith('\n'):
+                line = line[:-1]
+            else:
+                # no line break, so this is the last line (as when splitting)
+                self.more = False
+
+            if line.endswith('\r'):
+                line = line[:-1]
+
+            self.lines.append(line)
+
+    def discard(self):
+        row = self.raw_context()[0] - 1
+        if row > self.first_row:
+            del self.lines[:row - self.first_row]
+            self.first_row = row
+
+    def _get_char(self):
+        self.load(self.row)
+        if self.row > self.last_row():
+            return None
+
+        line = self.line(self.row)
+        if self.col > len(line):
+            self.row += 1
+            self.col = 1
+            return '\n'
+
+        c = line[self.col-1]
+        self.col += 1
+        return c
+
 class REPLTokeniser(Tokeniser):
-    def __init__(self):
-        super().__init__("<repl>")
+    def __init__(self, number=float):
+        super().__init__("<repl>", number)
 
     def _get_char(self):
         while self.row > len(self.lines):
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+
+import sys
+import csv
+import json
+import struct
+import argparse
+
+from .version import APP_NAME
+from .token import Token
+from .types import Fixed, flatten
+from .expr import Expression, VariableReference
+from .code import traced
+from .context import Context, format_trace_table
+
+TRACE_FORMATS = ('table', 'csv', 'jsonl', 'text', 'binary')
+TRACE_COLUMNS = ('call', 'context', 'line', 'name', 'value')
+
+def _plain_value(token):
+    value = flatten(token.value)
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+
+    return str(value)
+
+class TraceWriter:
+    # Collects formatted rows and writes them to the file in large chunks,
+    # so tracing does not keep any rows once they have been written.
+    def __init__(self, fp, buffer_rows=1024):
+        self.fp = fp
+        self.buffer_rows = buffer_rows
+        self.buffer = []
+        self.calls = 0
+        self.write_header()
+
+    def next_call(self, name=None):
+        self.calls += 1
+        return self.calls
+
+    def write_header(self):
+        pass
+
+    def format_row(self, call, context, line, name, value):
+        # by default a tab separated line of the TRACE_COLUMNS
+        fields = (call, context, line, name, _plain_value(value))
+        return "\t".join('' if field is None else str(field) for field in fields) + '\n'
+
+    def write(self, text):
+        self.buffer.append(text)
+        if len(self.buffer) >= self.buffer_rows:
+            self.flush()
+
+    def row(self, call, context, pos, name, value):
+        line = pos[0] if pos else None
+        self.write(self.format_row(call, context, line, name, value))
+
+    def conditional(self, call, context, pos, cond, truth):
+        self.row(call, context, pos, cond, Token('symbol', 'true' if truth else 'false'))
+
+    def flush(self):
+        if self.buffer:
+            self.fp.write("".join(self.buffer))
+            self.buffer = []
+
+        self.fp.flush()
+
+    def close(self):
+        self.flush()
+
+class CSVTraceWriter(TraceWriter):
+    def write_header(self):
+        # the csv writer hands each formatted row back to self.write()
+        self.csv = csv.writer(self, lineterminator='\n')
+        self.csv.writerow(TRACE_COLUMNS)
+
+    def row(self, call, context, pos, name, value):
+        self.csv.writerow((call, context, pos[0] if pos else None, name, _plain_value(value)))
+
+class JSONTraceWriter(TraceWriter):
+    def format_row(self, call, context, line, name, value):
+        return json.dumps(dict(zip(TRACE_COLUMNS, (call, context, line, name, _plain_value(value))))) + '\n'
+
+class TextTraceWriter(TraceWriter):
+    def write_header(self):
+        self.write("{:>6} {:>6}  {:<32} {}\n".format("Call", "Line", "Context", "Name = Value"))
+
+    def format_row(self, call, context, line, name, value):
+        return "{:>6} {:>6}  {:<32.32} {} = {}\n".format(call, '' if line is None else line,
+                context or '', name, _plain_value(value))
+
+# Binary trace log: a header followed by records, each starting with a tag
+# byte. Names (variables, conditions and contexts) are interned and then
+# referred to by number, and integers are written as varints.
+BINARY_MAGIC = b'PSTRACE\x01'
+
+REC_NAME = 1    # name id, string
+REC_CALL = 2    # call id, context name id (0 if unnamed)
+REC_SET = 3     # call id, line + 1 (0 if unknown), name id, value
+REC_COND = 4    # call id, line + 1, condition name id, 0 or 1
+
+VAL_NONE = 0
+VAL_FLOAT = 1   # 8 byte little endian double
+VAL_INT = 2     # zigzag varint
+VAL_STRING = 3  # length, utf-8 bytes
+VAL_FIXED = 4   # zigzag varint raw value, places
+VAL_OTHER = 5   # display text, as VAL_STRING
+
+_DOUBLE = struct.Struct('<d')
+
+def _varint(buf, n):
+    while n >= 0x80:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+
+    buf.append(n)
+
+def _zigzag(n):
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+def _unzigzag(n):
+    return n // 2 if not n & 1 else -(n + 1) // 2
+
+class BinaryTraceWriter(TraceWriter):
+    def __init__(self, fp, buffer_bytes=1 << 16):
+        self.names = {None: 0}
+        super().__init__(fp, buffer_bytes)
+
+    def write_header(self):
+        self.buffer = bytearray(BINARY_MAGIC)
+
+    def _name(self, name):
+        try:
+            return self.names[name]
+        except KeyError:
+            id_ = self.names[name] = len(self.names)
+            data = name.encode('utf-8')
+            buf = self.buffer
+            buf.append(REC_NAME)
+            _varint(buf, id_)
+            _varint(buf, len(data))
+            buf += data
+            return id_
+
+    def _value(self, buf, value):
+        value = flatten(value)
+        if value is None:
+            buf.append(VAL_NONE)
+
+        elif type(value) is float:
+            buf.append(VAL_FLOAT)
+            buf += _DOUBLE.pack(value)
+
+        elif type(value) is int or type(value) is bool:
+            buf.append(VAL_INT)
+            _varint(buf, _zigzag(int(value)))
+
+        elif type(value) is Fixed:
+            buf.append(VAL_FIXED)
+            _varint(buf, _zigzag(value.raw))
+            _varint(buf, value.places)
+
+        else:
+            buf.append(VAL_STRING if isinstance(value, str) else VAL_OTHER)
+            data = str(value).encode('utf-8')
+            _varint(buf, len(data))
+            buf += data
+
+    def next_call(self, name=None):
+        call = super().next_call()
+        name_id = self._name(name)
+        self.buffer.append(REC_CALL)
+        _varint(self.buffer, call)
+        _varint(self.buffer, name_id)
+        return call
+
+    def _event(self, tag, call, pos, name):
+        name_id = self.names.get(name)
+        if name_id is None:
+            name_id = self._name(name)
+
+        line = pos[0] + 1 if pos else 0
+        buf = self.buffer
+        if call < 0x80 and line < 0x80 and name_id < 0x80:
+            buf += bytes((tag, call, line, name_id))
+
+        else:
+            buf.append(tag)
+            _varint(buf, call)
+            _varint(buf, line)
+            _varint(buf, name_id)
+
+        return buf
+
+    def row(self, call, context, pos, name, value):
+        buf = self._event(REC_SET, call, pos, name)
+        value = value.value
+        if type(value) is float:
+            buf.append(VAL_FLOAT)
+            buf += _DOUBLE.pack(value)
+        else:
+            self._value(buf, value)
+        if len(buf) >= self.buffer_rows:
+            self.flush()
+
+    def conditional(self, call, context, pos, cond, truth):
+        buf = self._event(REC_COND, call, pos, cond)
+        buf.append(1 if truth else 0)
+        if len(buf) >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.fp.write(self.buffer)
+            self.buffer = bytearray()
+
+        self.fp.flush()
+
+class TraceReader:
+    def __init__(self, fp, chunk_size=1 << 16):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.data = b''
+        self.pos = 0
+        self.contexts = {}
+
+        if self._bytes(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError("Not a pseudo binary trace")
+
+    def _fill(self, n):
+        if self.pos + n > len(self.data):
+            self.data = self.data[self.pos:] + self.fp.read(max(n, self.chunk_size))
+            self.pos = 0
+
+        return self.pos + n <= len(self.data)
+
+    def _byte(self):
+        if not self._fill(1):
+            raise EOFError
+
+        self.pos += 1
+        return self.data[self.pos-1]
+
+    def _bytes(self, n):
+        if not self._fill(n):
+            raise ValueError("Truncated trace")
+
+        self.pos += n
+        return self.data[self.pos-n : self.pos]
+
+    def _varint(self):
+        shift = res = 0
+        while True:
+            b = self._byte()
+            res |= (b & 0x7f) << shift
+            if not b & 0x80:
+                return res
+
+            shift += 7
+
+    def _value(self):
+        tag = self._byte()
+        if tag == VAL_NONE:
+            return Token('symbol', None)
+
+        elif tag == VAL_FLOAT:
+            return Token('number', _DOUBLE.unpack(self._bytes(8))[0])
+
+        elif tag == VAL_INT:
+            return Token('number', _unzigzag(self._varint()))
+
+        elif tag == VAL_FIXED:
+            raw = _unzigzag(self._varint())
+            return Token('number', Fixed(raw, self._varint()))
+
+        text = self._bytes(self._varint()).decode('utf-8')
+        return Token('string' if tag == VAL_STRING else 'symbol', text)
+
+    def __iter__(self):
+        # yields (call, context, line, name, value) for every traced event
+        names = {0: None}
+        contexts = self.contexts
+        while True:
+            try:
+                tag = self._byte()
+            except EOFError:
+                return
+
+            if tag == REC_NAME:
+                id_ = self._varint()
+                names[id_] = self._bytes(self._varint()).decode('utf-8')
+
+            elif tag == REC_CALL:
+                call = self._varint()
+                contexts[call] = names[self._varint()]
+
+            elif tag in (REC_SET, REC_COND):
+                call = self._varint()
+                line = self._varint() - 1
+                name = names[self._varint()]
+                if tag == REC_SET:
+                    value = self._value()
+                else:
+                    value = Token('symbol', 'true' if self._byte() else 'false')
+
+                yield call, contexts.get(call), line if line >= 0 else None, name, value
+
+            else:
+                raise ValueError("Corrupt trace record {}".format(tag))
+
+TRACE_WRITERS = {
+    'csv': CSVTraceWriter,
+    'jsonl': JSONTraceWriter,
+    'text': TextTraceWriter,
+    'binary': BinaryTraceWriter
+}
+
+def _variables(node, names):
+    if isinstance(node, VariableReference):
+        names.add(node.name)
+
+    elif isinstance(node, Expression):
+        for value in vars(node).values():
+            for child in (value if isinstance(value, (list, tuple)) else (value,)):
+                if isinstance(child, Expression):
+                    _variables(child, names)
+
+    return names
+
+class TraceFilter:
+    # Decides which events are traced, before any value is formatted. Scopes
+    # are checked once per call, names and lines per event, and sampling and
+    # limits only for events that pass the other filters.
+    def __init__(self, names=None, scopes=None, lines=None, every=1, limit=None):
+        self.names = frozenset(names) if names else None
+        self.scopes = frozenset(scopes) if scopes else None
+        self.lines = list(lines) if lines else None
+        self.every = every
+        self.limit = limit
+
+        self.seen = 0
+        self.conditions = {}
+
+    def scope(self, scope):
+        return self.scopes is None or scope in self.scopes
+
+    def accept(self, ctx, pos):
+        if self.lines is not None:
+            row = pos[0] if pos else None
+            if row is None or not any(low <= row <= high for low, high in self.lines):
+                return False
+
+        if self.limit is not None and ctx.trace_count >= self.limit:
+            return False
+
+        if self.every > 1:
+            self.seen += 1
+            if (self.seen - 1) % self.every:
+                return False
+
+        ctx.trace_count += 1
+        return True
+
+    def accept_var(self, ctx, name, pos):
+        if self.names is not None and name not in self.names:
+            return False
+
+        return self.accept(ctx, pos)
+
+    def accept_conditional(self, ctx, cond, pos):
+        if self.names is not None:
+            # a condition is traced if it reads one of the traced variables
+            try:
+                wanted = self.conditions[cond]
+            except KeyError:
+                wanted = self.conditions[cond] = bool(_variables(cond, set()) & self.names)
+
+            if not wanted:
+                return False
+
+        return self.accept(ctx, pos)
+
+def line_range(text):
+    low, sep, high = text.partition('-')
+    try:
+        low = int(low)
+        high = int(high) if sep else low
+
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid line range: '{}'".format(text))
+
+    return low, high
+
+class StreamTraceContext(Context):
+    parallel = False
+
+    def __init__(self, writer, name=None, number=float, modules=None, programs=None,
+            trace_filter=None, scope=None, state=None):
+        super().__init__(number, modules, programs, state)
+        self.writer = writer
+        self.name = name
+        self.call = writer.next_call(name)
+
+        self.trace_filter = trace_filter
+        self.trace_count = 0
+        self.traced = trace_filter is None or trace_filter.scope(scope)
+
+    def child_context(self, name, scope=None):
+        return StreamTraceContext(self.writer, name, self.number, self.modules, self.programs,
+                self.trace_filter, scope, self.state)
+
+    def trace_var(self, name, value, ctx=None, pos=None):
+        self.set_var(name, value, ctx)
+
+        if self.traced and (self.trace_filter is None or self.trace_filter.accept_var(self, name, pos)):
+            self.writer.row(self.call, self.name, pos, name, value)
+
+    def trace_conditional(self, cond, value, pos=None):
+        if self.traced and (self.trace_filter is None or self.trace_filter.accept_conditional(self, cond, pos)):
+            self.writer.conditional(self.call, self.name, pos, str(cond), value.value)
+
+    def prepare(self, node):
+        return traced(node)
+
+    def finish_trace(self, fp):
+        self.writer.close()
+
+RENDER_FORMATS = ('table', 'csv', 'jsonl', 'text', 'timeline')
+
+def render_table(events, out):
+    traces = {}
+    for call, context, line, name, value in events:
+        traces.setdefault(call, []).append(((line, None), name, value))
+
+    # calls are numbered as they start, which is the order TraceContext
+    # writes its nested tables in
+    for call, context in sorted(events.contexts.items()):
+        out.write(format_trace_table(context, traces.get(call)))
+
+def render_timeline(events, out):
+    timelines = {}
+    for call, context, line, name, value in events:
+        timelines.setdefault(name, []).append((call, context, line, value))
+
+    for name, timeline in timelines.items():
+        out.write(name + '\n')
+        for call, context, line, value in timeline:
+            out.write("  {:>6} {:>6}  {:<32.32} {}\n".format(call, '' if line is None else line,
+                    context or '', _plain_value(value)))
+
+        out.write('\n')
+
+def render_rows(events, out, trace_format):
+    writer = TRACE_WRITERS[trace_format](out)
+    for call, context, line, name, value in events:
+        writer.row(call, context, (line, None) if line is not None else None, name, value)
+
+    writer.close()
+
+def render_main(argv):
+    parser = argparse.ArgumentParser(prog="{} trace-render".format(APP_NAME),
+            description="Render a binary trace written with --trace-format binary.")
+
+    parser.add_argument("trace_file", type=argparse.FileType('rb'),
+            help="Binary trace file to render.")
+
+    parser.add_argument("-f", "--format", choices=RENDER_FORMATS, default='table',
+            help="Output layout: trace tables per call (default), csv, jsonl or text rows, "
+                 "or a timeline of values per variable.")
+
+    parser.add_argument("-o", "--output", type=argparse.FileType('w'), default=sys.stdout,
+            help="Write the rendered trace to the given file instead of standard output.")
+
+    args = parser.parse_args(argv)
+
+    try:
+        events = TraceReader(args.trace_file)
+        if args.format == 'table':
+            render_table(events, args.output)
+
+        elif args.format == 'timeline':
+            render_timeline(events, args.output)
+
+        else:
+            render_rows(events, args.output, args.format)
+
+    except ValueError as e:
+        parser.exit(1, "{}: {}\n".format(args.trace_file.name, e))
+
+    finally:
+        args.output.flush()
@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+
+import re
+import math
+import operator
+from array import array
+from fractions import Fraction
+from functools import partial
+
+from .token import Token, PseudoTypeError, PseudoIndexError
+
+# Concatenations producing strings at least this long switch to a Rope.
+ROPE_THRESHOLD = 256
+
+def box(value):
+    if isinstance(value, Token):
+        return value
+    elif isinstance(value, (int, float, Fixed)):
+        return Token('number', value)
+    elif value is None:
+        return Token('symbol', None)
+    elif isinstance(value, PseudoArray):
+        return Token('array', value)
+    elif isinstance(value, PseudoMap):
+        return Token('map', value)
+    elif isinstance(value, Rope):
+        return Token('string', value)
+    else:
+        return Token('string', str(value))
+
+class PseudoArray:
+    # Arrays holding only (float) numbers are kept in a dense array('d');
+    # anything else degrades the storage to a plain list of tokens.
+    def __init__(self, tokens=()):
+        tokens = list(tokens)
+        if all(t.type == 'number' and type(t.value) is float for t in tokens):
+            self.items = array('d', [t.value for t in tokens])
+        else:
+            self.items = tokens
+
+    @classmethod
+    def filled(cls, size, value):
+        res = cls()
+        if value.type == 'number' and type(value.value) is float:
+            res.items = array('d', [value.value]) * size
+        else:
+            res.items = [value] * size
+
+        return res
+
+    @property
+    def typed(self):
+        return isinstance(self.items, array)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _index(self, index, ctx=None):
+        if index.type != 'number':
+            raise PseudoTypeError(ctx, "Array index must be a number, not {}".format(index.type))
+
+        i = index.value
+        if isinstance(i, float) and not math.isfinite(i) or i != int(i):
+            raise PseudoTypeError(ctx, "Array index must be an integer")
+
+        i = int(i)
+        if not 0 <= i < len(self.items):
+            raise PseudoIndexError(ctx, "Array index {} out of range".format(i))
+
+        return i
+
+    def get(self, index, ctx=None):
+        i = self._index(index, ctx)
+        if self.typed:
+            return Token('number', self.items[i])
+
+        return self.items[i]
+
+    def set(self, index, value, ctx=None):
+        i = self._index(index, ctx)
+        if self.typed:
+            if value.type == 'number' and type(value.value) is float:
+                self.items[i] = value.value
+                return
+
+            self.items = self.tokens()
+
+        self.items[i] = value
+
+    def fill(self, value):
+        self.items = PseudoArray.filled(len(self.items), value).items
+
+    def tokens(self):
+        if self.typed:
+            return [Token('number', v) for v in self.items]
+
+        return list(self.items)
+
+    def numbers(self, ctx=None):
+        if self.typed:
+            return self.items
+
+        for token in self.items:
+            if token.type != 'number':
+                raise PseudoTypeError(ctx, "Array contains {} elements".format(token.type))
+
+        return [token.value for token in self.items]
+
+    def sort(self, ctx=None):
+        if self.typed:
+            self.items = array('d', sorted(self.items))
+            return
+
+        types = set(token.type for token in self.items)
+        if len(types) > 1 or not types <= {'number', 'string'}:
+            raise PseudoTypeError(ctx, "Cannot sort array of {}".format(", ".join(sorted(types))))
+
+        self.items.sort(key=lambda token: flatten(token.value))
+
+    def __iter__(self):
+        return iter(self.tokens())
+
+    def __eq__(self, other):
+        if not isinstance(other, PseudoArray):
+            return NotImplemented
+
+        return self.tokens() == other.tokens()
+
+    def __str__(self):
+        return "[{}]".format(", ".join(map(_format_element, self.tokens())))
+
+    def __repr__(self):
+        return "PseudoArray({})".format(self)
+
+class PseudoMap:
+    # Entries are keyed by the raw key value (a float or str), so lookups are
+    # a single dict access; the key token is rebuilt with box() when needed.
+    def __init__(self, pairs=()):
+        self.entries = {}
+        for key, value in pairs:
+            self.set(key, value)
+
+    def _key(self, key, ctx=None):
+        if key.type not in ('number', 'string'):
+            raise PseudoTypeError(ctx, "Map key must be a number or string, not {}".format(key.type))
+
+        return flatten(key.value)
+
+    def get(self, key, ctx=None):
+        try:
+            return self.entries[self._key(key, ctx)]
+        except KeyError:
+            raise PseudoIndexError(ctx, "Key {} not in map".format(_format_element(key)))
+
+    def set(self, key, value, ctx=None):
+        self.entries[self._key(key, ctx)] = value
+
+    def has(self, key):
+        return flatten(key) in self.entries
+
+    def keys(self):
+        return [box(key) for key in self.entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __eq__(self, other):
+        if not isinstance(other, PseudoMap):
+            return NotImplemented
+
+        return self.entries == other.entries
+
+    def __str__(self):
+        return "{{{}}}".format(", ".join("{}: {}".format(_format_element(box(key)), _format_element(value))
+                for key, value in self.entries.items()))
+
+    def __repr__(self):
+        return "PseudoMap({})".format(self)
+
+class Rope:
+    # A string built by repeated appends. Ropes produced from one another
+    # share a single chunk list, each one seeing only its first `count`
+    # chunks, so appending to the newest rope is O(1) and older values stay
+    # unchanged. The text is only joined when it is actually needed.
+    __slots__ = ('chunks', 'count', 'length', 'flat')
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.count = len(chunks)
+        self.length = sum(map(len, chunks))
+        self.flat = None
+
+    @staticmethod
+    def concat(a, b):
+        if isinstance(b, Rope):
+            b = str(b)
+
+        if isinstance(a, Rope):
+            chunks = a.chunks
+            if len(chunks) != a.count:
+                chunks = chunks[:a.count]
+
+            chunks.append(b)
+            res = Rope.__new__(Rope)
+            res.chunks = chunks
+            res.count = a.count + 1
+            res.length = a.length + len(b)
+            res.flat = None
+            return res
+
+        if len(a) + len(b) >= ROPE_THRESHOLD:
+            return Rope([a, b])
+
+        return a + b
+
+    def __str__(self):
+        if self.flat is None:
+            self.flat = "".join(self.chunks[:self.count])
+            # later appends to this rope start from the joined text
+            self.chunks = [self.flat]
+            self.count = 1
+
+        return self.flat
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(str(self))
+
+    def __eq__(self, other):
+        if isinstance(other, (str, Rope)):
+            return str(self) == str(other)
+
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __repr__(self):
+        return "Rope({!r})".format(str(self))
+
+FIXED_RE = re.compile(r'([+-]?)([0-9]*)(?:\.([0-9]*))?')
+
+def _round_div(n, d):
+    # integer division rounding half to even, as round() does
+    q, r = divmod(n, d)
+    if 2 * r > d or (2 * r == d and q % 2):
+        q += 1
+
+    return q
+
+_SCALES = [10 ** places for places in range(10)]
+
+def fixed_product(a, b, places):
+    # the count of the product of two counts of 10**-places units
+    return _round_div(a * b, _SCALES[places] if places < 10 else 10 ** places)
+
+class Fixed:
+    # An exact decimal number stored as an integer count of 10**-places
+    # units, e.g. Fixed(1250, 2) is 12.50. Addition, subtraction and
+    # comparison are plain integer operations; products and quotients are
+    # rounded (half to even) back to the larger number of places.
+    __slots__ = ('raw', 'places')
+
+    def __init__(self, raw, places):
+        self.raw = raw
+        self.places = places
+
+    @staticmethod
+    def parse(text, places=2):
+        match = FIXED_RE.fullmatch(text.strip())
+        if not match or not (match.group(2) or match.group(3)):
+            value = float(text)
+            if not math.isfinite(value):
+                raise ValueError("cannot represent {!r} as a fixed point number".format(text))
+
+            return Fixed.from_number(value, places)
+
+        sign, whole, frac = match.group(1), match.group(2) or '0', match.group(3) or ''
+        places = max(places, len(frac))
+        raw = int(whole + frac.ljust(places, '0'))
+        return Fixed(-raw if sign == '-' else raw, places)
+
+    @staticmethod
+    def from_number(value, places):
+        if isinstance(value, Fixed):
+            return value
+
+        if isinstance(value, int):
+            return Fixed(value * 10 ** places, places)
+
+        if not math.isfinite(value):
+            raise PseudoTypeError(None, "Cannot represent {} as a fixed point number".format(value))
+
+        return Fixed(round(value * 10 ** places), places)
+
+    def _align(self, other):
+        if not isinstance(other, Fixed):
+            if not isinstance(other, (int, float)):
+                return None
+
+            other = Fixed.from_number(other, self.places)
+
+        if self.places == other.places:
+            return self.raw, other.raw, self.places
+
+        places = max(self.places, other.places)
+        return (self.raw * 10 ** (places - self.places),
+                other.raw * 10 ** (places - other.places), places)
+
+    def __add__(self, other):
+        if type(other) is Fixed and other.places == self.places:
+            return Fixed(self.raw + other.raw, self.places)
+
+        aligned = self._align(other)
+        if aligned is None:
+            return NotImplemented
+
+        a, b, places = aligned
+        return Fixed(a + b, places)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if type(other) is Fixed and other.places == self.places:
+            return Fixed(self.raw - other.raw, self.places)
+
+        aligned = self._align(other)
+        if aligned is None:
+            return NotImplemented
+
+        a, b, places = aligned
+        return Fixed(a - b, places)
+
+    def __rsub__(self, other):
+        aligned = self._align(other)
+        if aligned is None:
+            return NotImplemented
+
+        a, b, places = aligned
+        return Fixed(b - a, places)
+
+    def __mul__(self, other):
+        if type(other) is Fixed and other.places == self.places:
+            a, b, places = self.raw, other.raw, self.places
+        else:
+            aligned = self._align(other)
+            if aligned is None:
+                return NotImplemented
+
+            a, b, places = aligned
+
+        return Fixed(fixed_product(a, b, places), places)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        aligned = self._align(other)
+        if aligned is None:
+            return NotImplemented
+
+        a, b, places = aligned
+        if b == 0:
+            raise ZeroDivisionError("fixed point division by zero")
+
+        if b < 0:
+            a, b = -a, -b
+
+        return Fixed(_round_div(a * 10 ** places, b), places)
+
+    def __rtruediv__(self, other):
+        if not isinstance(other, (int, float)):
+            return NotImplemented
+
+        return Fixed.from_number(other, self.places) / self
+
+    def __neg__(self):
+        return Fixed(-self.raw, self.places)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return Fixed(abs(self.raw), self.places)
+
+    def __bool__(self):
+        return self.raw != 0
+
+    def __int__(self):
+        q = abs(self.raw) // 10 ** self.places
+        return -q if self.raw < 0 else q
+
+    def __floor__(self):
+        return self.raw // 10 ** self.places
+
+    def __ceil__(self):
+        return -(-self.raw // 10 ** self.places)
+
+    def __round__(self, places=None):
+        if places is None:
+            return round(self._fraction())
+
+        if places >= self.places:
+            return self
+
+        return Fixed(_round_div(self.raw, 10 ** (self.places - places)) * 10 ** (self.places - places), self.places)
+
+    def __float__(self):
+        return self.raw / 10 ** self.places
+
+    def _fraction(self):
+        return Fraction(self.raw, 10 ** self.places)
+
+    def _compare(self, other, op):
+        if type(other) is Fixed:
+            if self.places == other.places:
+                return op(self.raw, other.raw)
+
+            a, b, places = self._align(other)
+            return op(a, b)
+
+        if type(other) is int:
+            return op(self.raw, other * 10 ** self.places)
+
+        if isinstance(other, (int, float)):
+            # compare exactly, without rounding the other operand
+            return op(self._fraction(), other)
+
+        return NotImplemented
+
+    def __eq__(self, other):
+        if type(other) is Fixed and other.places == self.places:
+            return self.raw == other.raw
+
+        return self._compare(other, operator.eq)
+
+    def __ne__(self, other):
+        return self._compare(other, operator.ne)
+
+    def __lt__(self, other):
+        if type(other) is Fixed and other.places == self.places:
+            return self.raw < other.raw
+
+        return self._compare(other, operator.lt)
+
+    def __le__(self, other):
+        return self._compare(other, operator.le)
+
+    def __gt__(self, other):
+        if type(other) is Fixed and other.places == self.places:
+            return self.raw > other.raw
+
+        return self._compare(other, operator.gt)
+
+    def __ge__(self, other):
+        return self._compare(other, operator.ge)
+
+    def __hash__(self):
+        return hash(self._fraction())
+
+    def __str__(self):
+        if self.places == 0:
+            return str(self.raw)
+
+        digits = str(abs(self.raw)).rjust(self.places + 1, '0')
+        return "{}{}.{}".format('-' if self.raw < 0 else '', digits[:-self.places], digits[-self.places:])
+
+    def __repr__(self):
+        return "Fixed({!r})".format(str(self))
+
+    def __reduce__(self):
+        return (Fixed, (self.raw, self.places))
+
+def fixed_kind(places):
+    # number parser for the lexer and INPUT in fixed point mode
+    return partial(Fixed.parse, places=places)
+
+def flatten(value):
+    if isinstance(value, Rope):
+        return str(value)
+
+    return value
+
+def _format_element(token):
+    if token.type == 'string':
+        return '"{}"'.format(token.value)
+
+    return str(token.value)
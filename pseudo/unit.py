@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+import io
+import time
+from types import MappingProxyType
+
+from .token import Token, FileTokeniser, ParseError, PseudoRuntimeError, PseudoNameError, PseudoLimitError
+from .code import PseudoModule, PseudoProgram
+from .parse import pseudo_code_element
+from .imports import ImportStatement, enable
+from .context import Context, RunState
+from .limits import Budget
+from .stream import BufferSink, LineInput, resolve
+from .types import fixed_kind
+from . import stdlib
+
+# steps between the asyncio runner giving way to other tasks
+YIELD_STEPS = 1000
+
+class Result:
+    # status is 'ok', 'error' (a runtime error), 'limit' (a limit ran out)
+    # or 'parse_error'; error holds the message for the last three.
+    def __init__(self, status, output='', error=None, seconds=0.0, steps=0):
+        self.status = status
+        self.output = output
+        self.error = error
+        self.seconds = seconds
+        self.steps = steps
+
+    @property
+    def ok(self):
+        return self.status == 'ok'
+
+    def as_dict(self):
+        return dict(status=self.status, output=self.output, error=self.error,
+                seconds=self.seconds, steps=self.steps)
+
+    def __repr__(self):
+        return "Result({!r}, {!r}, error={!r}, seconds={}, steps={})".format(
+                self.status, self.output, self.error, self.seconds, self.steps)
+
+class CompiledUnit:
+    # A parsed source file that can be run any number of times, each run in
+    # a fresh context, also from several threads at once. Parse errors are
+    # kept and reported instead of stopping at the first one, like the
+    # interpreter does when it runs a file.
+    #
+    # The module and program tables are built once and are read-only; runs
+    # only create contexts and a RunState of their own. Pickles hold the
+    # parsed elements only and rebuild the tables when loaded.
+    def __init__(self, name, elements, errors=None, number=float):
+        self.name = name
+        self.elements = elements
+        self.errors = errors or []
+        self.number = number
+        self._link()
+
+    def _link(self):
+        modules = dict(stdlib.modules())
+        programs = {}
+        self.statements = []
+        self.link_errors = []
+
+        for el in self.elements:
+            if isinstance(el, (PseudoModule, PseudoProgram)):
+                table, kind = (modules, 'Module') if isinstance(el, PseudoModule) else (programs, 'Program')
+                if el.name in table:
+                    self.link_errors.append(str(PseudoRuntimeError(el.context,
+                            "{} {} already defined".format(kind, el.name))))
+                table[el.name] = el
+
+            elif isinstance(el, ImportStatement):
+                # the imported files are only scanned here; a file is parsed
+                # when one of its modules is first called
+                try:
+                    imported = el.lazy_modules(self.number)
+                except PseudoRuntimeError as e:
+                    self.link_errors.append(str(e))
+                    continue
+
+                for name, module in imported:
+                    current = modules.get(name)
+                    if getattr(current, 'library', None) is module.library:
+                        continue
+
+                    if name in modules:
+                        self.link_errors.append(str(PseudoRuntimeError(el.context,
+                                "Module {} already defined".format(name))))
+                    modules[name] = module
+
+            else:
+                self.statements.append(el)
+
+        self.modules = MappingProxyType(modules)
+        self.programs = MappingProxyType(programs)
+
+    def __getstate__(self):
+        return dict(name=self.name, elements=self.elements, errors=self.errors, number=self.number)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._link()
+
+    def _context(self, inputs, limits, output, workers, files):
+        # inputs is a list or iterator of input lines (or an input source),
+        # limits the keyword arguments of limits.Budget, workers the number
+        # of processes for PARALLEL FOR (None for one per core) and files
+        # whether the program may open files
+        input_source = inputs if hasattr(inputs, 'read_line') else LineInput(inputs)
+        state = RunState(Budget(**(limits or {})), output, input_source)
+        state.workers = workers
+        if not files:
+            state.files = None
+
+        return Context(self.number, self.modules, self.programs, state)
+
+    def run(self, program=None, inputs=(), limits=None, workers=None, files=True):
+        if self.errors:
+            return Result('parse_error', error="\n".join(self.errors))
+
+        output = BufferSink()
+        ctx = self._context(inputs, limits, output, workers, files)
+
+        status, error = 'ok', None
+        start = time.perf_counter()
+        try:
+            self.execute(ctx, program)
+
+        except (PseudoRuntimeError, RecursionError) as e:
+            status, error = failure(e)
+
+        finally:
+            ctx.state.close_files()
+
+        return Result(status, output.getvalue(), error, round(time.perf_counter() - start, 6),
+                ctx.budget.used)
+
+    async def arun(self, program=None, inputs=(), limits=None, output=None, yield_every=YIELD_STEPS,
+            workers=None, files=True):
+        # The asyncio runner. INPUT awaits the input source and OUTPUT the
+        # sink when they are asynchronous (stream.QueueInput, AsyncSink), and
+        # loops and module calls give way to other tasks every yield_every
+        # steps, so one event loop can run many sessions at once. Output goes
+        # to the result unless a sink is given.
+        if self.errors:
+            return Result('parse_error', error="\n".join(self.errors))
+
+        sink = BufferSink() if output is None else output
+        ctx = self._context(inputs, limits, sink, workers, files)
+        ctx.state.yield_every = yield_every
+
+        status, error = 'ok', None
+        start = time.perf_counter()
+        try:
+            await self.aexecute(ctx, program)
+
+        except (PseudoRuntimeError, RecursionError) as e:
+            status, error = failure(e)
+
+        finally:
+            ctx.state.close_files()
+            await resolve(sink.flush())
+
+        return Result(status, sink.getvalue() if output is None else '', error,
+                round(time.perf_counter() - start, 6), ctx.budget.used)
+
+    def _define(self, ctx):
+        if self.link_errors:
+            raise PseudoRuntimeError(None, "\n".join(self.link_errors))
+
+        if ctx.modules is not self.modules:
+            # a context with tables of its own, e.g. a tracing one that runs
+            # its own variant of each definition
+            for el in self.elements:
+                if isinstance(el, PseudoModule):
+                    ctx.def_module(el.name, ctx.prepare(el), el.context)
+
+                elif isinstance(el, PseudoProgram):
+                    ctx.def_program(el.name, ctx.prepare(el), el.context)
+
+                elif isinstance(el, ImportStatement):
+                    el.define(ctx)
+
+    def _entry(self, ctx, program):
+        if program is None:
+            return entry_point(ctx.programs)
+
+        prog = ctx.get_program(program)
+        if prog is None:
+            raise PseudoNameError(None, "Program {} is not defined".format(program))
+
+        return prog
+
+    def execute_statements(self, ctx):
+        # defines the unit's modules and programs in ctx and runs its
+        # top-level statements, but not a program
+        self._define(ctx)
+
+        for el in self.statements:
+            res = ctx.prepare(el).eval(ctx)
+            if res is not None and res != Token('symbol', None):
+                ctx.output.write(str(res.value) + '\n')
+
+    def execute(self, ctx, program=None):
+        self.execute_statements(ctx)
+
+        prog = self._entry(ctx, program)
+        if prog is not None:
+            return prog.eval(ctx)
+
+    async def aexecute(self, ctx, program=None):
+        if ctx.state.yield_every is None:
+            ctx.state.yield_every = YIELD_STEPS
+
+        self._define(ctx)
+
+        for el in self.statements:
+            res = await ctx.prepare(el).aeval(ctx)
+            if res is not None and res != Token('symbol', None):
+                await resolve(ctx.output.write(str(res.value) + '\n'))
+
+        prog = self._entry(ctx, program)
+        if prog is not None:
+            return await prog.aeval(ctx)
+
+def failure(e):
+    if isinstance(e, PseudoLimitError):
+        return 'limit', str(e)
+
+    elif isinstance(e, RecursionError):
+        return 'error', "Maximum recursion depth exceeded"
+
+    return 'error', str(e)
+
+def entry_point(programs):
+    if not programs:
+        return None
+
+    elif len(programs) == 1:
+        for prog in programs.values():
+            return prog
+
+    elif 'main' in programs:
+        return programs['main']
+
+    raise PseudoRuntimeError(None, "No main entry point among programs {}".format(
+            ", ".join(sorted(programs))))
+
+def compile_file(fp, name=None, number=float, imports=True):
+    # imports is whether the source may IMPORT files, or the
+    # imports.Importer to import them with
+    if name is None:
+        name = getattr(fp, 'name', '<stream>')
+
+    parse_ctx = FileTokeniser(fp, name, number)
+    if imports:
+        enable(parse_ctx, name, None if imports is True else imports)
+    elements = []
+    errors = []
+    while True:
+        try:
+            with parse_ctx.ready_context():
+                elements.append(pseudo_code_element(parse_ctx))
+
+        except EOFError:
+            break
+
+        except ParseError as e:
+            errors.append(str(e))
+            parse_ctx.reset()
+
+        except RecursionError:
+            errors.append(str(ParseError(parse_ctx, "Too deeply nested to parse")))
+            parse_ctx.reset()
+
+    return CompiledUnit(name, elements, errors, number)
+
+def compile_source(text, name='<source>', fixed=None):
+    return compile_file(io.StringIO(text), name, float if fixed is None else fixed_kind(fixed))